@@ -0,0 +1,57 @@
+"""
+Compares calculate_adjacent_periods applied row by row against
+calculate_adjacent_periods_vectorised, and checks that both give the same periods.
+Usage: python benchmarks/adjacent_periods.py [rows ...]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from es_aws_functions import general_functions
+
+periodicities = {"01": range(1, 13), "02": range(1, 13), "03": (3, 6, 9, 12)}
+
+
+def build_periods(rows, months, as_int):
+    years = np.random.randint(1990, 2030, rows)
+    periods = years * 100 + np.random.choice(list(months), rows)
+    return pd.Series(periods if as_int else periods.astype(str))
+
+
+def check_identical():
+    for periodicity, months in periodicities.items():
+        for as_int in (True, False):
+            periods = build_periods(5000, months, as_int)
+            for periods_back in (1, 2, 5):
+                expected = periods
+                for _ in range(periods_back):
+                    expected = expected.apply(
+                        general_functions.calculate_adjacent_periods,
+                        periodicity=periodicity)
+                result = general_functions.calculate_adjacent_periods_vectorised(
+                    periods, periodicity, periods_back)
+                assert list(result) == list(expected), (periodicity, periods_back)
+    print("Vectorised results identical to calculate_adjacent_periods.")
+
+
+def main(sizes):
+    check_identical()
+    print(f"{'rows':>10} {'periodicity':>12} {'apply s':>9} {'vectorised s':>13} "
+          f"{'speedup':>8}")
+    for rows in sizes:
+        for periodicity, months in periodicities.items():
+            periods = build_periods(rows, months, as_int=False)
+            start = time.perf_counter()
+            periods.apply(general_functions.calculate_adjacent_periods,
+                          periodicity=periodicity)
+            scalar = time.perf_counter() - start
+            start = time.perf_counter()
+            general_functions.calculate_adjacent_periods_vectorised(periods, periodicity)
+            vectorised = time.perf_counter() - start
+            print(f"{rows:>10} {periodicity:>12} {scalar:>9.3f} {vectorised:>13.3f} "
+                  f"{scalar / vectorised:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10000, 1000000])
@@ -0,0 +1,59 @@
+"""
+Compares the JSON path against the Parquet and Feather formats for size on S3,
+time to serialise (as in save_to_s3) and time to load (as in read_dataframe_from_s3).
+
+S3 itself is not involved, only the serialisation the library performs.
+Usage: python benchmarks/columnar_formats.py [rows ...]
+"""
+import json
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from es_aws_functions import aws_functions
+
+
+def build_dataframe(rows):
+    return pd.DataFrame({
+        "reference": np.arange(49900000000, 49900000000 + rows),
+        "period": "201809",
+        "region": pd.Categorical((np.arange(rows) % 14).astype(str)),
+        "Q601_asphalting_sand": (np.arange(rows) % 997).astype(float),
+        "Q602_building_soft_sand": np.arange(rows) % 31,
+    })
+
+
+def json_round_trip(dataframe):
+    start = time.perf_counter()
+    data = dataframe.to_json(orient="records")
+    saved = time.perf_counter()
+    loaded = pd.DataFrame(json.loads(data))
+    return len(data.encode("UTF-8")), saved - start, time.perf_counter() - saved, loaded
+
+
+def columnar_round_trip(dataframe, file_extension):
+    start = time.perf_counter()
+    data = aws_functions._to_columnar(dataframe, file_extension)
+    saved = time.perf_counter()
+    loaded = aws_functions._from_columnar(data, file_extension)
+    return len(data), saved - start, time.perf_counter() - saved, loaded
+
+
+def main(sizes):
+    print(f"{'rows':>10} {'format':>9} {'MB':>9} {'save s':>8} {'load s':>8} "
+          f"{'dtypes kept':>12}")
+    for rows in sizes:
+        dataframe = build_dataframe(rows)
+        results = [(".json",) + json_round_trip(dataframe)]
+        for file_extension in aws_functions.columnar_extensions:
+            results.append((file_extension,)
+                           + columnar_round_trip(dataframe, file_extension))
+        for file_extension, size, save, load, loaded in results:
+            kept = loaded.dtypes.equals(dataframe.dtypes)
+            print(f"{rows:>10} {file_extension:>9} {size / 2**20:>9.2f} {save:>8.3f} "
+                  f"{load:>8.3f} {str(kept):>12}")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10000, 1000000, 10000000])
@@ -0,0 +1,77 @@
+"""
+Compares uncompressed, gzip and zstd payloads for size on S3, the time to compress
+and decompress, and the latency of save_to_s3 and read_from_s3 against a moto S3.
+
+Each codec's round trip is checked to return exactly the data that was saved.
+Usage: python benchmarks/compression.py [rows ...]
+"""
+import json
+import sys
+import time
+
+import boto3
+from es_aws_functions import aws_functions
+
+try:
+    from moto import mock_aws as mock_s3
+except ImportError:
+    from moto import mock_s3
+
+bucket_name = "compression-benchmark"
+
+
+def build_payload(rows):
+    return json.dumps([{"reference": 49900000000 + i,
+                        "period": "201809",
+                        "region": str(i % 14),
+                        "Q601_asphalting_sand": float(i % 997),
+                        "Q602_building_soft_sand": i % 31}
+                       for i in range(rows)])
+
+
+def codec_timings(payload, compression):
+    start = time.perf_counter()
+    data = aws_functions._compress(payload, compression)
+    compressed = time.perf_counter()
+    decompressor = aws_functions._decompressor(compression)
+    restored = decompressor.decompress(data) + decompressor.flush()
+    decompressed = time.perf_counter()
+    assert restored.decode("UTF-8") == payload
+    return len(data), compressed - start, decompressed - compressed
+
+
+def s3_timings(payload, compression):
+    file_name = f"payload-{compression}"
+    start = time.perf_counter()
+    aws_functions.save_to_s3(bucket_name, file_name, payload, compression=compression)
+    saved = time.perf_counter()
+    data = aws_functions.read_from_s3(bucket_name, file_name)
+    read = time.perf_counter()
+    assert data == payload
+    return saved - start, read - saved
+
+
+def main(sizes):
+    print(f"{'rows':>10} {'codec':>6} {'MB':>8} {'ratio':>6} {'comp s':>8} "
+          f"{'decomp s':>9} {'save s':>8} {'read s':>8}")
+    with mock_s3():
+        aws_functions.reset_clients()
+        boto3.client("s3", region_name=aws_functions.region).create_bucket(
+            Bucket=bucket_name,
+            CreateBucketConfiguration={"LocationConstraint": aws_functions.region})
+        for rows in sizes:
+            payload = build_payload(rows)
+            raw_size = len(payload.encode("UTF-8"))
+            for compression in (None,) + aws_functions.compression_codecs:
+                if compression:
+                    size, compress, decompress = codec_timings(payload, compression)
+                else:
+                    size, compress, decompress = raw_size, 0.0, 0.0
+                save, read = s3_timings(payload, compression)
+                print(f"{rows:>10} {str(compression):>6} {size / 2**20:>8.2f} "
+                      f"{raw_size / size:>6.1f} {compress:>8.3f} {decompress:>9.3f} "
+                      f"{save:>8.3f} {read:>8.3f}")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10000, 100000, 1000000])
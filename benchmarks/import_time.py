@@ -0,0 +1,68 @@
+"""
+Measures the cold import cost of each public module with python -X importtime, so that
+heavy dependencies creeping back into import time show up. Each import is run in a
+fresh interpreter several times and the median is reported, along with the slowest
+dependencies the import pulled in.
+
+Run from the root of the repository (spp_logger need not be installed, it is only
+imported by get_logger).
+Usage: python benchmarks/import_time.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+modules = [
+    "es_aws_functions.aws_functions",
+    "es_aws_functions.async_aws_functions",
+    "es_aws_functions.exception_classes",
+    "es_aws_functions.general_functions",
+    "es_aws_functions.json_codecs",
+    "es_aws_functions.lazy_import",
+    "es_aws_functions.period_calendar",
+]
+
+# Dependencies that should only be imported when first used.
+heavy_dependencies = ["boto3", "botocore", "numpy", "orjson", "pandas", "pyarrow",
+                      "spp_logger"]
+
+
+def import_times(module):
+    """
+    Imports a module in a new interpreter.
+    :return: Cumulative import time in microseconds of each module imported, or None if
+    the import failed - Type: Dict
+    """
+    environment = dict(os.environ, PYTHONPATH=os.getcwd())
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        stderr=subprocess.PIPE, universal_newlines=True, env=environment)
+    if result.returncode:
+        print(f"{module:>38} import failed: {result.stderr.splitlines()[-1]}")
+        return None
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main(runs):
+    print(f"{'module':>38} {'ms':>8} {'modules':>8}  heavy dependencies imported")
+    for module in modules:
+        results = [import_times(module)]
+        if results[0] is None:
+            continue
+        results += [import_times(module) for _ in range(runs - 1)]
+        total = statistics.median(times[module] for times in results) / 1000
+        heavy = sorted({name.split(".")[0] for name in results[0]} &
+                       set(heavy_dependencies))
+        print(f"{module:>38} {total:>8.1f} {len(results[0]):>8}  "
+              f"{', '.join(heavy) or 'none'}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -0,0 +1,353 @@
+"""
+Benchmarks the aws_functions I/O paths against moto's in-process stand-ins for S3, SQS
+and SNS, across payload sizes, to give a performance baseline to compare changes with.
+
+Each function and payload size is run in a fresh process, so that its peak RSS is its
+own. A warm up call (client creation, first imports) is made before the timed calls.
+For each case the latency percentiles, throughput (payload size / median latency),
+peak RSS and the growth in RSS over the timed calls are reported. Results are written
+as JSON, and can be compared against a previous results file.
+
+moto adds its own overhead, so the figures are for comparing versions of the library
+with each other, not for predicting times against AWS.
+Usage: PYTHONPATH=. python benchmarks/io_paths.py [--sizes 1KB,1MB,100MB,500MB]
+    [--functions read_from_s3,save_to_s3] [--repeat 5] [--output results.json]
+    [--baseline previous.json] [--threshold 10] [--fail-on-regression]
+"""
+import argparse
+import contextlib
+import datetime
+import itertools
+import json
+import math
+import multiprocessing
+import platform
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+bucket_name = "io-paths-benchmark"
+message_group = "benchmark"
+units = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+# The largest message SQS and SNS accept.
+message_limit = 256 * 1024
+
+
+def build_payload(size):
+    """
+    Builds a JSON string of records, of about size bytes.
+    """
+    record = ('{"reference":%d,"period":"201809","region":"%d",'
+              '"Q601_asphalting_sand":%d.0,"Q602_building_soft_sand":%d}')
+    records = max(1, size // len(record % (49900000000, 10, 100, 10)))
+    return "[" + ",".join(record % (49900000000 + i, i % 14, i % 997, i % 31)
+                          for i in range(records)) + "]"
+
+
+def timed(function, *args, **kwargs):
+    start = time.perf_counter()
+    function(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def pointer_message(key):
+    return json.dumps({"bucket": bucket_name, "key": key})
+
+
+def read_from_s3(aws_functions, resources, payload):
+    aws_functions.save_to_s3(bucket_name, "read_from_s3", payload)
+    return lambda: timed(aws_functions.read_from_s3, bucket_name, "read_from_s3")
+
+
+def save_to_s3(aws_functions, resources, payload):
+    return lambda: timed(aws_functions.save_to_s3, bucket_name, "save_to_s3", payload)
+
+
+def save_data(aws_functions, resources, payload):
+    return lambda: timed(aws_functions.save_data, bucket_name, "save_data", payload,
+                         resources["new_queue"](), message_group)
+
+
+def get_data(aws_functions, resources, payload):
+    aws_functions.save_to_s3(bucket_name, "get_data", payload)
+
+    def run():
+        aws_functions.send_sqs_message(resources["queue_url"],
+                                       pointer_message("get_data"), message_group)
+        start = time.perf_counter()
+        receipt_handle = aws_functions.get_data(
+            resources["queue_url"], bucket_name, "get_data", message_group)[1]
+        elapsed = time.perf_counter() - start
+        aws_functions.get_client("sqs").delete_message(
+            QueueUrl=resources["queue_url"], ReceiptHandle=receipt_handle)
+        return elapsed
+    return run
+
+
+def get_dataframe(aws_functions, resources, payload):
+    aws_functions.save_to_s3(bucket_name, "get_dataframe", payload)
+
+    def run():
+        aws_functions.send_sqs_message(resources["queue_url"],
+                                       pointer_message("get_dataframe"), message_group)
+        start = time.perf_counter()
+        receipt_handle = aws_functions.get_dataframe(
+            resources["queue_url"], bucket_name, "get_dataframe", message_group)[1]
+        elapsed = time.perf_counter() - start
+        aws_functions.get_client("sqs").delete_message(
+            QueueUrl=resources["queue_url"], ReceiptHandle=receipt_handle)
+        return elapsed
+    return run
+
+
+def save_dataframe_to_csv(aws_functions, resources, payload):
+    dataframe = aws_functions.pd.DataFrame(json.loads(payload))
+    return lambda: timed(aws_functions.save_dataframe_to_csv, dataframe, bucket_name,
+                         "save_dataframe_to_csv")
+
+
+def send_sqs_message(aws_functions, resources, payload):
+    return lambda: timed(aws_functions.send_sqs_message, resources["new_queue"](),
+                         payload, message_group)
+
+
+def send_sqs_messages(aws_functions, resources, payload):
+    # The payload split into messages of about 1KB.
+    messages = [payload[start:start + 1024] for start in range(0, len(payload), 1024)]
+    return lambda: timed(aws_functions.send_sqs_messages, resources["new_queue"](),
+                         messages, message_group)
+
+
+def send_sns_message(aws_functions, resources, payload):
+    return lambda: timed(aws_functions.send_sns_message, resources["topic_arn"],
+                         "benchmark")
+
+
+def send_sns_message_with_anomalies(aws_functions, resources, payload):
+    return lambda: timed(aws_functions.send_sns_message_with_anomalies, payload,
+                         resources["topic_arn"], "benchmark")
+
+
+def send_bpm_status(aws_functions, resources, payload):
+    return lambda: timed(aws_functions.send_bpm_status, resources["new_queue"](),
+                         "benchmark", "IN PROGRESS", "run_id")
+
+
+# Each function with the largest payload it is run with. None is any size, 0 means the
+# payload is not used so it is only run once, at the smallest size. moto slows down
+# with every message a queue holds, so send_sqs_messages is kept to about 100 messages
+# and the functions that send messages are given a new queue for each call.
+functions = {
+    "read_from_s3": (read_from_s3, None),
+    "save_to_s3": (save_to_s3, None),
+    "save_data": (save_data, None),
+    "get_data": (get_data, None),
+    "get_dataframe": (get_dataframe, None),
+    "save_dataframe_to_csv": (save_dataframe_to_csv, None),
+    "send_sqs_message": (send_sqs_message, message_limit - 1024),
+    "send_sqs_messages": (send_sqs_messages, 100 * 1024),
+    "send_sns_message": (send_sns_message, 0),
+    "send_sns_message_with_anomalies": (send_sns_message_with_anomalies,
+                                        message_limit - 1024),
+    "send_bpm_status": (send_bpm_status, 0),
+}
+
+
+def aws_mock():
+    """
+    Returns moto's stand-ins for S3, SQS and SNS, for both new and old versions of moto.
+    """
+    try:
+        from moto import mock_aws
+        return mock_aws()
+    except ImportError:
+        from moto import mock_s3, mock_sns, mock_sqs
+        stack = contextlib.ExitStack()
+        for mock in (mock_s3(), mock_sqs(), mock_sns()):
+            stack.enter_context(mock)
+        return stack
+
+
+def peak_rss():
+    """
+    Returns the peak resident set size of this process so far, in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes.
+    return peak / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def percentile(latencies, percent):
+    ordered = sorted(latencies)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def run_case(name, size, repeat):
+    """
+    Runs one function at one payload size. Called in its own process.
+    :return: The case's results - Type: Dict
+    """
+    from es_aws_functions import aws_functions
+
+    result = {"function": name, "size": size, "repeat": repeat}
+    queue_numbers = itertools.count()
+
+    def new_queue():
+        return aws_functions.get_client("sqs").create_queue(
+            QueueName=f"benchmark{next(queue_numbers)}.fifo",
+            Attributes={"FifoQueue": "true"})["QueueUrl"]
+
+    try:
+        with aws_mock():
+            aws_functions.reset_clients()
+            aws_functions.get_client("s3").create_bucket(
+                Bucket=bucket_name,
+                CreateBucketConfiguration={"LocationConstraint": aws_functions.region})
+            resources = {
+                "new_queue": new_queue,
+                "queue_url": new_queue(),
+                "topic_arn": aws_functions.get_client("sns").create_topic(
+                    Name="benchmark")["TopicArn"],
+            }
+            run = functions[name][0](aws_functions, resources, build_payload(size))
+            run()
+            setup_rss = peak_rss()
+            latencies = [run() for _ in range(repeat)]
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {str(e)[:200]}"
+        return result
+
+    median = percentile(latencies, 50)
+    result.update({
+        "latency_mean_ms": sum(latencies) / len(latencies) * 1000,
+        "latency_p50_ms": median * 1000,
+        "latency_p90_ms": percentile(latencies, 90) * 1000,
+        "latency_p99_ms": percentile(latencies, 99) * 1000,
+        "throughput_mb_s": size / 1024 ** 2 / median if median else None,
+        "peak_rss_mb": peak_rss(),
+        "rss_growth_mb": peak_rss() - setup_rss,
+    })
+    return result
+
+
+def parse_size(size):
+    size = size.strip().upper()
+    for unit, factor in units.items():
+        if size.endswith(unit):
+            return int(float(size[:-len(unit)]) * factor)
+    return int(size)
+
+
+def format_size(size):
+    for unit, factor in reversed(list(units.items())):
+        if size >= factor:
+            return f"{size / factor:g}{unit}"
+    return f"{size}B"
+
+
+def cases(names, sizes):
+    for name in names:
+        limit = functions[name][1]
+        if limit == 0:
+            yield name, sizes[0]
+            continue
+        for size in sizes:
+            if limit is None or size <= limit:
+                yield name, size
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints each case's median latency against the baseline's.
+    :return: The number of cases slower than the baseline by more than threshold percent
+    - Type: Int
+    """
+    previous = {(result["function"], result["size"]): result
+                for result in baseline["results"] if "error" not in result}
+    regressions = 0
+    print(f"\nAgainst baseline from {baseline.get('created', 'unknown')}:")
+    print(f"{'function':>32} {'size':>7} {'p50 ms':>10} {'was ms':>10} {'change':>8}")
+    for result in results:
+        old = previous.get((result["function"], result["size"]))
+        if "error" in result or not old:
+            continue
+        change = result["latency_p50_ms"] / old["latency_p50_ms"] - 1
+        flag = ""
+        if change * 100 > threshold:
+            flag = "  slower"
+            regressions += 1
+        print(f"{result['function']:>32} {format_size(result['size']):>7} "
+              f"{result['latency_p50_ms']:>10.2f} {old['latency_p50_ms']:>10.2f} "
+              f"{change:>+8.0%}{flag}")
+    return regressions
+
+
+def versions():
+    found = {}
+    for package in ("boto3", "botocore", "moto", "pandas"):
+        try:
+            found[package] = __import__(package).__version__
+        except ImportError:
+            pass
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="1KB,100KB,1MB,10MB,100MB",
+                        help="Comma separated payload sizes, eg. 1KB,1MB,500MB")
+    parser.add_argument("--functions", default=",".join(functions),
+                        help="Comma separated functions to run")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Timed calls of each function at each size")
+    parser.add_argument("--output", default="io_paths_results.json",
+                        help="File to write the results to")
+    parser.add_argument("--baseline", help="Previous results file to compare with")
+    parser.add_argument("--threshold", type=float, default=10,
+                        help="Percent slower than the baseline to count as slower")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit with 1 if any case is slower than the baseline")
+    arguments = parser.parse_args()
+
+    sizes = sorted(parse_size(size) for size in arguments.sizes.split(","))
+    names = arguments.functions.split(",")
+    for name in names:
+        if name not in functions:
+            parser.error(f"Unknown function {name}, choose from {', '.join(functions)}")
+
+    results = []
+    print(f"{'function':>32} {'size':>7} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10} "
+          f"{'MB/s':>9} {'peak MB':>8} {'grew MB':>8}")
+    spawn = multiprocessing.get_context("spawn")
+    for name, size in cases(names, sizes):
+        with ProcessPoolExecutor(1, mp_context=spawn) as executor:
+            result = executor.submit(run_case, name, size, arguments.repeat).result()
+        results.append(result)
+        if "error" in result:
+            print(f"{name:>32} {format_size(size):>7} failed: {result['error']}")
+            continue
+        throughput = result["throughput_mb_s"] or float("inf")
+        print(f"{name:>32} {format_size(size):>7} {result['latency_p50_ms']:>10.2f} "
+              f"{result['latency_p90_ms']:>10.2f} {result['latency_p99_ms']:>10.2f} "
+              f"{throughput:>9.1f} {result['peak_rss_mb']:>8.0f} "
+              f"{result['rss_growth_mb']:>8.0f}")
+
+    with open(arguments.output, "w") as output:
+        json.dump({"created": datetime.datetime.now().isoformat(timespec="seconds"),
+                   "python": platform.python_version(),
+                   "versions": versions(),
+                   "repeat": arguments.repeat,
+                   "results": results}, output, indent=2)
+    print(f"\nResults written to {arguments.output}")
+
+    if arguments.baseline:
+        with open(arguments.baseline) as baseline:
+            regressions = compare(results, json.load(baseline), arguments.threshold)
+        if regressions and arguments.fail_on_regression:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
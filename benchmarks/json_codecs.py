@@ -0,0 +1,78 @@
+"""
+Compares the JSON codecs that are installed on the payloads a wrangler hop handles:
+parsing a file of records, serialising records, and serialising a DataFrame either
+through to_dict("records") or straight from its columns with dumps_dataframe.
+
+Each codec's results are checked to be exactly those of json.loads and json.dumps,
+and the benchmark fails if the preferred codec parses slower than json.
+Usage: python benchmarks/json_codecs.py [rows ...]
+"""
+import json
+import statistics
+import sys
+import time
+
+import pandas as pd
+from es_aws_functions import json_codecs
+
+
+def build_records(rows):
+    return [{"reference": 49900000000 + i,
+             "period": "201809",
+             "region": str(i % 14),
+             "Q601_asphalting_sand": float(i % 997) / 3,
+             "Q602_building_soft_sand": i % 31,
+             "land_or_marine": "L" if i % 5 else None,
+             "response_type": i % 2 == 0}
+            for i in range(rows)]
+
+
+def timed(function, *args, repeats=5):
+    """
+    :return: The median seconds taken and the last result - Type: Tuple
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def main(sizes):
+    slower = []
+    print(f"{'rows':>10} {'codec':>8} {'loads s':>9} {'dumps s':>9} "
+          f"{'df to_dict s':>13} {'df direct s':>12} {'speedup':>8}")
+    for rows in sizes:
+        records = build_records(rows)
+        payload = json.dumps(records)
+        dataframe = pd.DataFrame(records)
+        expected = json.dumps(dataframe.to_dict("records"))
+        loads_times = {}
+        for name in json_codecs.codec_names():
+            json_codecs.set_codec(name)
+            loads_time, parsed = timed(json_codecs.loads, payload)
+            loads_times[name] = loads_time
+            assert parsed == records
+            dumps_time, dumped = timed(json_codecs.dumps, records)
+            assert dumped == payload
+            to_dict_time, _ = timed(
+                lambda: json_codecs.dumps(dataframe.to_dict("records")))
+            direct_time, direct = timed(json_codecs.dumps_dataframe, dataframe)
+            assert direct == expected
+            print(f"{rows:>10} {name:>8} {loads_time:>9.4f} {dumps_time:>9.4f} "
+                  f"{to_dict_time:>13.4f} {direct_time:>12.4f} "
+                  f"{to_dict_time / direct_time:>7.1f}x")
+        json_codecs.set_codec()
+        to_json_time, _ = timed(lambda: dataframe.to_json(orient="records"))
+        print(f"{rows:>10} {'to_json':>8} {'':>9} {'':>9} {'':>13} {to_json_time:>12.4f}"
+              f"  (pandas, not the same output)")
+        preferred = json_codecs.codec_names()[0]
+        if loads_times[preferred] > loads_times["json"]:
+            slower.append(f"{preferred} parses {rows} rows slower than json")
+    if slower:
+        sys.exit("The preferred codec is slower than json: " + ", ".join(slower))
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [1000, 100000])
@@ -0,0 +1,53 @@
+"""
+Compares sas_round applied row by row against sas_round_vectorised, and checks that
+both give the same results for non-negative numbers (sas_round rounds negative halves
+up, where SAS and sas_round_vectorised round them away from zero).
+Usage: python benchmarks/sas_round.py [rows ...]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from es_aws_functions import general_functions
+
+
+def build_values(rows):
+    # Two decimal places, so that exact halves are well represented.
+    values = pd.Series(np.random.randint(0, 10000000, rows) / 100)
+    values[::10] = np.nan
+    return values
+
+
+def check_identical():
+    # Up to 1e10, where turnover figures reach, as well as small values.
+    for high in (10000000, 10 ** 12):
+        values = pd.Series(np.random.randint(0, high, 100000) / 100)
+        expected = values.apply(general_functions.sas_round)
+        result = general_functions.sas_round_vectorised(values)
+        assert (result == expected).all()
+    assert list(general_functions.sas_round_vectorised(
+        np.array([3437932970.5, 1e300, 2.0 ** 53]))) == [3437932971.0, 1e300, 2.0 ** 53]
+    assert list(general_functions.sas_round_vectorised(
+        np.array([-2.5, -0.4, 2.675, np.nan]), 2)[:3]) == [-2.5, -0.4, 2.68]
+    print("Vectorised results identical to sas_round.")
+
+
+def main(sizes):
+    check_identical()
+    print(f"{'rows':>10} {'apply s':>9} {'vectorised s':>13} {'speedup':>8}")
+    for rows in sizes:
+        values = build_values(rows)
+        start = time.perf_counter()
+        values.apply(lambda value: value if np.isnan(value)
+                     else general_functions.sas_round(value))
+        scalar = time.perf_counter() - start
+        start = time.perf_counter()
+        general_functions.sas_round_vectorised(values)
+        vectorised = time.perf_counter() - start
+        print(f"{rows:>10} {scalar:>9.3f} {vectorised:>13.3f} "
+              f"{scalar / vectorised:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10000, 1000000])
@@ -0,0 +1,64 @@
+"""
+Compares the peak memory of read_dataframe_from_s3 against stream_dataframe_from_s3.
+
+S3 is replaced with an in-memory body so only the parsing paths are measured.
+Usage: python benchmarks/streaming_read.py [rows ...]
+"""
+import io
+import json
+import sys
+import tracemalloc
+from unittest import mock
+
+from botocore.response import StreamingBody
+from es_aws_functions import aws_functions
+
+
+def build_payload(rows):
+    records = [{"reference": 49900000000 + i,
+                "period": "201809",
+                "region": str(i % 14),
+                "Q601_asphalting_sand": float(i % 997),
+                "Q602_building_soft_sand": i % 31}
+               for i in range(rows)]
+    return json.dumps(records).encode("UTF-8")
+
+
+def peak_memory(function, payload):
+    def new_response(**kwargs):
+        return {"Body": StreamingBody(io.BytesIO(payload), len(payload))}
+
+    def new_object(*args):
+        s3_object = mock.Mock()
+        s3_object.get.side_effect = new_response
+        return s3_object
+
+    client = mock.Mock()
+    client.get_object.side_effect = new_response
+    resource = mock.Mock()
+    resource.Object.side_effect = new_object
+    with mock.patch.object(aws_functions, "get_client", return_value=client), \
+            mock.patch.object(aws_functions, "get_resource", return_value=resource):
+        tracemalloc.start()
+        data = function("bucket", "file")
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return peak, len(data)
+
+
+def main(sizes):
+    print(f"{'rows':>10} {'MB':>8} {'current MB':>11} {'streamed MB':>12} {'saved':>7}")
+    # Dependencies are imported on first use, so a warm up keeps them out of the results.
+    for function in (aws_functions.read_dataframe_from_s3,
+                     aws_functions.stream_dataframe_from_s3):
+        peak_memory(function, build_payload(1))
+    for rows in sizes:
+        payload = build_payload(rows)
+        current, _ = peak_memory(aws_functions.read_dataframe_from_s3, payload)
+        streamed, _ = peak_memory(aws_functions.stream_dataframe_from_s3, payload)
+        print(f"{rows:>10} {len(payload) / 2**20:>8.1f} {current / 2**20:>11.1f} "
+              f"{streamed / 2**20:>12.1f} {1 - streamed / current:>7.0%}")
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [10000, 100000, 1000000])
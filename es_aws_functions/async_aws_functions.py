@@ -0,0 +1,188 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from es_aws_functions import aws_functions
+
+# Number of threads the blocking boto3 calls are run on.
+max_workers = 10
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    """
+    Returns the thread pool the blocking calls are run on, creating it on first use.
+    It is kept for the life of the container, so warm invocations reuse its threads.
+    :return executor: The shared thread pool - Type: ThreadPoolExecutor
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers)
+    return _executor
+
+
+def _run_in_new_loop(coroutine):
+    """
+    Runs a coroutine to completion on a new event loop, then closes the loop.
+    :param coroutine: The coroutine to run - Type: Coroutine
+    :return: The coroutine's result
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+async def _run_blocking(function, *args, **kwargs):
+    """
+    Runs a blocking function on the shared thread pool without blocking the event loop.
+    :param function: The function to run - Type: Function
+    :return: The function's result
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        _get_executor(), functools.partial(function, *args, **kwargs))
+
+
+async def get_data(queue_url, bucket_name, key, incoming_message_group, file_prefix="",
+                   file_extension=".json"):
+    """
+    Awaitable version of aws_functions.get_data.
+    :param queue_url: The url of the queue to retrieve message from - Type: String
+    :param bucket_name: The default bucket name to use if no message from previous
+    module - Type: String
+    :param key: The default file name to use if no message from the previous
+    module - Type: String
+    :param incoming_message_group: The name of the message group from previous
+    module - Type: String
+    :param file_prefix: Optional, run id to be added as file name prefix - Type: String
+    :param file_extension: The file extension that the submitted file should have.
+    :return data: The data from s3 - Type: Json
+    :return receipt_handle: The receipt_handle of the incoming message
+    (used to delete old message) - Type: String
+    """
+    return await _run_blocking(aws_functions.get_data, queue_url, bucket_name, key,
+                               incoming_message_group, file_prefix, file_extension)
+
+
+async def read_from_s3(bucket_name, file_name, file_prefix="", file_extension=".json"):
+    """
+    Awaitable version of aws_functions.read_from_s3.
+    :param bucket_name: Name of the S3 bucket - Type: String
+    :param file_name: Name of the file - Type: String
+    :param file_prefix: Optional, run id to be added as file name prefix - Type: String
+    :param file_extension: The file extension that the submitted file should have.
+    :return: input_file: The JSON file in S3 - Type: String
+    """
+    return await _run_blocking(aws_functions.read_from_s3, bucket_name, file_name,
+                               file_prefix, file_extension)
+
+
+def run_all(*coroutines, return_exceptions=False):
+    """
+    Runs coroutines concurrently from synchronous code, such as a lambda_handler, and
+    waits for them all to finish. Safe to call whether or not an event loop is already
+    running in the current thread; if one is, the coroutines are run on a separate
+    thread with their own loop.
+    :param coroutines: The coroutines to run - Type: Coroutine
+    :param return_exceptions: Optional, return exceptions in place of results rather
+    than raising the first one - Type: Boolean
+    :return: The results, in the order the coroutines were given - Type: List
+    """
+    async def gather():
+        return await asyncio.gather(*coroutines, return_exceptions=return_exceptions)
+
+    # asyncio.get_running_loop needs Python 3.7.
+    if asyncio._get_running_loop() is None:
+        return _run_in_new_loop(gather())
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(_run_in_new_loop, gather()).result()
+
+
+async def save_data(bucket_name, file_name, data, queue_url, message_id, file_prefix="",
+                    file_extension=".json", compression=None):
+    """
+    Awaitable version of aws_functions.save_data.
+    :param bucket_name: The name of the s3 bucket to use to save data
+    - Type: String
+    :param file_name: The name to give the file being saved - Type: String
+    :param data: The data to be saved - Type Json string
+    :param queue_url: The url of the queue to use in sending the file details
+    - Type: String
+    :param message_id: The label of the message sent to sqs(Message_group_id,
+    what module sent the message)
+    - Type: String
+    :param file_prefix: Optional, run id to be added as file name prefix - Type: String
+    :param file_extension: The file extension that the submitted file should have.
+    :param compression: Optional, compress the file with gzip or zstd - Type: String
+    :return: Nothing
+    """
+    return await _run_blocking(aws_functions.save_data, bucket_name, file_name, data,
+                               queue_url, message_id, file_prefix, file_extension,
+                               compression)
+
+
+async def save_to_s3(bucket_name, output_file_name, output_data, file_prefix="",
+                     file_extension=".json", compression=None):
+    """
+    Awaitable version of aws_functions.save_to_s3.
+    :param bucket_name: Name of the bucket you wish to upload too - Type: String.
+    :param output_file_name: Name you want the file to be called on s3 - Type: String.
+    :param output_data: The data that you wish to upload to s3 - Type: JSON.
+    :param file_prefix: Optional, run id to be added as file name prefix - Type: String
+    :param file_extension: The file extension that the submitted file should have.
+    :param compression: Optional, compress the file with gzip or zstd - Type: String
+    :return: None
+    """
+    return await _run_blocking(aws_functions.save_to_s3, bucket_name, output_file_name,
+                               output_data, file_prefix, file_extension, compression)
+
+
+async def send_bpm_status(queue_url, module_name, status, run_id, current_step_num=None,
+                          total_steps=0, survey="BMI"):
+    """
+    Awaitable version of aws_functions.send_bpm_status.
+    :param queue_url: Name of the queue for the BMP layer - Type: String.
+    :param module_name: Current module name - Type: String.
+    :param status: Current status of the module IN PROGRESS, FINISHED, FAILED
+    - Type: String.
+    :param run_id: run id of current run passed from the module - Type: String.
+    :param current_step_num: Number of the current module step - Type: Int or None.
+    :param total_steps: Total number of steps in the system. - Type: Int or None.
+    :param survey: Survey name for grouping status messages by survey and run_id
+    - Type: String.
+    :return: None
+    """
+    return await _run_blocking(aws_functions.send_bpm_status, queue_url, module_name,
+                               status, run_id, current_step_num, total_steps, survey)
+
+
+async def send_sns_message(sns_topic_arn, module_name):
+    """
+    Awaitable version of aws_functions.send_sns_message.
+    :param sns_topic_arn: The arn of the sns topic you are directing the message at -
+                          Type: String.
+    :param module_name: The name of the module currently being run - Type: String.
+    :return: Json string containing metadata about the message.
+    """
+    return await _run_blocking(aws_functions.send_sns_message, sns_topic_arn,
+                               module_name)
+
+
+async def send_sqs_message(queue_url, message, message_id="", fifo=True):
+    """
+    Awaitable version of aws_functions.send_sqs_message.
+    :param queue_url: The url of the SQS queue. - Type: String
+    :param message: The message/data you wish to send to the SQS queue - Type: String
+    :param message_id: The label of the record in the SQS queue - Type: String
+    :param fifo: Type of SQS queue - Type: Boolean
+    :return: Json string containing metadata about the message.
+    """
+    return await _run_blocking(aws_functions.send_sqs_message, queue_url, message,
+                               message_id, fifo)
@@ -1,25 +1,1505 @@
+import base64
+import codecs
+import contextlib
+import functools
+import gzip
+import hashlib
+import itertools
 import json
+import math
+import os
 import random
-from io import StringIO
+import re
+import tempfile
+import threading
+import time
+import warnings
+import zlib
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from io import BytesIO, StringIO
 
-import boto3
-import pandas as pd
-from botocore.exceptions import ClientError
-from es_aws_functions import exception_classes
+from es_aws_functions import exception_classes, json_codecs
+from es_aws_functions.lazy_import import LazyModule
+
+# Imported on first use, to keep them off the cold start.
+boto3 = LazyModule("boto3")
+botocore_config = LazyModule("botocore.config")
+botocore_exceptions = LazyModule("botocore.exceptions")
+pd = LazyModule("pandas")
 
 extension_types = {
     ".json": "application/json",
-    ".csv": "text/csv"
+    ".csv": "text/csv",
+    ".feather": "application/octet-stream",
+    ".parquet": "application/octet-stream"
 }
 
+# Content-Encodings that save_to_s3 can compress with. Files stored with one of these
+# are decompressed by read_from_s3 automatically. zstd needs the zstandard package.
+compression_codecs = ("gzip", "zstd")
+
+# Binary columnar formats, these are read and written as DataFrames (needs pyarrow).
+columnar_extensions = (".feather", ".parquet")
+
 region = "eu-west-2"
 
+# Size of the HTTP connection pool held by each cached client/resource.
+# Change before first use, or call reset_clients() to apply a new value.
+max_pool_connections = 10
+
+# Payloads larger than multipart_threshold bytes are uploaded in parts of
+# multipart_chunksize bytes, multipart_max_workers at a time. A part that fails is
+# retried up to multipart_part_retries times before the whole upload is aborted.
+multipart_threshold = 16 * 1024 * 1024
+multipart_chunksize = 8 * 1024 * 1024
+multipart_max_workers = 8
+multipart_part_retries = 3
+
+# Objects larger than ranged_get_threshold bytes are read with concurrent ranged GETs
+# of ranged_get_chunksize bytes, ranged_get_max_workers at a time.
+# Set ranged_get_threshold to 0 to always read with a single request.
+ranged_get_threshold = 16 * 1024 * 1024
+ranged_get_chunksize = 8 * 1024 * 1024
+ranged_get_max_workers = 8
+
+# Compressed objects are read and decompressed decompress_chunksize bytes at a time.
+decompress_chunksize = 1024 * 1024
+
+# Failed entries of an SQS batch send are retried up to sqs_batch_retries times.
+sqs_batch_retries = 3
+
+# Claim-check threshold for save_data. Payloads of up to sqs_inline_threshold bytes
+# (before compression) are sent inline in the SQS message rather than saved to S3,
+# saving a PUT and a GET. 0 turns it off, and SQS messages cannot be over 256KB.
+sqs_inline_threshold = 0
+
+# Opt-in disk cache for read_from_s3, for warm containers that read the same files on
+# every invocation. Set disk_cache_directory (eg. "/tmp/s3_cache") to turn it on. Cached
+# copies are checked against S3 with a conditional GET before being used, and the least
+# recently used are removed once the cache is larger than disk_cache_max_size.
+disk_cache_directory = None
+disk_cache_max_size = 256 * 1024 * 1024
+
+# Opt-in in-memory cache of parsed DataFrames for read_dataframe_from_s3 and
+# get_dataframe, so warm invocations reading an unchanged file skip the parsing. Set
+# dataframe_cache_max_size to the bytes of DataFrames to keep (eg. 512MB), 0 is off.
+dataframe_cache_max_size = 0
+
+# The "compact" dtypes policy of the DataFrame reads makes a column of strings (or
+# other objects) a category when it has no more than category_threshold distinct
+# values per row, eg. 0.5 for at most one distinct value in two rows.
+category_threshold = 0.5
+
+_client_lock = threading.Lock()
+_clients = {}
+_resources = threading.local()
+_generation = 0
+
+_disk_cache_lock = threading.Lock()
+_disk_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+_dataframe_cache = OrderedDict()
+_dataframe_cache_lock = threading.Lock()
+_dataframe_cache_size = 0
+_dataframe_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+_sqs_max_message_size = 262144
+
+# Functions called with each call's record, see add_instrumentation_hook. The record of
+# the call in progress on each thread is kept in _call_state.
+_call_state = threading.local()
+_instrumentation_hooks = ()
+_instrumentation_lock = threading.Lock()
+# A context manager that does nothing; suppressing no exceptions, it works like
+# contextlib.nullcontext, which needs Python 3.7.
+_not_measured = contextlib.suppress()
+
+_whitespace = re.compile(r"[ \t\n\r]*")
+
+
+def _add_to_call(field, amount):
+    """
+    Adds to a field of the record of the call in progress, if calls are being recorded.
+    :param field: bytes or retries - Type: String
+    :param amount: The amount to add - Type: Int
+    :return: None
+    """
+    record = _call_state.__dict__.get("record")
+    if record is not None:
+        record[field] += amount
+
+
+def _bpm_message(module_name, status, run_id, current_step_num, total_steps, survey):
+    """
+    Builds a BPM status message and the message group it is sent under.
+    :param module_name: Current module name - Type: String.
+    :param status: Current status of the module IN PROGRESS, FINISHED, FAILED
+    - Type: String.
+    :param run_id: run id of current run passed from the module - Type: String.
+    :param current_step_num: Number of the current module step - Type: Int or None.
+    :param total_steps: Total number of steps in the system. - Type: Int or None.
+    :param survey: Survey name for grouping status messages by survey and run_id
+    - Type: String.
+    :return bpm_message: The status message - Type: JSON String
+    :return output_message_id: The message group of the message - Type: String
+    """
+    run_id = str(run_id)
+    output_message = "_Status_Message"
+    output_message_id = run_id + "_" + survey + output_message
+
+    bpm_message = {
+        "bpm_id": run_id,
+        "status": {
+            "current_step": current_step_num,
+            "total_steps": total_steps,
+            "step_name": module_name,
+            "message": {
+                "text": module_name + " stage: " + status
+            },
+            "state": status}
+    }
+
+    bpm_message = json_codecs.dumps(bpm_message)
+    return bpm_message, output_message_id
+
+
+def _build_dataframe(records, dtypes=None):
+    """
+    Builds a DataFrame from parsed JSON, as pd.DataFrame(records) would. With dtypes,
+    records (a list of dicts) are turned into columns one at a time and each column is
+    converted as soon as it is built, so the full size columns are never all held at
+    once.
+    :param records: Parsed JSON, normally a list of dicts - Type: List
+    :param dtypes: Optional, dtypes to convert columns to, see _convert_columns
+    - Type: Dict or String
+    :return: The DataFrame - Type: DataFrame
+    """
+    if dtypes is None:
+        return pd.DataFrame(records)
+    if not isinstance(records, list) or \
+            not all(isinstance(record, dict) for record in records):
+        return _convert_columns(pd.DataFrame(records).items(), dtypes)
+
+    missing = float("nan")
+    names = dict.fromkeys(name for record in records for name in record)
+    return _convert_columns(
+        ((name, pd.Series([record.get(name, missing) for record in records]))
+         for name in names), dtypes)
+
+
+def _cached_copy(dataframe, unlocked):
+    """
+    Returns a copy of a cached DataFrame to hand out. With copy-on-write, columns held
+    in numpy arrays are shared, as _lock_dataframe made them read-only and pandas copies
+    them before changing them. Those it could not lock are copied, so changing them in
+    place cannot change the cache. Without copy-on-write, pandas would write a replaced
+    column into the shared array, so every column is copied.
+    :param dataframe: The cached DataFrame - Type: DataFrame
+    :param unlocked: Names of the columns _lock_dataframe could not lock, or None to
+    copy every column - Type: List
+    :return: The copy - Type: DataFrame
+    """
+    if unlocked is None or not _copy_on_write():
+        return dataframe.copy()
+    copy = dataframe.copy(deep=False)
+    for name in unlocked:
+        copy[name] = dataframe[name].copy()
+    return copy
+
+
+def _compact_dtype(column):
+    """
+    Picks the smallest dtype that a column can be converted to without losing any of its
+    values, for the "compact" dtypes policy. 64 bit integers become int32 if they fit,
+    floats that are all whole numbers (with missing values) become nullable Int32 or
+    Int64, other floats become float32 if every value survives it, and objects become
+    a category if they repeat enough (see category_threshold).
+    :param column: The column - Type: Series
+    :return: The dtype, or None to leave the column as it is - Type: String
+    """
+    kind = column.dtype.kind
+    if kind in "iu" and column.dtype.itemsize > 4:
+        if not len(column) or (column.min() >= -2 ** 31 and column.max() < 2 ** 31):
+            return "int32"
+    elif kind == "f" and column.dtype.itemsize > 4:
+        present = column.dropna()
+        if not len(present):
+            return None
+        if len(present) < len(column) and (present % 1 == 0).all():
+            if present.min() >= -2 ** 31 and present.max() < 2 ** 31:
+                return "Int32"
+            if present.min() >= -2 ** 63 and present.max() < 2 ** 63:
+                return "Int64"
+        if (present.astype("float32") == present).all():
+            return "float32"
+    elif kind == "O" and len(column):
+        try:
+            distinct = column.nunique(dropna=False)
+        except TypeError:
+            # Unhashable values, eg. lists.
+            return None
+        if distinct <= len(column) * category_threshold:
+            return "category"
+    return None
+
+
+def _compress(data, compression):
+    """
+    Compresses data with one of the compression_codecs.
+    :param data: The data to compress - Type: String or Bytes
+    :param compression: The codec, gzip or zstd - Type: String
+    :return: The compressed data - Type: Bytes
+    """
+    if isinstance(data, str):
+        data = data.encode("UTF-8")
+    if compression == "gzip":
+        return gzip.compress(data, compresslevel=6)
+    if compression == "zstd":
+        # Optional dependency, only needed when zstd is asked for.
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    raise ValueError(f"Unknown compression {compression}, use one of "
+                     f"{', '.join(compression_codecs)}.")
+
+
+def _compressor(compression):
+    """
+    Returns an incremental compressor for one of the compression_codecs, so that data
+    can be compressed a chunk at a time as it is produced.
+    :param compression: The codec, gzip or zstd, or None - Type: String
+    :return: The compressor, or None if no compression was asked for
+    - Type: Compressor
+    """
+    if compression is None:
+        return None
+    if compression == "gzip":
+        return zlib.compressobj(6, zlib.DEFLATED, 31)
+    if compression == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=3).compressobj()
+    raise ValueError(f"Unknown compression {compression}, use one of "
+                     f"{', '.join(compression_codecs)}.")
+
+
+def _concat_dataframes(dataframes):
+    """
+    Joins DataFrames as pd.concat would, but keeps category columns as categories
+    (pd.concat turns them into objects unless the categories of every DataFrame are the
+    same), and adds together their dtype reports (see _convert_columns).
+    :param dataframes: The DataFrames - Type: List
+    :return: The DataFrame - Type: DataFrame
+    """
+    report = {}
+    for dataframe in dataframes:
+        for name, entry in dataframe.attrs.get("dtype_report", {}).items():
+            total = report.setdefault(name, dict(entry, bytes_before=0, bytes_after=0,
+                                                 saved=0))
+            for field in ("bytes_before", "bytes_after", "saved"):
+                total[field] += entry[field]
+
+    for name in dataframes[0].columns:
+        columns = [dataframe[name] for dataframe in dataframes if name in dataframe]
+        if all(isinstance(column.dtype, pd.CategoricalDtype) for column in columns):
+            categories = pd.api.types.union_categoricals(
+                columns, ignore_order=True).categories
+            for dataframe in dataframes:
+                if name in dataframe:
+                    dataframe[name] = dataframe[name].cat.set_categories(categories)
+
+    dataframe = pd.concat(dataframes, ignore_index=True, sort=False)
+    if report:
+        dataframe.attrs["dtype_report"] = report
+    return dataframe
+
+
+def _convert_columns(columns, dtypes):
+    """
+    Builds a DataFrame from columns, converting each to the dtype it is given by dtypes
+    before moving on to the next. A report of each column converted, with its old and
+    new dtype and bytes used, is kept in the DataFrame's attrs as dtype_report.
+    :param columns: Pairs of column name and column - Type: Iterable of Tuples
+    :param dtypes: Dtype of each column by name (others are left alone), eg.
+    {"region": "category", "q601": "int32"}, or "compact" to pick the smallest dtype
+    each column can take without losing values - Type: Dict or String
+    :return: The DataFrame - Type: DataFrame
+    """
+    if dtypes != "compact" and not isinstance(dtypes, dict):
+        raise ValueError(f"Unknown dtypes {dtypes!r}, expected a dict or 'compact'.")
+    converted = {}
+    report = {}
+    for name, column in columns:
+        dtype = _compact_dtype(column) if dtypes == "compact" else dtypes.get(name)
+        if dtype is not None and column.dtype != dtype:
+            bytes_before = int(column.memory_usage(index=False, deep=True))
+            try:
+                new_column = column.astype(dtype)
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"Could not convert column {name} to {dtype}. {e}")
+            bytes_after = int(new_column.memory_usage(index=False, deep=True))
+            report[name] = {"from": str(column.dtype), "to": str(new_column.dtype),
+                            "bytes_before": bytes_before, "bytes_after": bytes_after,
+                            "saved": bytes_before - bytes_after}
+            column = new_column
+        converted[name] = column
+        del column
+
+    dataframe = pd.DataFrame(converted)
+    dataframe.attrs["dtype_report"] = report
+    return dataframe
+
+
+def _copy_on_write():
+    """
+    Checks whether pandas copies arrays shared between DataFrames before changing them,
+    which it always does from pandas 3 and does from pandas 1.5 if turned on.
+    :return: Whether it does - Type: Boolean
+    """
+    if int(pd.__version__.split(".")[0]) >= 3:
+        return True
+    try:
+        return pd.get_option("mode.copy_on_write") is True
+    except KeyError:
+        # The option does not exist before pandas 1.5.
+        return False
+
+
+def _count_disk_cache(statistic):
+    """
+    Adds one to a disk cache counter.
+    :param statistic: hits, misses or evictions - Type: String
+    :return: None
+    """
+    with _disk_cache_lock:
+        _disk_cache_stats[statistic] += 1
+
+
+def _csv_parts(dataframe, part_size, chunk_rows, compression=None):
+    """
+    Writes a DataFrame as CSV chunk_rows rows at a time, encoding (and compressing)
+    each chunk as soon as it is written, and yields the result in parts of part_size
+    bytes, the last of which may be smaller. Only one chunk and one part are held at
+    once, however large the DataFrame. The bytes are exactly those of writing the
+    whole DataFrame at once.
+    :param dataframe: The DataFrame - Type: DataFrame
+    :param part_size: Number of bytes per part - Type: Int
+    :param chunk_rows: Number of rows written at a time - Type: Int
+    :param compression: Optional, compress with gzip or zstd - Type: String
+    :return: Generator of Bytes
+    """
+    compressor = _compressor(compression)
+    buffer = bytearray()
+    witnesses = [_csv_time_witnesses(column) for _, column in dataframe.items()]
+    # An empty DataFrame is still written once, for its header.
+    for start in range(0, max(len(dataframe), 1), chunk_rows):
+        with _measure("build_time"):
+            chunk = dataframe.iloc[start:start + chunk_rows]
+            if any(values is not None for values in witnesses):
+                # Datetimes and timedeltas are formatted as in the whole DataFrame.
+                columns = [column if values is None else _csv_times(column, values)
+                           for (_, column), values in zip(chunk.items(), witnesses)]
+                chunk = pd.DataFrame(dict(enumerate(columns)), index=chunk.index)
+                chunk.columns = dataframe.columns
+            data = chunk.to_csv(sep=",", index=False, header=start == 0).encode("UTF-8")
+            if compressor:
+                data = compressor.compress(data)
+        buffer += data
+        while len(buffer) >= part_size:
+            _add_to_call("bytes", part_size)
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if compressor:
+        buffer += compressor.flush()
+    _add_to_call("bytes", len(buffer))
+    for start in range(0, len(buffer), part_size):
+        yield bytes(buffer[start:start + part_size])
+
+
+def _csv_time_witnesses(column):
+    """
+    pandas writes a datetime or timedelta column to CSV in a format chosen from the
+    values being written, eg. dates without times only if no value has a time, and
+    fractions of a second to the finest precision any value has. Picks, from the whole
+    column, a few values that make pandas choose the format it would for the whole
+    column, so that each chunk of it can be written the same way.
+    :param column: The column - Type: Series
+    :return: The values, or None if the column is not a datetime or timedelta
+    - Type: Series
+    """
+    dtype = column.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        dtype = dtype.categories.dtype
+    if dtype.kind not in "mM":
+        return None
+    values = column.dropna()
+    times = values.astype(dtype)
+    if getattr(times.dt, "tz", None) is not None:
+        times = times.dt.tz_localize(None)
+    positions = set()
+    for frequency in ("D", "s", "ms", "us"):
+        uneven = (times != times.dt.floor(frequency)).to_numpy().nonzero()[0]
+        if len(uneven):
+            positions.add(uneven[0])
+    return values.iloc[sorted(positions)]
+
+
+def _csv_times(column, witnesses):
+    """
+    Formats a chunk of a datetime or timedelta column as pandas would write it to CSV
+    as part of the whole column.
+    :param column: The chunk of the column - Type: Series
+    :param witnesses: Values picked from the whole column by _csv_time_witnesses
+    - Type: Series
+    :return: The formatted values - Type: Series
+    """
+    lines = pd.concat([witnesses, column]).to_csv(index=False, header=False)
+    # A missing value alone on a line is written as "".
+    return pd.Series(["" if line == '""' else line
+                      for line in lines.splitlines()[len(witnesses):]],
+                     index=column.index, dtype=object)
+
+
+def _decode_inline_message(message):
+    """
+    Reads the payload of an SQS message sent inline by save_data.
+    :param message: The message's body - Type: Dict
+    :return: The payload - Type: String (Bytes for columnar formats)
+    """
+    data = message["data"]
+    content_encoding = message.get("content_encoding")
+    if content_encoding or message.get("binary"):
+        data = base64.b64decode(data)
+    decompressor = _decompressor(content_encoding)
+    if decompressor:
+        data = decompressor.decompress(data) + decompressor.flush()
+    if isinstance(data, bytes) and not message.get("binary"):
+        data = data.decode("UTF-8")
+    return data
+
+
+def _decompress_body(body, decompressor, output):
+    """
+    Reads a streaming body a chunk at a time, adding each chunk to output as soon as it
+    is decompressed, so the compressed data is never held whole.
+    :param body: File-like object to read bytes from (eg. StreamingBody)
+    :param decompressor: Decompressor for the body - Type: Decompressor
+    :param output: The decompressed data so far - Type: Bytearray
+    :return: None
+    """
+    while True:
+        chunk = body.read(decompress_chunksize)
+        if not chunk:
+            return
+        _add_to_call("bytes", len(chunk))
+        output += decompressor.decompress(chunk)
+
+
+def _decompressor(content_encoding):
+    """
+    Returns an incremental decompressor for a Content-Encoding, so that data can be
+    decompressed a chunk at a time as it is read.
+    :param content_encoding: The Content-Encoding of the data - Type: String
+    :return: The decompressor, or None if the data is not compressed
+    - Type: Decompressor
+    """
+    if content_encoding == "gzip":
+        return zlib.decompressobj(wbits=31)
+    if content_encoding == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+def _disk_cache_path(bucket_name, full_file_name):
+    """
+    Returns the path a file's cached copy is kept at.
+    :param bucket_name: Name of the S3 bucket - Type: String
+    :param full_file_name: Key of the object - Type: String
+    :return: The path - Type: String
+    """
+    name = hashlib.sha256(f"{bucket_name}/{full_file_name}".encode("UTF-8"))
+    return os.path.join(disk_cache_directory, name.hexdigest())
+
+
+def _dtypes_key(dtypes):
+    """
+    Makes the dtypes given to a DataFrame read hashable, for the DataFrame cache key.
+    :param dtypes: Dtypes as given to _convert_columns, or None - Type: Dict or String
+    :return: The key - Type: Tuple or String
+    """
+    if isinstance(dtypes, dict):
+        return tuple(sorted((str(name), repr(dtype)) for name, dtype in dtypes.items()))
+    return dtypes
+
+
+def _evict_disk_cache():
+    """
+    Removes the least recently used cached files until the cache is no larger than
+    disk_cache_max_size. Files another process has already removed are skipped.
+    :return: None
+    """
+    files = []
+    with os.scandir(disk_cache_directory) as entries:
+        for entry in entries:
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total_size <= disk_cache_max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        total_size -= size
+        _count_disk_cache("evictions")
+
+
+def _from_columnar(data, file_extension):
+    """
+    Loads a DataFrame from Parquet or Feather bytes.
+    :param data: The file contents - Type: Bytes
+    :param file_extension: The file extension, one of columnar_extensions - Type: String
+    :return: The loaded data - Type: DataFrame
+    """
+    if file_extension == ".parquet":
+        return pd.read_parquet(BytesIO(data))
+    return pd.read_feather(BytesIO(data))
+
+
+def _inline_message(data, file_extension, compression):
+    """
+    Builds the SQS message that save_data sends a payload inline in, if the payload is
+    no larger than sqs_inline_threshold. Binary and compressed payloads are base64
+    encoded.
+    :param data: The data to be saved - Type: Json string
+    (For .parquet and .feather extensions a DataFrame may be given instead)
+    :param file_extension: The file extension that the file would have.
+    :param compression: Compress the payload with gzip or zstd, or None - Type: String
+    :return: The message's body, or None if the payload is too large to send inline
+    - Type: String
+    """
+    if file_extension in columnar_extensions:
+        data = _to_columnar(data, file_extension)
+    if len(data) > sqs_inline_threshold:
+        return None
+    if isinstance(data, str):
+        data = data.encode("UTF-8")
+        if len(data) > sqs_inline_threshold:
+            return None
+        binary = False
+    else:
+        binary = True
+
+    message = {}
+    if compression:
+        data = _compress(data, compression)
+        message["content_encoding"] = compression
+    if binary or compression:
+        message["data"] = base64.b64encode(data).decode("ascii")
+    else:
+        message["data"] = data.decode("UTF-8")
+    if binary:
+        message["binary"] = True
+    message = json_codecs.dumps(message)
+    if len(message.encode("UTF-8")) > _sqs_max_message_size:
+        return None
+    return message
+
+
+def _instrumented(function):
+    """
+    Decorator recording each call of an aws_functions function for the instrumentation
+    hooks. Calls made on the same thread by a call already being recorded (eg. get_data
+    calling read_from_s3) add to its record rather than making their own. When there are
+    no hooks the only cost is checking for them. A hook that raises cannot change the
+    result of the call, its error is given as a RuntimeWarning instead.
+    :param function: The function to record - Type: Function
+    :return: The recorded function - Type: Function
+    """
+    @functools.wraps(function)
+    def recorded(*args, **kwargs):
+        if not _instrumentation_hooks or _call_state.__dict__.get("record"):
+            return function(*args, **kwargs)
+        record = {"call": function.__name__, "wall_time": 0.0, "transfer_time": 0.0,
+                  "parse_time": 0.0, "build_time": 0.0, "bytes": 0, "retries": 0,
+                  "error": None}
+        start = time.perf_counter()
+        try:
+            return _run_in_call(record, function, *args, **kwargs)
+        except Exception as e:
+            record["error"] = type(e).__name__
+            raise
+        finally:
+            record["wall_time"] = time.perf_counter() - start
+            for hook in _instrumentation_hooks:
+                try:
+                    hook(record)
+                except Exception as e:
+                    try:
+                        warnings.warn(f"Instrumentation hook {hook!r} raised {e!r}.",
+                                      RuntimeWarning)
+                    except Exception:
+                        # Warnings have been turned into errors.
+                        pass
+    return recorded
+
+
+def _iter_dataframe_batches(body, chunk_size, batch_rows, decompressor=None,
+                            dtypes=None):
+    """
+    Parses a JSON array of records straight from a file-like body, reading chunk_size
+    bytes at a time, and yields a DataFrame for every batch_rows records. Only the
+    unparsed tail of the text and one batch of records are held at once. If the
+    document is not an array, it is parsed whole and yielded as a single DataFrame.
+    Invalid JSON raises a ValueError, as json.loads would, including empty elements
+    and anything but whitespace after the array.
+    :param body: File-like object to read bytes from (eg. StreamingBody)
+    :param chunk_size: Number of bytes to read per chunk - Type: Int
+    :param batch_rows: Number of records per DataFrame batch - Type: Int
+    :param decompressor: Optional, decompressor for each chunk read, if the body is
+    compressed - Type: Decompressor
+    :param dtypes: Optional, dtypes to convert each batch's columns to, see
+    _convert_columns - Type: Dict or String
+    :return: Generator of DataFrames
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    # What may come next: the start of the array, its first element or its end, an
+    # element, a separator or its end, or nothing once it has ended.
+    expecting = "array"
+    records = []
+    while True:
+        with _measure("transfer_time"):
+            chunk = body.read(chunk_size)
+        _add_to_call("bytes", len(chunk))
+        final = not chunk
+        if decompressor:
+            chunk = decompressor.decompress(chunk)
+            if final:
+                chunk += decompressor.flush()
+        buffer = buffer[position:] + text_decoder.decode(chunk, final)
+        position = 0
+        while True:
+            position = _whitespace.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            if expecting == "end":
+                raise ValueError("Extra data after the JSON array.")
+            if expecting == "array":
+                if buffer[position] != "[":
+                    with _measure("transfer_time"):
+                        rest = body.read()
+                    _add_to_call("bytes", len(rest))
+                    if decompressor:
+                        rest = decompressor.decompress(rest) + decompressor.flush()
+                    buffer += text_decoder.decode(rest, True)
+                    records = json_codecs.loads(buffer[position:])
+                    with _measure("build_time"):
+                        dataframe = _build_dataframe(records, dtypes)
+                    yield dataframe
+                    return
+                expecting = "first"
+                position += 1
+                continue
+            if buffer[position] == "]" and expecting != "element":
+                if records:
+                    with _measure("build_time"):
+                        dataframe = _build_dataframe(records, dtypes)
+                    yield dataframe
+                    records = []
+                expecting = "end"
+                position += 1
+                continue
+            if expecting == "separator":
+                if buffer[position] != ",":
+                    raise ValueError("Expecting ',' delimiter between records.")
+                expecting = "element"
+                position += 1
+                continue
+            if buffer[position] in ",]":
+                raise ValueError("Expecting a record, found an empty element.")
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                if final:
+                    raise
+                break
+            if end == len(buffer) and not final:
+                # A trailing scalar could continue in the next chunk.
+                break
+            records.append(record)
+            position = end
+            expecting = "separator"
+            if len(records) >= batch_rows:
+                with _measure("build_time"):
+                    dataframe = _build_dataframe(records, dtypes)
+                yield dataframe
+                records = []
+        if final:
+            if expecting == "end":
+                return
+            raise ValueError("Unexpected end of JSON data.")
+
+
+def _infer_columns(dataframe, batches):
+    """
+    Gives a DataFrame joined from batches the dtypes it would have had if it was built
+    from all the records at once. pd.concat gives an object column when the batches
+    disagree on its dtype (eg. a batch of nulls then a batch of numbers), where
+    pd.DataFrame(records) would have inferred the dtype from all of the values.
+    :param dataframe: The joined DataFrame - Type: DataFrame
+    :param batches: The DataFrames it was joined from - Type: List
+    :return: None
+    """
+    for name, column in dataframe.items():
+        if column.dtype == object and any(
+                name not in batch or batch[name].dtype != object for batch in batches):
+            dataframe[name] = pd.Series(column.tolist(), index=dataframe.index)
+
+
+def _lock_dataframe(dataframe):
+    """
+    Makes the arrays holding a DataFrame's columns read-only, so that a cached DataFrame
+    cannot be changed through the views handed out of the cache. Columns held in
+    extension arrays (categories, nullable integers, strings, datetimes with a time
+    zone) cannot be locked, and have to be copied by _cached_copy instead.
+    :param dataframe: The DataFrame - Type: DataFrame
+    :return: The names of the columns that could not be locked, or None if they
+    cannot be told apart (duplicate column names) - Type: List
+    """
+    manager = getattr(dataframe, "_mgr", None) or dataframe._data
+    for block in manager.blocks:
+        if hasattr(block.values, "flags"):
+            block.values.flags.writeable = False
+    unlocked = [name for name, column in dataframe.items()
+                if pd.api.types.is_extension_array_dtype(column.dtype)]
+    if unlocked and not dataframe.columns.is_unique:
+        return None
+    return unlocked
+
+
+def _measure(field):
+    """
+    Returns a context manager adding the time spent in its with block to a field of the
+    record of the call in progress. Time spent in a block measured inside another only
+    counts towards the inner block's field. Does nothing if calls are not being recorded.
+    :param field: transfer_time, parse_time or build_time - Type: String
+    :return: The context manager - Type: ContextManager
+    """
+    record = _call_state.__dict__.get("record")
+    if record is None:
+        return _not_measured
+    return _measured(record, field)
+
+
+@contextlib.contextmanager
+def _measured(record, field):
+    """
+    Context manager doing the work of _measure.
+    :param record: The record of the call in progress - Type: Dict
+    :param field: transfer_time, parse_time or build_time - Type: String
+    """
+    outer = _call_state.section
+    now = time.perf_counter()
+    if outer:
+        record[outer[0]] += now - outer[1]
+    _call_state.section = [field, now]
+    try:
+        yield
+    finally:
+        now = time.perf_counter()
+        record[field] += now - _call_state.section[1]
+        if outer:
+            outer[1] = now
+        _call_state.section = outer
+
+
+def _multipart_upload(bucket_name, full_file_name, parts, put_arguments):
+    """
+    Uploads parts to S3 as a single object using a multipart upload. Parts are sent
+    concurrently, with no more than multipart_max_workers in flight (or held in memory)
+    at once. Failed parts are retried individually, and if any part still fails the
+    upload is aborted so no partial object or orphaned parts are left behind.
+    :param bucket_name: Name of the bucket to upload to - Type: String
+    :param full_file_name: Key of the object - Type: String
+    :param parts: Iterable of parts, each at least 5MB except the last - Type: Bytes
+    :param put_arguments: Extra arguments for the object (eg. ContentType) - Type: Dict
+    :return: None
+    """
+    s3 = get_client("s3")
+    record = _call_state.__dict__.get("record")
+    upload_id = s3.create_multipart_upload(
+        Bucket=bucket_name, Key=full_file_name, **put_arguments)["UploadId"]
+    try:
+        with ThreadPoolExecutor(multipart_max_workers) as executor:
+            futures = []
+            pending = set()
+            for part_number, part in enumerate(parts, 1):
+                if len(pending) >= multipart_max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                future = executor.submit(_run_in_call, record, _upload_part, s3,
+                                         bucket_name, full_file_name, upload_id,
+                                         part_number, part)
+                futures.append(future)
+                pending.add(future)
+            completed_parts = [future.result() for future in futures]
+        s3.complete_multipart_upload(
+            Bucket=bucket_name, Key=full_file_name, UploadId=upload_id,
+            MultipartUpload={"Parts": completed_parts})
+    except Exception:
+        s3.abort_multipart_upload(
+            Bucket=bucket_name, Key=full_file_name, UploadId=upload_id)
+        raise
+
+
+def _pack_sqs_batches(entries):
+    """
+    Groups SQS entries, in order, into batches of at most 10 entries and 256KB.
+    :param entries: Entries for send_message_batch - Type: List
+    :return: Generator of Lists
+    """
+    batch = []
+    batch_bytes = 0
+    for entry in entries:
+        entry_bytes = len(entry["MessageBody"].encode("UTF-8"))
+        if batch and (len(batch) == 10
+                      or batch_bytes + entry_bytes > _sqs_max_message_size):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(entry)
+        batch_bytes += entry_bytes
+    if batch:
+        yield batch
+
+
+def _parse_dataframe(data, file_extension, dtypes=None):
+    """
+    Parses a file read by read_dataframe_from_s3 into a DataFrame.
+    :param data: The file's contents - Type: String (Bytes for columnar formats)
+    :param file_extension: The file extension that the file has - Type: String
+    :param dtypes: Optional, dtypes to convert columns to, see _convert_columns
+    - Type: Dict or String
+    :return: The DataFrame - Type: DataFrame
+    """
+    if file_extension in columnar_extensions:
+        with _measure("parse_time"):
+            dataframe = _from_columnar(data, file_extension)
+        if dtypes is None:
+            return dataframe
+        with _measure("build_time"):
+            return _convert_columns(dataframe.items(), dtypes)
+    with _measure("parse_time"):
+        records = json_codecs.loads(data)
+    with _measure("build_time"):
+        return _build_dataframe(records, dtypes)
+
+
+def _parse_json_dataframe(data, file_extension, dtypes=None):
+    """
+    Parses a file read by get_dataframe into a DataFrame. With dtypes, JSON is parsed
+    as _parse_dataframe parses it, so that each column is converted as it is built
+    rather than after the whole DataFrame has been built by pd.read_json.
+    :param data: The file's contents - Type: String (Bytes for columnar formats)
+    :param file_extension: The file extension that the file has - Type: String
+    :param dtypes: Optional, dtypes to convert columns to, see _convert_columns
+    - Type: Dict or String
+    :return: The DataFrame - Type: DataFrame
+    """
+    if dtypes is not None:
+        return _parse_dataframe(data, file_extension, dtypes)
+    with _measure("parse_time"):
+        if file_extension in columnar_extensions:
+            return _from_columnar(data, file_extension)
+        # Newer pandas take a string as a path, so it is wrapped in a file.
+        return pd.read_json(StringIO(data), dtype=False)
+
+
+def _read_cache_file(path):
+    """
+    Reads a cached copy of an S3 object from the disk cache.
+    :param path: Path of the cached copy - Type: String
+    :return: The copy's details (etag and content_encoding), or None if there is no
+    usable copy - Type: Dict
+    :return: The object's contents, or None if there is no usable copy - Type: Bytes
+    """
+    try:
+        with open(path, "rb") as cache_file:
+            header = json.loads(cache_file.readline())
+            return header, cache_file.read()
+    except (OSError, ValueError):
+        return None, None
+
+
+def _read_cached_object(s3, bucket_name, full_file_name, if_match=None):
+    """
+    Reads an S3 object through the disk cache. A cached copy is sent as the ETag of a
+    conditional GET, so it is only used if S3 confirms the object has not changed;
+    otherwise the new contents come back in the same request and replace the copy.
+    The cache is best effort: if the copy can't be written (eg. the directory is not
+    writable or the disk is full), the downloaded contents are still returned.
+    :param s3: S3 client - Type: Boto3 Client
+    :param bucket_name: Name of the S3 bucket - Type: String
+    :param full_file_name: Key of the object - Type: String
+    :param if_match: Optional, the ETag the object must have - Type: String
+    :return: The object's contents - Type: Bytes or Bytearray
+    :return: The object's Content-Encoding, if it has one - Type: String
+    """
+    path = _disk_cache_path(bucket_name, full_file_name)
+    header, cached_data = _read_cache_file(path)
+    try:
+        data, content_encoding, etag = _read_object(
+            s3, bucket_name, full_file_name, header and header["etag"], if_match)
+    except botocore_exceptions.ClientError as e:
+        if not header or e.response["Error"]["Code"] not in ("304", "NotModified"):
+            raise
+        _count_disk_cache("hits")
+        try:
+            # Marks the copy as recently used.
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return cached_data, header["content_encoding"]
+
+    _count_disk_cache("misses")
+    if etag and len(data) <= disk_cache_max_size:
+        try:
+            _write_cache_file(path, {"etag": etag, "content_encoding": content_encoding},
+                              data)
+            _evict_disk_cache()
+        except OSError:
+            pass
+    return data, content_encoding
+
+
+def _read_dataframe(bucket_name, file_name, file_prefix, file_extension, parse,
+                    dtypes=None):
+    """
+    Reads a file with read_from_s3 and parses it into a DataFrame. If
+    dataframe_cache_max_size is set, the parsed DataFrame is cached by bucket, key and
+    ETag, so reading an unchanged file again costs a HEAD request instead of a download
+    and a parse. The file is only downloaded if it still has the ETag of the HEAD, so
+    a DataFrame is never cached under the ETag of another version.
+    Each caller is given its own copy, so changing it cannot corrupt the cache. With
+    pandas copy-on-write the copy is shallow, and the cached arrays are read-only, so
+    writing to them directly (eg. through to_numpy) raises an error; columns that can't
+    be made read-only (extension arrays, eg. categories) are copied for each caller.
+    Without copy-on-write (before pandas 3, unless turned on) the copy is deep.
+    :param bucket_name: Name of the S3 bucket - Type: String
+    :param file_name: Name of the file - Type: String
+    :param file_prefix: Run id to be added as file name prefix - Type: String
+    :param file_extension: The file extension that the file has - Type: String
+    :param parse: Function taking the file's contents, extension and dtypes and
+    returning a DataFrame - Type: Function
+    :param dtypes: Optional, dtypes to convert columns to, see _convert_columns
+    - Type: Dict or String
+    :return: The DataFrame - Type: DataFrame
+    """
+    global _dataframe_cache_size
+    if not dataframe_cache_max_size:
+        return parse(read_from_s3(bucket_name, file_name, file_prefix, file_extension),
+                     file_extension, dtypes)
+
+    full_file_name = file_prefix + file_name + file_extension
+    try:
+        with _measure("transfer_time"):
+            etag = get_client("s3").head_object(Bucket=bucket_name,
+                                                Key=full_file_name)["ETag"]
+    except Exception as e:
+        raise Exception(f"Could not find s3://{bucket_name}/{full_file_name}.{type(e)}")
+    cache_key = (bucket_name, full_file_name, etag, parse.__name__, _dtypes_key(dtypes))
+    with _dataframe_cache_lock:
+        if cache_key in _dataframe_cache:
+            _dataframe_cache.move_to_end(cache_key)
+            _dataframe_cache_stats["hits"] += 1
+            dataframe, _, unlocked = _dataframe_cache[cache_key]
+            return _cached_copy(dataframe, unlocked)
+        _dataframe_cache_stats["misses"] += 1
+
+    dataframe = parse(_read_file(bucket_name, full_file_name, file_extension, etag),
+                      file_extension, dtypes)
+    size = int(dataframe.memory_usage(deep=True).sum())
+    if size > dataframe_cache_max_size:
+        return dataframe
+    unlocked = _lock_dataframe(dataframe)
+    with _dataframe_cache_lock:
+        # Older versions of the file will not be asked for again.
+        for stale_key in [key for key in _dataframe_cache
+                          if key[:2] == cache_key[:2] and key[3:] == cache_key[3:]]:
+            _dataframe_cache_size -= _dataframe_cache.pop(stale_key)[1]
+        _dataframe_cache[cache_key] = (dataframe, size, unlocked)
+        _dataframe_cache_size += size
+        while _dataframe_cache_size > dataframe_cache_max_size:
+            _dataframe_cache_size -= _dataframe_cache.popitem(last=False)[1][1]
+            _dataframe_cache_stats["evictions"] += 1
+    return _cached_copy(dataframe, unlocked)
+
+
+def _read_file(bucket_name, full_file_name, file_extension, if_match=None):
+    """
+    Reads a file for read_from_s3, decompressing and decoding it.
+    :param bucket_name: Name of the S3 bucket - Type: String
+    :param full_file_name: Key of the file - Type: String
+    :param file_extension: The file extension that the file has - Type: String
+    :param if_match: Optional, the ETag the file must have - Type: String
+    :return: The file - Type: String (Bytes for .parquet and .feather extensions)
+    """
+    s3 = get_client("s3")
+    try:
+        with _measure("transfer_time"):
+            if disk_cache_directory:
+                input_file, content_encoding = _read_cached_object(
+                    s3, bucket_name, full_file_name, if_match)
+            else:
+                input_file, content_encoding = _read_object(
+                    s3, bucket_name, full_file_name, if_match=if_match,
+                    decompress=True)[:2]
+        decompressor = _decompressor(content_encoding)
+        if decompressor:
+            input_file = decompressor.decompress(input_file) + decompressor.flush()
+        if file_extension not in columnar_extensions:
+            input_file = input_file.decode("UTF-8")
+    except Exception as e:
+        raise Exception(f"Could not find s3://{bucket_name}/{full_file_name}.{type(e)}")
+    return input_file
+
+
+def _read_many(read_function, files, max_workers):
+    """
+    Calls read_function concurrently for each entry of files and collects the results
+    in the same order. A failed read does not stop the others, its error is returned
+    in place of the data.
+    :param read_function: Function to read one file (eg. read_from_s3) - Type: Function
+    :param files: Tuples of arguments for read_function, (bucket_name, file_name) with
+    optional file_prefix and file_extension - Type: List
+    :param max_workers: Number of files to read at once - Type: Int
+    :return: One dict per file with bucket, key, data and error - Type: List
+    """
+    with ThreadPoolExecutor(max_workers) as executor:
+        futures = [executor.submit(read_function, *file) for file in files]
+
+    results = []
+    for file, future in zip(files, futures):
+        bucket_name, file_name, file_prefix, file_extension = \
+            tuple(file) + ("", ".json")[len(file) - 2:]
+        error = future.exception()
+        results.append({
+            "bucket": bucket_name,
+            "key": file_prefix + file_name + file_extension,
+            "data": None if error else future.result(),
+            "error": error
+        })
+    return results
+
+
+def _read_object(s3, bucket_name, full_file_name, if_none_match=None, if_match=None,
+                 decompress=False):
+    """
+    Reads the contents of an S3 object. The first request asks for the first
+    ranged_get_threshold bytes, so smaller objects still take a single request. The rest
+    of a larger object is fetched with concurrent ranged GETs, each written straight
+    into its slice of one preallocated buffer.
+    With decompress, a compressed object is instead decompressed as it is read, from
+    the first response and then a single GET of the rest, so that the compressed data
+    is never held whole.
+    :param s3: S3 client - Type: Boto3 Client
+    :param bucket_name: Name of the S3 bucket - Type: String
+    :param full_file_name: Key of the object - Type: String
+    :param if_none_match: Optional, an ETag to make the read conditional on. If the
+    object still has this ETag a 304 ClientError is raised - Type: String
+    :param if_match: Optional, the ETag the object must have. If it has changed a 412
+    ClientError is raised - Type: String
+    :param decompress: Optional, decompress the object as it is read - Type: Boolean
+    :return: The object's contents - Type: Bytes or Bytearray
+    :return: The object's Content-Encoding, if it has one and it was not decompressed
+    - Type: String
+    :return: The object's ETag - Type: String
+    """
+    conditions = {"IfNoneMatch": if_none_match} if if_none_match else {}
+    if if_match:
+        conditions["IfMatch"] = if_match
+    if ranged_get_threshold:
+        conditions["Range"] = f"bytes=0-{ranged_get_threshold - 1}"
+    try:
+        response = s3.get_object(Bucket=bucket_name, Key=full_file_name, **conditions)
+    except botocore_exceptions.ClientError as e:
+        # Any range of an empty object is unsatisfiable.
+        if not ranged_get_threshold or e.response["Error"]["Code"] != "InvalidRange":
+            raise
+        return b"", None, None
+    content_encoding = response.get("ContentEncoding")
+    etag = response.get("ETag")
+    decompressor = _decompressor(content_encoding) if decompress else None
+    if decompressor:
+        output = bytearray()
+        _decompress_body(response["Body"], decompressor, output)
+        if "ContentRange" in response:
+            match = re.match(r"bytes \d+-(\d+)/(\d+)", response["ContentRange"])
+            start, total_size = int(match.group(1)) + 1, int(match.group(2))
+            if start < total_size:
+                rest = s3.get_object(Bucket=bucket_name, Key=full_file_name,
+                                     IfMatch=etag, Range=f"bytes={start}-")
+                _decompress_body(rest["Body"], decompressor, output)
+        output += decompressor.flush()
+        return output, None, etag
+
+    first_part = response["Body"].read()
+    _add_to_call("bytes", len(first_part))
+    if "ContentRange" not in response:
+        return first_part, content_encoding, etag
+    total_size = int(response["ContentRange"].rsplit("/", 1)[1])
+    if len(first_part) >= total_size:
+        return first_part, content_encoding, etag
+
+    buffer = bytearray(total_size)
+    view = memoryview(buffer)
+    view[:len(first_part)] = first_part
+    starts = range(len(first_part), total_size, ranged_get_chunksize)
+    del first_part
+    with ThreadPoolExecutor(ranged_get_max_workers) as executor:
+        futures = [executor.submit(_read_range, s3, bucket_name, full_file_name,
+                                   etag, start,
+                                   view[start:start + ranged_get_chunksize])
+                   for start in starts]
+        for future in futures:
+            future.result()
+    # The ranges are read in other threads, so are counted here.
+    _add_to_call("bytes", total_size - starts.start)
+    return buffer, content_encoding, etag
+
+
+def _read_range(s3, bucket_name, full_file_name, etag, start, view):
+    """
+    Reads one byte range of an S3 object into view. The ETag is checked so that a file
+    replaced part way through the read fails instead of returning mixed contents.
+    :param s3: S3 client - Type: Boto3 Client
+    :param bucket_name: Name of the S3 bucket - Type: String
+    :param full_file_name: Key of the object - Type: String
+    :param etag: ETag of the object from the first request - Type: String
+    :param start: Offset of the range in the object - Type: Int
+    :param view: The slice of the buffer to fill - Type: Memoryview
+    :return: None
+    """
+    body = s3.get_object(Bucket=bucket_name, Key=full_file_name, IfMatch=etag,
+                         Range=f"bytes={start}-{start + len(view) - 1}")["Body"]
+    position = 0
+    while position < len(view):
+        if hasattr(body, "readinto"):
+            amount_read = body.readinto(view[position:])
+        else:
+            data = body.read(min(len(view) - position, 1024 * 1024))
+            amount_read = len(data)
+            view[position:position + amount_read] = data
+        if not amount_read:
+            raise IOError(f"s3://{bucket_name}/{full_file_name} ended early.")
+        position += amount_read
+
+
+def _receive_data(queue_url, bucket_name, key, incoming_message_group, file_prefix,
+                  file_extension):
+    """
+    Works out which file get_data and get_dataframe should read. If the next message on
+    the queue is from the preceding module, its bucket and key are used, otherwise the
+    bucket_name and key given. If the message carries the data inline (see save_data)
+    there is nothing to read and the data is returned instead.
+    :param queue_url: The url of the queue to retrieve message from - Type: String
+    :param bucket_name: The default bucket name to use if no message from previous
+    module - Type: String
+    :param key: The default file name to use if no message from the previous
+    module - Type: String
+    :param incoming_message_group: The name of the message group from previous
+    module - Type: String
+    :param file_prefix: Run id to be added as file name prefix - Type: String
+    :param file_extension: The file extension that the submitted file should have.
+    :return: The bucket_name, file_name, file_prefix and file_extension to read
+    - Type: Tuple
+    :return: The data, if it was sent inline, else None - Type: String
+    (Bytes for columnar formats)
+    :return receipt_handle: The receipt_handle of the incoming message
+    (used to delete old message) - Type: String
+    """
+    response = get_sqs_message(queue_url)
+    if "Messages" not in response or (
+        "Messages" in response
+        and (
+            response["Messages"][0]["Attributes"]["MessageGroupId"]
+            != incoming_message_group
+        )
+    ):
+        return (bucket_name, key, "", ".json"), None, None
+
+    message = response["Messages"][0]
+    receipt_handle = message["ReceiptHandle"]
+    message = json.loads(message["Body"])
+    if "data" in message:
+        return None, _decode_inline_message(message), receipt_handle
+    return (message["bucket"], message["key"], file_prefix, file_extension), None, \
+        receipt_handle
+
+
+def _run_in_call(record, function, *args, **kwargs):
+    """
+    Runs a function with its work added to record. Used to start recording a call, and
+    to carry the record of a call over to the threads it hands work to.
+    :param record: The call's record, or None if calls are not being recorded
+    - Type: Dict
+    :param function: The function to run - Type: Function
+    :return: The function's result
+    """
+    if record is None:
+        return function(*args, **kwargs)
+    _call_state.record = record
+    _call_state.section = None
+    try:
+        return function(*args, **kwargs)
+    finally:
+        _call_state.record = None
+        _call_state.section = None
+
+
+def _send_sqs_batch(sqs, queue_url, batch, stopped_groups):
+    """
+    Sends one batch of entries to SQS. Entries that fail through no fault of their own
+    are retried, without resending the ones that succeeded.
+    On a FIFO queue the messages of a group must arrive in order, so an entry that
+    fails is resent together with the later entries of its group. Those that SQS had
+    already accepted are resent under a new de-duplication id, so they may arrive
+    twice, but the last copy is in order. Once an entry has failed for good, the later
+    entries of its group are not sent, and are reported as failed.
+    :param sqs: SQS client - Type: Boto3 Client
+    :param queue_url: The url of the SQS queue. - Type: String
+    :param batch: Up to 10 entries for send_message_batch - Type: List
+    :param stopped_groups: Groups in which an entry has failed for good, added to as
+    entries fail - Type: Set
+    :return: The Successful and Failed entries - Type: Dict
+    """
+    results = {}
+    pending = batch
+    for attempt in range(sqs_batch_retries + 1):
+        sending = []
+        for entry in pending:
+            if entry.get("MessageGroupId") in stopped_groups:
+                results[entry["Id"]] = ("Failed", {
+                    "Id": entry["Id"], "SenderFault": False,
+                    "Code": "PrecedingMessageFailed",
+                    "Message": "An earlier message in the group failed."})
+            else:
+                sending.append(entry)
+        if not sending:
+            break
+        if attempt:
+            _add_to_call("retries", 1)
+        _add_to_call("bytes", sum(len(entry["MessageBody"]) for entry in sending))
+        with _measure("transfer_time"):
+            response = sqs.send_message_batch(QueueUrl=queue_url, Entries=sending)
+        for entry in response.get("Successful", []):
+            results[entry["Id"]] = ("Successful", entry)
+        failed = {entry["Id"]: entry for entry in response.get("Failed", [])}
+
+        pending = []
+        failed_groups = set()
+        for entry in sending:
+            group = entry.get("MessageGroupId")
+            failure = failed.get(entry["Id"])
+            if failure and (failure["SenderFault"] or attempt == sqs_batch_retries):
+                results[entry["Id"]] = ("Failed", failure)
+                if group is not None:
+                    stopped_groups.add(group)
+            elif failure:
+                pending.append(entry)
+                if group is not None:
+                    failed_groups.add(group)
+            elif group in failed_groups:
+                # Accepted ahead of an earlier entry of its group, so sent again after
+                # it.
+                pending.append(dict(entry,
+                                    MessageDeduplicationId=str(random.getrandbits(128))))
+        if not pending:
+            break
+        time.sleep(0.1 * 2 ** attempt)
+
+    result = {"Successful": [], "Failed": []}
+    for entry in batch:
+        if entry["Id"] in results:
+            outcome, response_entry = results[entry["Id"]]
+            result[outcome].append(response_entry)
+    return result
+
+
+def _split_parts(data, part_size):
+    """
+    Splits data into parts of part_size bytes for a multipart upload. Parts are sliced
+    as they are requested, so only the parts being uploaded are copied.
+    :param data: The data to split - Type: Bytes
+    :param part_size: Number of bytes per part - Type: Int
+    :return: Generator of Bytes
+    """
+    for start in range(0, len(data), part_size):
+        yield data[start:start + part_size]
+
+
+def _sqs_entry(entry_id, message, message_id, fifo, deduplication_id=None):
+    """
+    Builds an entry for send_message_batch, with the same group and de-duplication
+    settings that send_sqs_message uses.
+    :param entry_id: Id of the entry, unique within its batch - Type: String
+    :param message: The message/data you wish to send to the SQS queue - Type: String
+    :param message_id: The label of the record in the SQS queue - Type: String
+    :param fifo: Type of SQS queue - Type: Boolean
+    :param deduplication_id: Optional, de-duplication id for a FIFO queue, random if
+    not given - Type: String
+    :return: The entry - Type: Dict
+    """
+    entry = {"Id": entry_id, "MessageBody": message}
+    if fifo:
+        entry["MessageGroupId"] = message_id
+        entry["MessageDeduplicationId"] = deduplication_id or \
+            str(random.getrandbits(128))
+    return entry
+
+
+def _to_columnar(data, file_extension):
+    """
+    Serialises data to Parquet or Feather bytes. The index is not stored, in line with
+    the JSON records the other formats use.
+    :param data: The data to convert - Type: DataFrame or JSON string
+    :param file_extension: The file extension, one of columnar_extensions - Type: String
+    :return: The serialised data - Type: Bytes
+    """
+    if not isinstance(data, pd.DataFrame):
+        data = pd.DataFrame(json_codecs.loads(data))
+    buffer = BytesIO()
+    if file_extension == ".parquet":
+        data.to_parquet(buffer, index=False)
+    else:
+        data.reset_index(drop=True).to_feather(buffer)
+    return buffer.getvalue()
+
+
+def _to_json(data):
+    """
+    Serialises a DataFrame to a JSON array of records, as
+    json.dumps(data.to_dict("records")) would but faster (see
+    json_codecs.dumps_dataframe). Anything else is returned as it is.
+    :param data: The data to convert - Type: DataFrame or JSON string
+    :return: The JSON - Type: String
+    """
+    if isinstance(data, (str, bytes, bytearray)) or not isinstance(data, pd.DataFrame):
+        return data
+    with _measure("build_time"):
+        return json_codecs.dumps_dataframe(data)
+
+
+def _upload_part(s3, bucket_name, full_file_name, upload_id, part_number, body):
+    """
+    Uploads one part of a multipart upload, retrying with backoff if it fails.
+    :param s3: S3 client - Type: Boto3 Client
+    :param bucket_name: Name of the bucket to upload to - Type: String
+    :param full_file_name: Key of the object - Type: String
+    :param upload_id: Id of the multipart upload - Type: String
+    :param part_number: Position of the part in the object, from 1 - Type: Int
+    :param body: The part's data - Type: Bytes
+    :return: The completed part's details - Type: Dict
+    """
+    for attempt in range(multipart_part_retries + 1):
+        try:
+            response = s3.upload_part(Bucket=bucket_name, Key=full_file_name,
+                                      UploadId=upload_id, PartNumber=part_number,
+                                      Body=body)
+            return {"ETag": response["ETag"], "PartNumber": part_number}
+        except (botocore_exceptions.BotoCoreError, botocore_exceptions.ClientError):
+            if attempt == multipart_part_retries:
+                raise
+            _add_to_call("retries", 1)
+            time.sleep(0.1 * 2 ** attempt)
+
 
+def _write_cache_file(path, header, data):
+    """
+    Writes a copy of an S3 object to the disk cache. The copy is written to a temporary
+    file and then renamed into place, so a reader in another thread or process sees
+    either the old copy or the new one, never a partly written file.
+    :param path: Path of the cached copy - Type: String
+    :param header: The copy's details (etag and content_encoding) - Type: Dict
+    :param data: The object's contents - Type: Bytes or Bytearray
+    :return: None
+    """
+    os.makedirs(disk_cache_directory, exist_ok=True)
+    handle, temporary_path = tempfile.mkstemp(dir=disk_cache_directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as cache_file:
+            cache_file.write(json.dumps(header).encode("UTF-8") + b"\n")
+            cache_file.write(data)
+        os.replace(temporary_path, path)
+    except BaseException:
+        try:
+            os.remove(temporary_path)
+        except FileNotFoundError:
+            # clear_disk_cache removed it first.
+            pass
+        raise
+
+
+def add_instrumentation_hook(hook):
+    """
+    Adds a function to be called with a record of every call made to the aws_functions
+    that read, write or send data, from any thread. Instrumentation does this for you
+    and logs the results; use this for anything else, eg. sending metrics elsewhere.
+    :param hook: Function taking the call's record: a dict of call (the function's
+    name), wall_time, transfer_time, parse_time and build_time (seconds), bytes,
+    retries and error (the exception's name, or None) - Type: Function
+    :return: None
+    """
+    global _instrumentation_hooks
+    with _instrumentation_lock:
+        _instrumentation_hooks += (hook,)
+
+
+def clear_dataframe_cache():
+    """
+    Removes every DataFrame from the DataFrame cache and resets its counters.
+    :return: None
+    """
+    global _dataframe_cache_size
+    with _dataframe_cache_lock:
+        _dataframe_cache.clear()
+        _dataframe_cache_size = 0
+        for statistic in _dataframe_cache_stats:
+            _dataframe_cache_stats[statistic] = 0
+
+
+def clear_disk_cache():
+    """
+    Removes every file from the disk cache and resets its counters.
+    :return: None
+    """
+    if disk_cache_directory and os.path.isdir(disk_cache_directory):
+        for name in os.listdir(disk_cache_directory):
+            try:
+                os.remove(os.path.join(disk_cache_directory, name))
+            except FileNotFoundError:
+                pass
+    with _disk_cache_lock:
+        for statistic in _disk_cache_stats:
+            _disk_cache_stats[statistic] = 0
+
+
+@_instrumented
 def delete_data(bucket_name, file_name, file_prefix="", file_extension=".json"):
     """
-    Deletes specified file from specified S3 bucket.
-    Checks if file exists before deletion.
-    If file does not exist, return error message.
+    Deletes specified file from specified S3 bucket, in a single request.
+    S3 does not report whether the file existed, so deleting a file that does not
+    exist also succeeds. If the delete fails, return error message.
 
     :param bucket_name: The name of the bucket containing the file - Type: String
     :param file_name: The name of the file being deleted - Type: String
@@ -27,19 +1507,83 @@ def delete_data(bucket_name, file_name, file_prefix="", file_extension=".json"):
     :param file_extension: The file extension that the submitted file should have.
     :return: Success or error message - Type: String
     """
-    s3 = boto3.resource('s3', region_name=region)
+    s3 = get_client("s3")
     try:
         full_file_name = file_name + file_extension
         if len(file_prefix) > 0:
             full_file_name = file_prefix + full_file_name
 
-        s3.Object(bucket_name, full_file_name).load()
-        s3.Object(bucket_name, full_file_name).delete()
+        with _measure("transfer_time"):
+            s3.delete_object(Bucket=bucket_name, Key=full_file_name)
         return "Succesfully deleted file from S3 bucket."
-    except ClientError:
+    except botocore_exceptions.ClientError:
         return "File does not exist in specified bucket!"
 
 
+@_instrumented
+def delete_data_by_prefix(bucket_name, file_prefix, max_workers=10):
+    """
+    Deletes every file in the S3 bucket whose name starts with file_prefix, eg. all of
+    a run's intermediate files. Files are listed a page at a time and each page of up
+    to 1000 files is removed with a single delete_objects request, several pages at
+    once.
+
+    :param bucket_name: The name of the bucket containing the files - Type: String
+    :param file_prefix: The prefix of the files being deleted, must not be empty
+    - Type: String
+    :param max_workers: Optional, number of delete requests to make at once - Type: Int
+    :return: The keys deleted and the errors for any that could not be, as
+    delete_objects returns them - Type: Dict
+    """
+    if not file_prefix:
+        raise ValueError("A file_prefix is needed, refusing to empty the bucket.")
+    s3 = get_client("s3")
+    paginator = s3.get_paginator("list_objects_v2")
+    report = {"Deleted": [], "Errors": []}
+    with _measure("transfer_time"), ThreadPoolExecutor(max_workers) as executor:
+        futures = []
+        for page in paginator.paginate(Bucket=bucket_name, Prefix=file_prefix,
+                                       PaginationConfig={"PageSize": 1000}):
+            keys = [{"Key": s3_object["Key"]} for s3_object in page.get("Contents", [])]
+            if keys:
+                futures.append(executor.submit(
+                    s3.delete_objects, Bucket=bucket_name,
+                    Delete={"Objects": keys, "Quiet": False}))
+        for future in futures:
+            response = future.result()
+            report["Deleted"] += [deleted["Key"] for deleted in
+                                  response.get("Deleted", [])]
+            report["Errors"] += response.get("Errors", [])
+    return report
+
+
+def get_client(service_name, region_name=None):
+    """
+    Returns a boto3 client for the given service and region. The client is created on
+    first use and then reused by every later call (and warm lambda invocation), so its
+    connection pool stays open. Clients are thread-safe and shared between threads.
+    :param service_name: Name of the AWS service (eg. s3, sqs, sns) - Type: String
+    :param region_name: Optional, region of the client (default is region)
+    - Type: String
+    :return client: The cached client - Type: Boto3 Client
+    """
+    key = (service_name, region_name or region)
+    client = _clients.get(key)
+    if client is None:
+        with _client_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = boto3.client(
+                    service_name,
+                    region_name=key[1],
+                    config=botocore_config.Config(
+                        max_pool_connections=max_pool_connections)
+                )
+                _clients[key] = client
+    return client
+
+
+@_instrumented
 def get_data(queue_url, bucket_name, key, incoming_message_group, file_prefix="",
              file_extension=".json"):
     """
@@ -55,6 +1599,7 @@ def get_data(queue_url, bucket_name, key, incoming_message_group, file_prefix=""
 
     Data is returned as a json string. To use as dataframe you will need to json.loads
     and pd.dataframe() the response.
+    Data that save_data sent inline in the message is returned without reading s3.
     :param queue_url: The url of the queue to retrieve message from - Type: String
     :param bucket_name: The default bucket name to use if no message from previous
     module - Type: String
@@ -65,33 +1610,21 @@ def get_data(queue_url, bucket_name, key, incoming_message_group, file_prefix=""
     :param file_prefix: Optional, run id to be added as file name prefix - Type: String
     :param file_extension: The file extension that the submitted file should have.
     :return data: The data from s3 - Type: Json
+    (Bytes for .parquet and .feather extensions)
     :return receipt_handle: The receipt_handle of the incoming message
     (used to delete old message) - Type: String
     """
-    response = get_sqs_message(queue_url)
-    receipt_handle = None
-    if "Messages" not in response or (
-        "Messages" in response
-        and (
-            response["Messages"][0]["Attributes"]["MessageGroupId"]
-            != incoming_message_group
-        )
-    ):
-        bucket = bucket_name
-        key = key
-        data = read_from_s3(bucket, key)
-    else:
-        message = response["Messages"][0]
-        receipt_handle = message["ReceiptHandle"]
-        message = json.loads(message["Body"])
-        bucket = message["bucket"]
-        key = message["key"]
-        data = read_from_s3(bucket, key, file_prefix, file_extension)
+    location, data, receipt_handle = _receive_data(
+        queue_url, bucket_name, key, incoming_message_group, file_prefix,
+        file_extension)
+    if location:
+        data = read_from_s3(*location)
     return data, receipt_handle
 
 
+@_instrumented
 def get_dataframe(queue_url, bucket_name, key, incoming_message_group, file_prefix="",
-                  file_extension=".json"):
+                  file_extension=".json", dtypes=None):
     """
     Get data function recieves a message from an sqs queue,
     extracts the bucket and filename, then uses them to get the file from s3.
@@ -103,7 +1636,12 @@ def get_dataframe(queue_url, bucket_name, key, incoming_message_group, file_pref
     get_sqs_message when the data size approaches this figure. Used in conjunction with
     save_data
 
-    Data is returned as a DataFrame.
+    Data is returned as a DataFrame. If dataframe_cache_max_size is set, DataFrames
+    are cached and each caller given a copy, as read_dataframe_from_s3. Data that
+    save_data sent inline in the message is parsed without reading s3.
+    With dtypes, columns are converted to smaller dtypes (eg. category, int32) as the
+    DataFrame is built, and a report of the bytes saved per column is kept in
+    data.attrs["dtype_report"].
 
     :param queue_url: The url of the queue to retrieve message from - Type: String
     :param bucket_name: The default bucket name to use if no message from previous
@@ -114,50 +1652,146 @@ def get_dataframe(queue_url, bucket_name, key, incoming_message_group, file_pref
     module - Type: String
     :param file_prefix: Optional, run id to be added as file name prefix - Type: String
     :param file_extension: The file extension that the submitted file should have.
+    :param dtypes: Optional, dtype of each column by name, eg. {"region": "category"},
+    or "compact" to use the smallest dtype that holds each column's values
+    - Type: Dict or String
     :return data: The data from s3 - Type: DataFrame
     :return receipt_handle: The receipt_handle of the incoming message
     (used to delete old message) - Type: String
     """
-    data, receipt_handle = get_data(queue_url, bucket_name, key,
-                                    incoming_message_group, file_prefix, file_extension)
-    data = pd.read_json(data, dtype=False)
+    location, data, receipt_handle = _receive_data(
+        queue_url, bucket_name, key, incoming_message_group, file_prefix,
+        file_extension)
+    if location:
+        data = _read_dataframe(*location, _parse_json_dataframe, dtypes)
+    else:
+        data = _parse_json_dataframe(data, file_extension, dtypes)
     return data, receipt_handle
 
 
-def get_sqs_message(queue_url, max_number_of_messages=1):
+def get_dataframe_cache_stats():
+    """
+    Returns the DataFrame cache's counters since the container started or the cache was
+    last cleared, and how much it holds.
+    :return: Counts of hits, misses and evictions, the number of DataFrames held
+    (entries) and their size in bytes (size) - Type: Dict
+    """
+    with _dataframe_cache_lock:
+        return dict(_dataframe_cache_stats, entries=len(_dataframe_cache),
+                    size=_dataframe_cache_size)
+
+
+def get_disk_cache_stats():
+    """
+    Returns the disk cache's counters since the container started or the cache was
+    last cleared. A hit is a cached copy confirmed by S3, a miss a file downloaded.
+    :return: Counts of hits, misses and evictions - Type: Dict
+    """
+    with _disk_cache_lock:
+        return dict(_disk_cache_stats)
+
+
+def get_resource(service_name, region_name=None):
+    """
+    Returns a boto3 resource for the given service and region. Boto3 resources are not
+    thread-safe, so one is created per thread on first use and reused afterwards.
+    :param service_name: Name of the AWS service (eg. s3) - Type: String
+    :param region_name: Optional, region of the resource (default is region)
+    - Type: String
+    :return resource: The cached resource - Type: Boto3 Resource
+    """
+    key = (service_name, region_name or region)
+    if getattr(_resources, "generation", None) != _generation:
+        _resources.cache = {}
+        _resources.generation = _generation
+    resource = _resources.cache.get(key)
+    if resource is None:
+        # The default boto3 session is not thread-safe, so creation is serialised.
+        with _client_lock:
+            resource = boto3.resource(
+                service_name,
+                region_name=key[1],
+                config=botocore_config.Config(
+                    max_pool_connections=max_pool_connections)
+            )
+        _resources.cache[key] = resource
+    return resource
+
+
+@_instrumented
+def get_sqs_message(queue_url, max_number_of_messages=1, wait_time_seconds=None):
     """
     This method retrieves the data from the specified SQS queue.
     :param queue_url: The url of the SQS queue. - Type: String
     :param max_number_of_messages: Number of messages to pick up from queue(default 1)
      - Type: Int
+    :param wait_time_seconds: Optional, seconds to long poll for messages, up to 20
+    (default is the queue's own setting) - Type: Int
     :return: Messages from queue - Type: json string
     """
-    sqs = boto3.client("sqs", region_name=region)
-    return sqs.receive_message(QueueUrl=queue_url, AttributeNames=["MessageGroupId"],
-                               MaxNumberOfMessages=max_number_of_messages)
+    sqs = get_client("sqs")
+    with _measure("transfer_time"):
+        if wait_time_seconds is None:
+            response = sqs.receive_message(QueueUrl=queue_url,
+                                           AttributeNames=["MessageGroupId"],
+                                           MaxNumberOfMessages=max_number_of_messages)
+        else:
+            response = sqs.receive_message(QueueUrl=queue_url,
+                                           AttributeNames=["MessageGroupId"],
+                                           MaxNumberOfMessages=max_number_of_messages,
+                                           WaitTimeSeconds=wait_time_seconds)
+    _add_to_call("bytes", sum(len(message["Body"])
+                              for message in response.get("Messages", [])))
+    return response
 
 
-def get_sqs_messages(sqs_queue_url, number_of_messages, incoming_message_group):
+@_instrumented
+def get_sqs_messages(sqs_queue_url, number_of_messages, incoming_message_group,
+                     timeout=0):
     """
     This method retrieves a number of messages from the sqs queue.
-    It takes 10 messages from the queue, then checks each to see if it comes from
-    the appropriate message_group.
+    It takes messages from the queue 10 at a time, keeping each that comes from
+    the appropriate message_group, until number_of_messages have been collected.
+    If they are not all visible yet, it long polls for the rest until timeout seconds
+    have passed. Messages received more than once are only counted once, and keep the
+    ReceiptHandle of the latest receive, as only that one can delete them.
 
     :param sqs_queue_url: The url of the SQS queue. - Type: String
     :param number_of_messages: Number of messages expected
                 (will raise error if not met): Type - Int
     :param incoming_message_group: The message group of messages to collect.
+    :param timeout: Optional, seconds to keep waiting for messages. With the default
+    of 0, stops as soon as the queue returns no more messages - Type: Int
     :return: Messages from queue - List of Json Strings
     """
     messages = {"Messages": []}
-    # Grab 10 messages from queue
-    responses = get_sqs_message(sqs_queue_url, 10)
-    if "Messages" not in responses:
+    received = {}
+    received_any = False
+    deadline = time.monotonic() + timeout
+    while len(messages["Messages"]) < number_of_messages:
+        wait_time_seconds = None
+        if timeout:
+            # Rounded up, as a wait of 0 would poll without waiting until the deadline.
+            wait_time_seconds = min(20, max(0, math.ceil(deadline - time.monotonic())))
+        responses = get_sqs_message(sqs_queue_url, 10, wait_time_seconds)
+        new_messages = []
+        for response in responses.get("Messages", []):
+            if response["MessageId"] in received:
+                received[response["MessageId"]]["ReceiptHandle"] = \
+                    response["ReceiptHandle"]
+            else:
+                new_messages.append(response)
+        received_any = received_any or bool(new_messages)
+        # Loop through the messages to see if they fit criteria
+        for response in new_messages:
+            received[response["MessageId"]] = response
+            if incoming_message_group in response['Attributes']['MessageGroupId']:
+                messages["Messages"].append(response)
+        if not new_messages and deadline - time.monotonic() <= 0:
+            break
+
+    if not received_any:
         raise exception_classes.NoDataInQueueError("No Messages in queue")
-    # Loop through the messages to see if they fit criteria
-    for response in responses['Messages']:
-        if incoming_message_group in response['Attributes']['MessageGroupId']:
-            messages["Messages"].append(response)
     if len(messages['Messages']) < number_of_messages:
         raise exception_classes.DoNotHaveAllDataError(
             "Only " + str(len(messages["Messages"])) + " recieved"
@@ -165,55 +1799,139 @@ def get_sqs_messages(sqs_queue_url, number_of_messages, incoming_message_group):
     return messages
 
 
+@_instrumented
 def read_dataframe_from_s3(bucket_name, file_name, file_prefix="",
-                           file_extension=".json"):
+                           file_extension=".json", dtypes=None):
     """
     Given the name of the bucket and the filename(key), this function will
     return contents of a file. File is DataFrame format.
+    If dataframe_cache_max_size is set, the DataFrame is cached by bucket, key and ETag
+    and each caller given its own copy, which can be changed without changing the cache.
+    With dtypes, columns are converted to smaller dtypes (eg. category, int32) one at a
+    time as the DataFrame is built, so the peak memory is lower too. A report of the
+    bytes saved per column is kept in input_file.attrs["dtype_report"].
     :param bucket_name: Name of the S3 bucket - Type: String
     :param file_name: Name of the file - Type: String
     :param file_prefix: Optional, run id to be added as file name prefix - Type: String
     :param file_extension: The file extension that the submitted file should have.
+    :param dtypes: Optional, dtype of each column by name, eg. {"region": "category"},
+    or "compact" to use the smallest dtype that holds each column's values
+    - Type: Dict or String
     :return: input_file: The JSON file in S3 loaded into dataframe table - Type: DataFrame
     """
-    input_file = read_from_s3(bucket_name, file_name, file_prefix, file_extension)
-    json_content = json.loads(input_file)
-    return pd.DataFrame(json_content)
+    return _read_dataframe(bucket_name, file_name, file_prefix, file_extension,
+                           _parse_dataframe, dtypes)
 
 
+@_instrumented
 def read_from_s3(bucket_name, file_name, file_prefix="", file_extension=".json"):
     """
     Given the name of the bucket and the filename(key), this function will
     return a file. File is JSON format.
+    Files larger than ranged_get_threshold are read with concurrent ranged GETs.
+    Files saved with compression are decompressed. If disk_cache_directory is set the
+    file is read through the disk cache.
     :param bucket_name: Name of the S3 bucket - Type: String
     :param file_name: Name of the file - Type: String
     :param file_prefix: Optional, run id to be added as file name prefix - Type: String
     :param file_extension: The file extension that the submitted file should have.
     :return: input_file: The JSON file in S3 - Type: String
+    (Bytes for .parquet and .feather extensions)
     """
-    s3 = boto3.resource("s3", region_name=region)
     full_file_name = file_name + file_extension
     if len(file_prefix) > 0:
         full_file_name = file_prefix + full_file_name
-    try:
-        s3_object = s3.Object(bucket_name, full_file_name)
-        input_file = s3_object.get()["Body"].read().decode("UTF-8")
-    except Exception as e:
-        raise Exception(f"Could not find s3://{bucket_name}/{full_file_name}.{type(e)}")
-    return input_file
+    return _read_file(bucket_name, full_file_name, file_extension)
+
+
+@_instrumented
+def read_many_dataframes(files, concatenate=False, max_workers=10, dtypes=None):
+    """
+    Reads several files from s3 at once, as read_dataframe_from_s3 would, through the
+    shared s3 client. The total time is close to that of the slowest file rather than
+    the sum of them all.
+    :param files: Tuples of (bucket_name, file_name, file_prefix, file_extension),
+    file_prefix and file_extension are optional - Type: List
+    :param concatenate: Optional, join the results into one DataFrame. Raises if any
+    file could not be read - Type: Boolean
+    :param max_workers: Optional, number of files to read at once - Type: Int
+    :param dtypes: Optional, dtype of each column by name, eg. {"region": "category"},
+    or "compact" to use the smallest dtype that holds each column's values. Category
+    columns stay categories when the files are joined - Type: Dict or String
+    :return: One dict per file in the order given, with keys bucket, key, data
+    (DataFrame) and error (Exception or None) - Type: List
+    Or when concatenate is set, all of the data - Type: DataFrame
+    """
+    results = _read_many(functools.partial(read_dataframe_from_s3, dtypes=dtypes),
+                         files, max_workers)
+    if not concatenate:
+        return results
 
+    failed = [result for result in results if result["error"]]
+    if failed:
+        raise Exception("Could not read " + ", ".join(
+            f"s3://{result['bucket']}/{result['key']}" for result in failed) +
+            f". {failed[0]['error']}")
+    if not results:
+        return pd.DataFrame()
+    return _concat_dataframes([result["data"] for result in results])
 
+
+@_instrumented
+def read_many_from_s3(files, max_workers=10):
+    """
+    Reads several files from s3 at once, as read_from_s3 would, through the shared s3
+    client. The total time is close to that of the slowest file rather than the sum
+    of them all.
+    :param files: Tuples of (bucket_name, file_name, file_prefix, file_extension),
+    file_prefix and file_extension are optional - Type: List
+    :param max_workers: Optional, number of files to read at once - Type: Int
+    :return: One dict per file in the order given, with keys bucket, key, data
+    (String) and error (Exception or None) - Type: List
+    """
+    return _read_many(read_from_s3, files, max_workers)
+
+
+def remove_instrumentation_hook(hook):
+    """
+    Stops a function added with add_instrumentation_hook from being called. Once there
+    are no hooks, calls are no longer recorded.
+    :param hook: The function - Type: Function
+    :return: None
+    """
+    global _instrumentation_hooks
+    with _instrumentation_lock:
+        _instrumentation_hooks = tuple(added for added in _instrumentation_hooks
+                                       if added != hook)
+
+
+def reset_clients():
+    """
+    Discards every cached client and resource so that the next call creates new ones.
+    For use in tests that patch or mock boto3, and after changing max_pool_connections.
+    :return: None
+    """
+    global _generation
+    with _client_lock:
+        _clients.clear()
+        _generation += 1
+
+
+@_instrumented
 def save_data(bucket_name, file_name, data, queue_url, message_id, file_prefix="",
-              file_extension=".json"):
+              file_extension=".json", compression=None):
     """
     Save data function stores data in s3 and passes the bucket & filename
     onto sqs queue. SQS only supports message length of 256k, so this function
      is to be used instead of send_sqs_message
      when the data size approaches this figure. Used in conjunction with get_data
+    If sqs_inline_threshold is set, payloads no larger than it are sent inline in the
+    SQS message instead, and nothing is saved to s3.
     :param bucket_name: The name of the s3 bucket to use to save data
     - Type: String
     :param file_name: The name to give the file being saved - Type: String
     :param data: The data to be saved - Type Json string
+    (For .json, .parquet and .feather extensions a DataFrame may be given instead)
     :param queue_url: The url of the queue to use in sending the file details
     - Type: String
     :param message_id: The label of the message sent to sqs(Message_group_id,
@@ -221,52 +1939,110 @@ def save_data(bucket_name, file_name, data, queue_url, message_id, file_prefix="
     - Type: String
     :param file_prefix: Optional, run id to be added as file name prefix - Type: String
     :param file_extension: The file extension that the submitted file should have.
+    :param compression: Optional, compress the file with gzip or zstd - Type: String
     :return: Nothing
     """
-    save_to_s3(bucket_name, file_name, data, file_prefix, file_extension)
-    sqs_message = json.dumps({"bucket": bucket_name, "key": file_name})
+    if file_extension == ".json":
+        data = _to_json(data)
+    sqs_message = None
+    if sqs_inline_threshold:
+        sqs_message = _inline_message(data, file_extension, compression)
+    if sqs_message is None:
+        save_to_s3(bucket_name, file_name, data, file_prefix, file_extension,
+                   compression)
+        sqs_message = json_codecs.dumps({"bucket": bucket_name, "key": file_name})
     send_sqs_message(queue_url, sqs_message, message_id, fifo=True)
 
 
+@_instrumented
 def save_dataframe_to_csv(dataframe, bucket_name, file_name, file_prefix="",
-                          file_extension=".csv"):
+                          file_extension=".csv", compression=None, chunk_rows=10000):
     """
     This function takes a Dataframe and stores it in a specific bucket.
+    The CSV is written, encoded and compressed chunk_rows rows at a time and uploaded
+    in parts as it goes, so the whole file is never held in memory. Files larger than
+    multipart_threshold are sent as a multipart upload, as save_to_s3 would.
     :param dataframe: The Dataframe you wish to save - Type: Dataframe.
     :param bucket_name: Name of the bucket you wish to save the csv into - Type: String.
     :param file_name: The name given to the CSV - Type: String.
     :param file_prefix: Optional, run id to be added as file name prefix - Type: String
     :param file_extension: The file extension that the submitted file should have.
+    :param compression: Optional, compress the file with gzip or zstd - Type: String
+    :param chunk_rows: Optional, number of rows written at a time - Type: Int
     :return: None
     """
-    csv_buffer = StringIO()
-    dataframe.to_csv(csv_buffer, sep=",", index=False)
-    data = csv_buffer.getvalue()
+    full_file_name = file_prefix + file_name + file_extension
+    put_arguments = {"ContentType": extension_types[file_extension]}
+    if compression:
+        put_arguments["ContentEncoding"] = compression
+    parts = _csv_parts(dataframe, multipart_chunksize, chunk_rows, compression)
+
+    # Parts are held until there are more than multipart_threshold bytes of them, so
+    # that small files are still sent with a single put.
+    first_parts = []
+    size = 0
+    for part in parts:
+        first_parts.append(part)
+        size += len(part)
+        if size > multipart_threshold:
+            break
+    else:
+        with _measure("transfer_time"):
+            get_resource("s3").Object(bucket_name, full_file_name).put(
+                Body=b"".join(first_parts), **put_arguments)
+        return
 
-    save_to_s3(bucket_name, file_name, data, file_prefix, file_extension)
+    with _measure("transfer_time"):
+        _multipart_upload(bucket_name, full_file_name,
+                          itertools.chain(first_parts, parts), put_arguments)
 
 
+@_instrumented
 def save_to_s3(bucket_name, output_file_name, output_data, file_prefix="",
-               file_extension=".json"):
+               file_extension=".json", compression=None):
     """
     This function uploads a specified set of data to the s3 bucket under the given name.
+    Data larger than multipart_threshold is sent as a concurrent multipart upload.
     :param bucket_name: Name of the bucket you wish to upload too - Type: String.
     :param output_file_name: Name you want the file to be called on s3 - Type: String.
     :param output_data: The data that you wish to upload to s3 - Type: JSON.
+    (For .json, .parquet and .feather extensions a DataFrame may be given instead)
     :param file_prefix: Optional, run id to be added as file name prefix - Type: String
     :param file_extension: The file extension that the submitted file should have.
+    :param compression: Optional, compress the file with gzip or zstd. The file keeps
+    its name and is given a Content-Encoding - Type: String
     :return: None
     """
-    s3 = boto3.resource("s3", region_name=region)
+    s3 = get_resource("s3")
 
     full_file_name = output_file_name + file_extension
     if len(file_prefix) > 0:
         full_file_name = file_prefix + full_file_name
 
-    s3.Object(bucket_name, full_file_name).put(
-        Body=output_data, ContentType=extension_types[file_extension])
+    if file_extension in columnar_extensions:
+        output_data = _to_columnar(output_data, file_extension)
+    elif file_extension == ".json":
+        output_data = _to_json(output_data)
+
+    put_arguments = {"ContentType": extension_types[file_extension]}
+    if compression:
+        output_data = _compress(output_data, compression)
+        put_arguments["ContentEncoding"] = compression
 
+    if isinstance(output_data, str) and len(output_data) > multipart_threshold:
+        output_data = output_data.encode("UTF-8")
+    _add_to_call("bytes", len(output_data))
+    with _measure("transfer_time"):
+        if len(output_data) > multipart_threshold:
+            _multipart_upload(bucket_name, full_file_name,
+                              _split_parts(output_data, multipart_chunksize),
+                              put_arguments)
+        else:
+            s3.Object(bucket_name, full_file_name).put(Body=output_data,
+                                                       **put_arguments)
 
+
+@_instrumented
 def send_bpm_status(queue_url, module_name, status, run_id, current_step_num=None,
                     total_steps=0, survey="BMI"):
     """
@@ -283,27 +2059,13 @@ def send_bpm_status(queue_url, module_name, status, run_id, current_step_num=Non
     - Type: String.
     :return: None
     """
-    run_id = str(run_id)
-    output_message = "_Status_Message"
-    output_message_id = run_id + "_" + survey + output_message
-
-    bpm_message = {
-        "bpm_id": run_id,
-        "status": {
-            "current_step": current_step_num,
-            "total_steps": total_steps,
-            "step_name": module_name,
-            "message": {
-                "text": module_name + " stage: " + status
-            },
-            "state": status}
-    }
-
-    bpm_message = json.dumps(bpm_message)
+    bpm_message, output_message_id = _bpm_message(
+        module_name, status, run_id, current_step_num, total_steps, survey)
 
     send_sqs_message(queue_url, bpm_message, output_message_id, fifo=True)
 
 
+@_instrumented
 def send_sns_message(sns_topic_arn, module_name):
     """
     This method is responsible for sending a notification to the specified arn,
@@ -313,16 +2075,20 @@ def send_sns_message(sns_topic_arn, module_name):
                           Type: String.
     :return: Json string containing metadata about the message.
     """
-    sns = boto3.client("sns", region_name=region)
+    sns = get_client("sns")
     sns_message = {
         "success": True,
         "module": module_name,
         "message": "Completed " + module_name,
     }
 
-    return sns.publish(TargetArn=sns_topic_arn, Message=json.dumps(sns_message))
+    sns_message = json_codecs.dumps(sns_message)
+    _add_to_call("bytes", len(sns_message))
+    with _measure("transfer_time"):
+        return sns.publish(TargetArn=sns_topic_arn, Message=sns_message)
 
 
+@_instrumented
 def send_sns_message_with_anomalies(anomalies, sns_topic_arn, module_name):
     """
     This method is responsible for sending a notification to the specified arn,
@@ -333,7 +2099,7 @@ def send_sns_message_with_anomalies(anomalies, sns_topic_arn, module_name):
                           Type: String.
     :return: None
     """
-    sns = boto3.client("sns", region_name=region)
+    sns = get_client("sns")
     sns_message = {
         "success": True,
         "module": module_name,
@@ -341,9 +2107,13 @@ def send_sns_message_with_anomalies(anomalies, sns_topic_arn, module_name):
         "message": "Completed " + module_name,
     }
 
-    sns.publish(TargetArn=sns_topic_arn, Message=json.dumps(sns_message))
+    sns_message = json_codecs.dumps(sns_message)
+    _add_to_call("bytes", len(sns_message))
+    with _measure("transfer_time"):
+        sns.publish(TargetArn=sns_topic_arn, Message=sns_message)
 
 
+@_instrumented
 def send_sqs_message(queue_url, message, message_id="", fifo=True):
     """
     This method is responsible for sending data to the SQS queue.
@@ -355,17 +2125,382 @@ def send_sqs_message(queue_url, message, message_id="", fifo=True):
     """
     # MessageDeduplicationId is set to a random hash to overcome de-duplication,
     # otherwise modules could not be re-run in the space of 5 Minutes.
-    sqs = boto3.client("sqs", region_name=region)
+    sqs = get_client("sqs")
+    _add_to_call("bytes", len(message))
 
-    if fifo:
-        return sqs.send_message(
-            QueueUrl=queue_url,
-            MessageBody=message,
-            MessageGroupId=message_id,
-            MessageDeduplicationId=str(random.getrandbits(128))
-        )
+    with _measure("transfer_time"):
+        if fifo:
+            return sqs.send_message(
+                QueueUrl=queue_url,
+                MessageBody=message,
+                MessageGroupId=message_id,
+                MessageDeduplicationId=str(random.getrandbits(128))
+            )
+        else:
+            return sqs.send_message(
+                QueueUrl=queue_url,
+                MessageBody=message
+            )
+
+
+@_instrumented
+def send_sqs_messages(queue_url, messages, message_id="", fifo=True):
+    """
+    This method sends a number of messages to the SQS queue, packed into as few
+    send_message_batch calls as possible (10 messages and 256KB per call).
+    Messages keep their order, and failed messages are retried individually. On a
+    FIFO queue, if a message fails for good the later messages with the same
+    message_id are not sent, and are reported as failed with the code
+    PrecedingMessageFailed.
+    :param queue_url: The url of the SQS queue. - Type: String
+    :param messages: The messages/data you wish to send to the SQS queue. Either
+    strings, which are labelled with message_id, or (message, message_id) tuples.
+    A tuple may also give a de-duplication id, (message, message_id,
+    deduplication_id), so that sending it again (eg. after an error) is not
+    delivered twice by a FIFO queue - Type: List
+    :param message_id: The label of the records in the SQS queue - Type: String
+    :param fifo: Type of SQS queue - Type: Boolean
+    :return: The Successful and Failed entries, as send_message_batch returns them
+    - Type: Dict
+    """
+    sqs = get_client("sqs")
+    entries = []
+    for entry_id, message in enumerate(messages):
+        if isinstance(message, str):
+            message = (message, message_id)
+        entries.append(_sqs_entry(str(entry_id), message[0], message[1], fifo,
+                                  *message[2:]))
+
+    result = {"Successful": [], "Failed": []}
+    stopped_groups = set()
+    for batch in _pack_sqs_batches(entries):
+        batch_result = _send_sqs_batch(sqs, queue_url, batch, stopped_groups)
+        result["Successful"] += batch_result["Successful"]
+        result["Failed"] += batch_result["Failed"]
+    return result
+
+
+@_instrumented
+def stream_dataframe_from_s3(bucket_name, file_name, file_prefix="",
+                             file_extension=".json", chunk_size=1048576,
+                             batch_rows=10000, dtypes=None):
+    """
+    Given the name of the bucket and the filename(key), this function will
+    return contents of a file as a DataFrame, the same as read_dataframe_from_s3.
+    The JSON is parsed straight from the S3 stream in chunks and the DataFrame is built
+    in batches, so the raw bytes, the decoded text and the full list of records are
+    never held in memory at the same time. Compressed files are decompressed a chunk
+    at a time as they are read.
+    With a dict of dtypes, each batch is converted as it is built. The "compact" policy
+    needs to see whole columns to choose, so it is applied once all batches are read.
+    :param bucket_name: Name of the S3 bucket - Type: String
+    :param file_name: Name of the file - Type: String
+    :param file_prefix: Optional, run id to be added as file name prefix - Type: String
+    :param file_extension: The file extension that the submitted file should have.
+    :param chunk_size: Optional, number of bytes read per chunk - Type: Int
+    :param batch_rows: Optional, number of rows per DataFrame batch - Type: Int
+    :param dtypes: Optional, dtype of each column by name, eg. {"region": "category"},
+    or "compact" to use the smallest dtype that holds each column's values
+    - Type: Dict or String
+    :return: input_file: The JSON file in S3 loaded into dataframe table - Type: DataFrame
+    """
+    s3 = get_resource("s3")
+    full_file_name = file_name + file_extension
+    if len(file_prefix) > 0:
+        full_file_name = file_prefix + full_file_name
+    try:
+        with _measure("transfer_time"):
+            response = s3.Object(bucket_name, full_file_name).get()
+    except Exception as e:
+        raise Exception(f"Could not find s3://{bucket_name}/{full_file_name}.{type(e)}")
+
+    with _measure("parse_time"):
+        batches = list(_iter_dataframe_batches(
+            response["Body"], chunk_size, batch_rows,
+            _decompressor(response.get("ContentEncoding")),
+            None if dtypes == "compact" else dtypes))
+    if not batches:
+        dataframe = pd.DataFrame()
+    elif len(batches) == 1:
+        dataframe = batches[0]
     else:
-        return sqs.send_message(
-            QueueUrl=queue_url,
-            MessageBody=message
-        )
+        with _measure("build_time"):
+            dataframe = _concat_dataframes(batches)
+            _infer_columns(dataframe, batches)
+    if dtypes != "compact":
+        return dataframe
+    with _measure("build_time"):
+        return _convert_columns(dataframe.items(), dtypes)
+
+
+class SQSBatchSender:
+    """
+    Collects messages for an SQS queue and sends them in batches with
+    send_sqs_messages when flush is called. With flush_interval they are also sent
+    every flush_interval seconds from a background thread, so send never waits on SQS;
+    without it, send sends them itself once a full batch of 10 is waiting.
+    If a flush raises, its messages are kept and sent by the next flush, and on a FIFO
+    queue they keep their de-duplication ids, so any SQS had already accepted are not
+    delivered twice. Errors raised in the background thread are added to the errors
+    attribute.
+    close (or leaving a with block) sends anything still waiting, and must be called
+    before the lambda returns.
+    """
+    def __init__(self, queue_url, fifo=True, flush_interval=None):
+        """
+        :param queue_url: The url of the SQS queue. - Type: String
+        :param fifo: Type of SQS queue - Type: Boolean
+        :param flush_interval: Optional, seconds between background flushes. Without
+        it, messages are only sent by send (once 10 are waiting), flush and close
+        - Type: Float
+        """
+        self.queue_url = queue_url
+        self.fifo = fifo
+        self.failed = []
+        self.errors = []
+        self._messages = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        if flush_interval:
+            self._thread = threading.Thread(target=self._flush_periodically,
+                                            args=(flush_interval,), daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _flush_periodically(self, flush_interval):
+        """
+        Background thread, flushes every flush_interval seconds until closed. A flush
+        that raises is recorded in errors, and its messages are tried again by the
+        next one.
+        :param flush_interval: Seconds between flushes - Type: Float
+        :return: None
+        """
+        while not self._closed.wait(flush_interval):
+            try:
+                self.flush()
+            except Exception as error:
+                self.errors.append(error)
+
+    def _restore_messages(self, messages):
+        """
+        Puts back the messages taken by a flush that raised, ahead of any queued since.
+        Called with _lock held.
+        :param messages: The messages _take_messages returned - Type: List
+        :return: None
+        """
+        self._messages = messages + self._messages
+
+    def _take_messages(self):
+        """
+        Removes and returns the waiting messages. Called with _lock held.
+        :return: (message, message_id, deduplication_id) tuples - Type: List
+        """
+        messages = self._messages
+        self._messages = []
+        return messages
+
+    def close(self):
+        """
+        Stops the background thread, if there is one, and sends any waiting messages.
+        :return: The Successful and Failed entries - Type: Dict
+        """
+        self._closed.set()
+        if self._thread:
+            self._thread.join()
+        return self.flush()
+
+    def flush(self):
+        """
+        Sends all waiting messages. Messages that still failed after retrying are
+        also added to the failed attribute. If sending raises, the messages are put
+        back to be sent by the next flush, and the error is raised.
+        :return: The Successful and Failed entries - Type: Dict
+        """
+        # Flushes are serialised so batches leave in the order they were queued, but
+        # send is only blocked while the waiting messages are taken.
+        with self._flush_lock:
+            with self._lock:
+                messages = self._take_messages()
+            try:
+                result = send_sqs_messages(self.queue_url, messages, fifo=self.fifo)
+            except Exception:
+                with self._lock:
+                    self._restore_messages(messages)
+                raise
+            self.failed += result["Failed"]
+        return result
+
+    def send(self, message, message_id=""):
+        """
+        Queues a message to be sent in the next batch.
+        :param message: The message/data you wish to send to the SQS queue - Type: String
+        :param message_id: The label of the record in the SQS queue - Type: String
+        :return: None
+        """
+        with self._lock:
+            self._messages.append((message, message_id, str(random.getrandbits(128))))
+            full = len(self._messages) >= 10
+        if full and not self._thread:
+            self.flush()
+
+
+class BPMStatusReporter(SQSBatchSender):
+    """
+    Collects BPM status updates and sends them in batches, so that reporting a status
+    doesn't wait on SQS. Updates are sent when flush is called or every flush_interval
+    seconds from a background thread. If a module reports again before its last status
+    was sent, only the newer status is sent. Statuses from a flush that raised are
+    sent by the next flush, unless the module has reported again since.
+    close (or leaving a with block) sends anything still waiting, and must be called
+    before the lambda returns.
+    """
+    def __init__(self, queue_url, flush_interval=None):
+        """
+        :param queue_url: Name of the queue for the BMP layer - Type: String.
+        :param flush_interval: Optional, seconds between background flushes. Without
+        it, statuses are only sent by flush and close - Type: Float
+        """
+        self._statuses = {}
+        self._taken_statuses = {}
+        super().__init__(queue_url, fifo=True, flush_interval=flush_interval)
+
+    def _restore_messages(self, messages):
+        """
+        Puts back the statuses taken by a flush that raised, ahead of any reported
+        since. A status is dropped if its module has reported again in the meantime.
+        Called with _lock held.
+        :param messages: The messages _take_messages returned - Type: List
+        :return: None
+        """
+        taken = self._taken_statuses
+        super()._restore_messages(messages[:len(messages) - len(taken)])
+        self._statuses = {**{key: status for key, status in taken.items()
+                             if key not in self._statuses},
+                          **self._statuses}
+
+    def _take_messages(self):
+        """
+        Removes and returns the waiting statuses. Called with _lock held.
+        :return: (message, message_id, deduplication_id) tuples - Type: List
+        """
+        self._taken_statuses = self._statuses
+        self._statuses = {}
+        return super()._take_messages() + list(self._taken_statuses.values())
+
+    def report(self, module_name, status, run_id, current_step_num=None, total_steps=0,
+               survey="BMI"):
+        """
+        Queues a status update, replacing any update from the same module, run and
+        survey that has not been sent yet. Takes the same parameters as send_bpm_status.
+        :param module_name: Current module name - Type: String.
+        :param status: Current status of the module IN PROGRESS, FINISHED, FAILED
+        - Type: String.
+        :param run_id: run id of current run passed from the module - Type: String.
+        :param current_step_num: Number of the current module step - Type: Int or None.
+        :param total_steps: Total number of steps in the system. - Type: Int or None.
+        :param survey: Survey name for grouping status messages by survey and run_id
+        - Type: String.
+        :return: None
+        """
+        message = _bpm_message(module_name, status, run_id, current_step_num,
+                               total_steps, survey) + (str(random.getrandbits(128)),)
+        key = (str(run_id), survey, module_name)
+        with self._lock:
+            # Re-inserted so the update is sent in the order it was reported.
+            self._statuses.pop(key, None)
+            self._statuses[key] = message
+
+
+class Instrumentation:
+    """
+    Records the calls made to aws_functions while it is active and, when it ends, logs
+    them as one line tagged with the run_id and module, totalled for each function:
+    number of calls, errors, bytes, retries, and the time spent in all (wall_time), on
+    the network (transfer_time), parsing (parse_time) and building DataFrames
+    (build_time). Calls from every thread are included, eg. those of async_aws_functions.
+
+    Use as a context manager around the body of a lambda_handler, with the logger from
+    general_functions.get_logger.
+    """
+    def __init__(self, run_id, module_name, logger=None):
+        """
+        :param run_id: run id of current run passed from the module - Type: String
+        :param module_name: Current module name - Type: String
+        :param logger: Optional, logger to write the summary line to when the
+        Instrumentation ends - Type: Logger
+        """
+        self.run_id = run_id
+        self.module_name = module_name
+        self.logger = logger
+        self.calls = {}
+        self._lock = threading.Lock()
+        self._started = None
+        self._elapsed = 0.0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def record(self, call):
+        """
+        Adds a call's record to the totals. Used as the instrumentation hook.
+        :param call: The call's record, see add_instrumentation_hook - Type: Dict
+        :return: None
+        """
+        with self._lock:
+            totals = self.calls.get(call["call"])
+            if totals is None:
+                totals = self.calls[call["call"]] = {
+                    "count": 0, "errors": 0, "bytes": 0, "retries": 0,
+                    "wall_time": 0.0, "max_wall_time": 0.0, "transfer_time": 0.0,
+                    "parse_time": 0.0, "build_time": 0.0}
+            totals["count"] += 1
+            totals["errors"] += call["error"] is not None
+            totals["max_wall_time"] = max(totals["max_wall_time"], call["wall_time"])
+            for field in ("bytes", "retries", "wall_time", "transfer_time",
+                          "parse_time", "build_time"):
+                totals[field] += call[field]
+
+    def start(self):
+        """
+        Starts recording calls.
+        :return: None
+        """
+        self._started = time.perf_counter()
+        add_instrumentation_hook(self.record)
+
+    def stop(self):
+        """
+        Stops recording calls and logs the summary, if a logger was given.
+        :return: The summary - Type: Dict
+        """
+        remove_instrumentation_hook(self.record)
+        if self._started is not None:
+            self._elapsed += time.perf_counter() - self._started
+            self._started = None
+        summary = self.summary()
+        if self.logger:
+            self.logger.info(json.dumps(summary))
+        return summary
+
+    def summary(self):
+        """
+        Returns the calls recorded so far, totalled for each function.
+        :return: run_id, module, elapsed (seconds recorded for) and calls (the totals
+        for each function, by name) - Type: Dict
+        """
+        with self._lock:
+            calls = {name: {field: round(value, 6) for field, value in totals.items()}
+                     for name, totals in self.calls.items()}
+        return {"run_id": str(self.run_id), "module": self.module_name,
+                "elapsed": round(self._elapsed, 6), "calls": calls}
@@ -1,11 +1,79 @@
+import atexit
+import logging
 import math
+import queue
 import sys
+import threading
 import traceback
+from collections import OrderedDict
 
-import immutables
-from es_aws_functions import aws_functions
+from es_aws_functions import aws_functions, period_calendar
+from es_aws_functions.lazy_import import LazyModule
 
-from spp_logger import SPPLogger, SPPLoggerConfig
+# Imported on first use, so that eg. sas_round does not pay for pandas or the logger.
+immutables = LazyModule("immutables")
+np = LazyModule("numpy")
+pd = LazyModule("pandas")
+logging_handlers = LazyModule("logging.handlers")
+spp_logger = LazyModule("spp_logger")
+
+# Most loggers kept by get_logger, so that a warm lambda container running many runs
+# does not keep a logger for every one of them.
+logger_cache_size = 32
+
+# Loggers made by get_logger by their arguments, each with the QueueListener writing
+# its records if it is asynchronous, else None. Least recently used first.
+_loggers = OrderedDict()
+_loggers_lock = threading.Lock()
+
+
+def _make_asynchronous(logger):
+    """
+    Description: Moves the handlers of a logger onto a background thread, leaving a
+    handler on the logger that only queues each record for them.
+    So formatting the record and writing it to the stream happen off the calling thread.
+    :param logger: The logger - Type: Logger
+    :return listener: The listener running the handlers - Type: QueueListener
+    """
+    records = queue.Queue()
+    handlers = list(logger.handlers)
+    for handler in handlers:
+        logger.removeHandler(handler)
+    logger.addHandler(_QueueHandler(records))
+    listener = logging_handlers.QueueListener(records, *handlers,
+                                              respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def _make_synchronous(logger, listener):
+    """
+    Description: Undoes _make_asynchronous, putting the handlers back on the logger,
+    then writes out everything already queued and stops the listener's thread.
+    The logger still works if used afterwards, writing in the call to it.
+    :param logger: The logger - Type: Logger
+    :param listener: The listener returned by _make_asynchronous - Type: QueueListener
+    """
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    for handler in listener.handlers:
+        logger.addHandler(handler)
+    listener.stop()
+
+
+def _stop_listeners():
+    """
+    Description: Writes out everything queued by asynchronous loggers and stops their
+    threads. Run when the interpreter exits.
+    """
+    with _loggers_lock:
+        cached = [entry for entry in _loggers.values() if entry[1]]
+        _loggers.clear()
+    for logger, listener in cached:
+        _make_synchronous(logger, listener)
+
+
+atexit.register(_stop_listeners)
 
 
 def calculate_adjacent_periods(current_period, periodicity):
@@ -13,46 +81,61 @@ def calculate_adjacent_periods(current_period, periodicity):
     Description: This method uses periodicity to calculate
     what should be the adjacent periods for a row,
     Then uses a filter to confirm whether these periods exist for a record.
+    Answered from a precomputed period_calendar, so repeated lookups are cheap.
     :param current_period: int/str(either) - The current period to find the previous for
     :param periodicity: String - The periodicity of the survey we are imputing for:
     01 = monthly, 02 = annually, 03 = quarterly
     :return: previous_period: String - The previous period.
     """
-    monthly = "01"
-    annually = "02"
-    current_month = str(current_period)[4:]
-    current_year = str(current_period)[:4]
-    if periodicity == monthly:
-
-        last_month = int(float(current_month)) - int(periodicity)
-        last_year = int(current_year)
-        if last_month < 1:
-            last_year -= 1
-            last_month += 12
-        if last_month < 10:
-            last_month = "0" + str(last_month)
+    return period_calendar.get_calendar(periodicity).previous(current_period)
 
-        last_period = str(last_year) + str(last_month)
 
-    elif periodicity == annually:
+def calculate_adjacent_periods_vectorised(periods, periodicity, periods_back=1):
+    """
+    Description: Array version of calculate_adjacent_periods. Uses integer arithmetic
+    over the whole column at once, rather than string slicing for each period, and
+    gives the same results.
+    :param periods: The current periods to find the previous for
+    - Type: Series/ndarray/list of int/str(either)
+    :param periodicity: String - The periodicity of the survey we are imputing for:
+    01 = monthly, 02 = annually, 03 = quarterly
+    :param periods_back: Optional, how many periods to step back - Type: Int
+    :return: previous_periods: The previous periods, a Series (keeping the index) if
+    given a Series, else an ndarray - Type: Series/ndarray of String
+    """
+    monthly = "01"
+    annually = "02"
+    # A column holds few distinct periods, so the work is done once per distinct
+    # period and the results are then spread back over every row.
+    codes, unique_periods = pd.factorize(np.asarray(periods))
+    if (codes < 0).any():
+        raise ValueError("Periods must not be missing.")
+    current_periods = np.asarray(unique_periods).astype(np.int64)
+    if periodicity == annually:
 
-        last_period = str(int(current_period) - 1)
+        last_periods = current_periods - periods_back
 
-    else:  # quarterly(03)
+    else:
 
-        last_month = int(current_month) - 3
-        last_year = int(current_year)
-        if last_month < 1:
-            last_year -= 1
-            last_month += 4
-        if len(str(last_month)) < 2:
-            last_month = "0" + str(last_month)
-        last_period = str(last_year) + str(last_month)
+        # Monthly wraps from month 1 to 12, quarterly(03) wraps as 4 months.
+        step, wrap = (1, 12) if periodicity == monthly else (3, 4)
+        last_year = current_periods // 100
+        last_month = current_periods % 100
+        for _ in range(periods_back):
+            last_month = last_month - step
+            wrapped = last_month < 1
+            last_year = last_year - wrapped
+            last_month = last_month + wrap * wrapped
+        last_periods = last_year * 100 + last_month
 
-    return last_period
+    last_periods = last_periods.astype(str).astype(object)[codes]
+    if isinstance(periods, pd.Series):
+        return pd.Series(last_periods, index=periods.index, name=periods.name)
+    return last_periods
 
 
-def handle_exception(exception, module, run_id, context=None, bpm_queue_url=None):
+def handle_exception(exception, module, run_id, context=None, bpm_queue_url=None,
+                     status_reporter=None):
     """
     Description: Generates an error message from an exception.
     Returns an error message detailing exception type, arguments, and line number.
@@ -62,6 +145,8 @@ def handle_exception(exception, module, run_id, context=None, bpm_queue_url=None
     :param context: AWS Context object
     (has default so that moving to glue will not require lots of changes)
     :param bpm_queue_url: The url of the queue to send the BPM status message to.
+    :param status_reporter: Optional, BPMStatusReporter to queue the BPM status message
+    on instead of sending it straight away - Type: BPMStatusReporter
     :return error_message: Error message generated for exception - Type: String
     """
     exc_type, exc_obj, exc_tb = sys.exc_info()
@@ -73,7 +158,9 @@ def handle_exception(exception, module, run_id, context=None, bpm_queue_url=None
     error_message += " | Outer line number: " + str(exception.__traceback__.tb_lineno)
     error_message += " | Inner Line number: " + str(tb[1]) + " in: " + str(tb[0])
 
-    if bpm_queue_url:
+    if status_reporter:
+        status_reporter.report(module, "ERROR", run_id)
+    elif bpm_queue_url:
         status_msg = "ERROR"
         aws_functions.send_bpm_status(bpm_queue_url, module, status_msg, run_id)
 
@@ -92,17 +179,80 @@ def sas_round(num):
         return math.floor(num)
 
 
-def get_logger(survey, module_name, environment, run_id, log_level="INFO"):
+def sas_round_vectorised(values, decimals=0, inplace=False):
+    """
+    Description: Array version of sas_round, for rounding whole columns at once
+    instead of calling sas_round row by row with apply. NaN values stay NaN. A tiny
+    fuzz is applied first, as in SAS, so that 2.675 rounds to 2.68 despite being
+    stored as 2.67499... Values too large for the fuzz (over about 4.5 million) are
+    rounded exactly.
+    It differs from sas_round in two ways:
+    Halves are rounded away from zero as SAS does, so -2.5 becomes -3 (sas_round
+    gives -2).
+    Values within 5e-10 of a half are taken as the half, so 0.4999999999 becomes 1
+    and 1.4999999996 becomes 2 (sas_round gives 0 and 1).
+    :param values: Numbers to round - Type: ndarray/Series/DataFrame of Float
+    :param decimals: Optional, number of decimal places to round to - Type: Int
+    :param inplace: Optional, round a float64 ndarray in place rather than into a new
+    array - Type: Boolean
+    :return values: Rounded numbers, of the same type (and index/columns) as given
+    - Type: ndarray/Series/DataFrame of Float
+    """
+    if inplace and isinstance(values, np.ndarray) and values.dtype == np.float64:
+        array = values
+    else:
+        # The only full size allocation, every step below works in place on it.
+        array = np.array(values, dtype=np.float64)
+
+    factor = 10.0 ** decimals
+    negative = np.signbit(array)
+    np.abs(array, out=array)
+    if decimals:
+        np.multiply(array, factor, out=array)
+    # The fuzz rounds to 9 decimal places, which multiplies by 1e9. That is only exact
+    # below 2 ** 52 / 1e9 (about 4.5 million), and larger values have no digits that
+    # far down to fuzz, so they are left as they are.
+    fuzzed = array < 2 ** 52 / 1e9
+    np.multiply(array, 1e9, out=array, where=fuzzed)
+    np.rint(array, out=array, where=fuzzed)
+    np.divide(array, 1e9, out=array, where=fuzzed)
+    np.add(array, 0.5, out=array)
+    np.floor(array, out=array)
+    if decimals:
+        np.divide(array, factor, out=array)
+    np.negative(array, out=array, where=negative)
+    # Turns -0.0 (from eg. -0.4) into 0.0.
+    np.add(array, 0.0, out=array)
+
+    if isinstance(values, pd.DataFrame):
+        return pd.DataFrame(array, index=values.index, columns=values.columns)
+    if isinstance(values, pd.Series):
+        return pd.Series(array, index=values.index, name=values.name)
+    return array
+
+
+def get_logger(survey, module_name, environment, run_id, log_level="INFO",
+               asynchronous=False):
     """
     Description: Returns the spp-logger with loglevel set.
                  defaults to info.
+                 Loggers are kept and returned again when called with the same
+                 arguments, rather than building a new one each time.
     :param survey: Name of the current survey - Type: String
     :param module_name: Name of current module - Type: String
     :param environment: Name of the current environment - Type: String
     :param run_id: ID passed from BPM
     :param log_level: the log_level for the logger - Type: String (default=INFO)
+    :param asynchronous: Optional, format and write log records on a background thread
+    instead of in the call to the logger. Call flush_logs before the lambda returns, so
+    that nothing queued is lost when the container is frozen - Type: Boolean
     :return logger: The logger - Type: Logger
     """
+    key = (survey, module_name, environment, str(run_id), log_level, asynchronous)
+    with _loggers_lock:
+        if key in _loggers:
+            _loggers.move_to_end(key)
+            return _loggers[key][0]
 
     # set the logger context attributes
     main_context = immutables.Map(log_correlation_id=str(run_id),
@@ -110,7 +260,7 @@ def get_logger(survey, module_name, environment, run_id, log_level="INFO"):
                                   log_level=log_level
                                   )
     # set logger configs
-    config = SPPLoggerConfig(
+    config = spp_logger.SPPLoggerConfig(
         service="Results",
         component=module_name,
         environment=environment,
@@ -118,10 +268,66 @@ def get_logger(survey, module_name, environment, run_id, log_level="INFO"):
     )
     # set the logger with context and configs
     # Stream is configurable as any IO, it defaults to stdout
-    logger = SPPLogger(
+    logger = spp_logger.SPPLogger(
         name="my_logger",
         config=config,
         context=main_context,
         stream=sys.stdout,
     )
+    listener = _make_asynchronous(logger) if asynchronous else None
+
+    evicted = []
+    with _loggers_lock:
+        if key in _loggers:
+            # Made at the same time on another thread, use that one instead.
+            evicted.append((logger, listener))
+            logger = _loggers[key][0]
+        else:
+            _loggers[key] = (logger, listener)
+        while len(_loggers) > max(logger_cache_size, 1):
+            evicted.append(_loggers.popitem(last=False)[1])
+    for old_logger, old_listener in evicted:
+        if old_listener:
+            _make_synchronous(old_logger, old_listener)
     return logger
+
+
+def flush_logs():
+    """
+    Description: Waits until every record logged so far by asynchronous loggers from
+    get_logger has been written, then flushes their streams.
+    Does nothing for loggers that are not asynchronous, as they have already written.
+    """
+    with _loggers_lock:
+        listeners = [listener for _, listener in _loggers.values() if listener]
+    for listener in listeners:
+        listener.queue.join()
+        for handler in listener.handlers:
+            handler.flush()
+
+
+class _QueueHandler(logging.Handler):
+    """
+    Handler putting records on a queue for a QueueListener to format and write.
+    Unlike logging.handlers.QueueHandler, the record is not formatted before being
+    queued, only its message is built (so that later changes to the arguments are not
+    seen), leaving the formatting, exception text included, to the listener's thread.
+    """
+    def __init__(self, records):
+        """
+        :param records: The queue the listener reads - Type: Queue
+        """
+        super().__init__()
+        self.records = records
+
+    def emit(self, record):
+        """
+        Queues the record.
+        :param record: The record to queue - Type: LogRecord
+        """
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+            self.records.put_nowait(record)
+        except Exception:
+            self.handleError(record)
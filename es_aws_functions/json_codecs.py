@@ -0,0 +1,210 @@
+import importlib.util
+import json
+import threading
+from json.encoder import encode_basestring_ascii
+
+from es_aws_functions.lazy_import import LazyModule
+
+# Imported on first use, and only if installed.
+orjson = LazyModule("orjson")
+
+# Codecs by name, in order of preference. The first one that is installed is used,
+# unless another is chosen with set_codec.
+_codecs = {}
+_active = None
+_codecs_lock = threading.Lock()
+
+
+def _has_large_whole_float(data):
+    """
+    Checks parsed JSON for whole floats beyond 64 bit integers, which is what orjson
+    turns integers beyond 64 bits into.
+    :param data: The parsed data
+    :return: Whether there are any - Type: Boolean
+    """
+    stack = [data]
+    while stack:
+        value = stack.pop()
+        if type(value) is float:
+            if abs(value) >= 2 ** 63 and value.is_integer():
+                return True
+        elif type(value) is dict:
+            stack.extend(value.values())
+        elif type(value) is list:
+            stack.extend(value)
+    return False
+
+
+def _orjson_loads(data):
+    """
+    Parses JSON with orjson. Documents that orjson rejects but json accepts (NaN and
+    Infinity) are parsed with json instead, as are documents where orjson may have
+    turned integers beyond 64 bits into floats, so the result is always what
+    json.loads would give.
+    :param data: The JSON - Type: String or Bytes
+    :return: The parsed data
+    """
+    try:
+        parsed = orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return json.loads(data)
+    if _has_large_whole_float(parsed):
+        return json.loads(data)
+    return parsed
+
+
+def codec_names():
+    """
+    Returns the names of the registered codecs that are installed, in order of
+    preference.
+    :return: The names - Type: List
+    """
+    return [name for name, codec in _codecs.items() if codec.available()]
+
+
+def dumps(data):
+    """
+    Serialises data to JSON with the active codec. The output is exactly that of
+    json.dumps(data).
+    :param data: The data to serialise
+    :return: The JSON - Type: String
+    """
+    return get_codec().dumps(data)
+
+
+def dumps_dataframe(dataframe):
+    """
+    Serialises a DataFrame to a JSON array of records, exactly as
+    json.dumps(dataframe.to_dict("records")) would, without building the list of
+    dicts. Each column is encoded at once, numeric and boolean columns with a single
+    call to the encoder, and the rows are then joined from the encoded columns.
+    Missing values of nullable columns (pd.NA in Int64, boolean and string columns,
+    NaT in datetimes with a time zone) are written as null.
+    :param dataframe: The DataFrame - Type: DataFrame
+    :return: The JSON - Type: String
+    """
+    names = dataframe.columns.tolist()
+    if not names or len(set(names)) != len(names):
+        # Rows of empty dicts, or columns that to_dict would merge.
+        return dumps(dataframe.to_dict("records"))
+
+    columns = []
+    for _, column in dataframe.items():
+        values = column.tolist()
+        # Extension dtypes have an na_value; NaN (eg. in a category) is kept as NaN.
+        na_value = getattr(column.dtype, "na_value", 0.0)
+        if not isinstance(na_value, float) and column.hasnans:
+            values = [None if missing else value
+                      for value, missing in zip(values, column.isna().tolist())]
+        if column.dtype.kind in "biuf":
+            # Numbers, booleans and null never contain ", ".
+            columns.append(dumps(values)[1:-1].split(", ") if values else [])
+        else:
+            columns.append([encode_basestring_ascii(value) if type(value) is str
+                            else dumps(value) for value in values])
+    # Keys are encoded as json.dumps would encode them in a dict, eg. 1 as "1".
+    keys = [dumps({name: 0})[1:-4].replace("%", "%%") for name in names]
+    row = "{" + ", ".join(key + ": %s" for key in keys) + "}"
+    return "[" + ", ".join([row % values for values in zip(*columns)]) + "]"
+
+
+def get_codec():
+    """
+    Returns the active codec, the one chosen with set_codec or else the most preferred
+    codec that is installed.
+    :return: The codec - Type: JSONCodec
+    """
+    global _active
+    if _active is None:
+        with _codecs_lock:
+            if _active is None:
+                _active = next(codec for codec in _codecs.values()
+                               if codec.available())
+    return _active
+
+
+def loads(data):
+    """
+    Parses JSON with the active codec. The result is exactly that of json.loads(data).
+    :param data: The JSON - Type: String or Bytes
+    :return: The parsed data
+    """
+    return get_codec().loads(data)
+
+
+def register_codec(codec, preferred=True):
+    """
+    Adds a codec to the registry, replacing any of the same name. Its loads must give
+    the same result as json.loads, and its dumps (if it has one) exactly the same
+    string as json.dumps, as files written with one codec are read with another.
+    :param codec: The codec - Type: JSONCodec
+    :param preferred: Optional, prefer the codec over those already registered, else
+    use it only if none of them are installed - Type: Boolean
+    :return: None
+    """
+    global _active, _codecs
+    with _codecs_lock:
+        others = {name: other for name, other in _codecs.items() if name != codec.name}
+        if preferred:
+            _codecs = {codec.name: codec, **others}
+        else:
+            _codecs = {**others, codec.name: codec}
+        _active = None
+
+
+def set_codec(name=None):
+    """
+    Chooses the codec to use, eg. to compare them.
+    :param name: Name of a registered codec, or None to go back to the most preferred
+    codec that is installed - Type: String
+    :return: None
+    """
+    global _active
+    if name is None:
+        _active = None
+        return
+    if name not in _codecs:
+        raise ValueError(f"Unknown JSON codec {name}, expected one of "
+                         f"{', '.join(_codecs)}.")
+    if not _codecs[name].available():
+        raise ValueError(f"JSON codec {name} needs {_codecs[name].module}, which is not "
+                         f"installed.")
+    _active = _codecs[name]
+
+
+class JSONCodec:
+    """
+    A JSON implementation the library can parse and serialise data with.
+    """
+    def __init__(self, name, loads, dumps=None, module=None):
+        """
+        :param name: Name of the codec - Type: String
+        :param loads: Function parsing JSON, giving the same result as json.loads
+        - Type: Function
+        :param dumps: Optional, function serialising data to exactly the string
+        json.dumps gives. Without it json.dumps is used - Type: Function
+        :param module: Optional, module the codec needs, it is only used if the module
+        is installed - Type: String
+        """
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps or json.dumps
+        self.module = module
+
+    def available(self):
+        """
+        Checks that the module the codec needs is installed, without importing it.
+        :return: Whether the codec can be used - Type: Boolean
+        """
+        return self.module is None or importlib.util.find_spec(self.module) is not None
+
+    def __repr__(self):
+        return f"<JSONCodec {self.name}>"
+
+
+register_codec(JSONCodec("json", json.loads, json.dumps))
+# orjson's output differs from json.dumps (no spaces, raw UTF-8, 1e16 for 1e+16), so
+# only its parser is used. Once checked for integers beyond 64 bits it is no faster
+# than json.loads (see benchmarks/json_codecs.py), so it is only used if chosen with
+# set_codec.
+register_codec(JSONCodec("orjson", _orjson_loads, module="orjson"), preferred=False)
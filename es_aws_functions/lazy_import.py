@@ -0,0 +1,33 @@
+import importlib
+import threading
+
+_import_lock = threading.Lock()
+
+
+class LazyModule:
+    """
+    Stands in for a module, importing it the first time one of its attributes is used
+    rather than when this module is imported. Keeps heavy dependencies such as pandas
+    and boto3 off the cold start of lambdas that do not use them.
+    """
+    def __init__(self, name):
+        """
+        :param name: Full name of the module, eg. botocore.config - Type: String
+        """
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attribute):
+        """
+        Imports the module if it has not been already and returns its attribute.
+        :param attribute: Name of the attribute - Type: String
+        :return: The module's attribute
+        """
+        if self._module is None:
+            with _import_lock:
+                if self._module is None:
+                    self._module = importlib.import_module(self._name)
+        return getattr(self._module, attribute)
+
+    def __repr__(self):
+        return f"<LazyModule {self._name}>"
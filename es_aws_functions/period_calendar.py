@@ -0,0 +1,153 @@
+import functools
+
+# Years that each calendar precomputes. Periods outside them are still answered,
+# by calculating them as they are asked for.
+first_year = 1900
+last_year = 2100
+
+
+def _calculate_previous_period(current_period, periodicity):
+    """
+    Calculates the previous period, as calculate_adjacent_periods always has.
+    :param current_period: int/str(either) - The current period to find the previous for
+    :param periodicity: String - The periodicity of the survey:
+    01 = monthly, 02 = annually, 03 = quarterly
+    :return: previous_period: String - The previous period.
+    """
+    monthly = "01"
+    annually = "02"
+    current_month = str(current_period)[4:]
+    current_year = str(current_period)[:4]
+    if periodicity == monthly:
+
+        last_month = int(float(current_month)) - int(periodicity)
+        last_year = int(current_year)
+        if last_month < 1:
+            last_year -= 1
+            last_month += 12
+        if last_month < 10:
+            last_month = "0" + str(last_month)
+
+        last_period = str(last_year) + str(last_month)
+
+    elif periodicity == annually:
+
+        last_period = str(int(current_period) - 1)
+
+    else:  # quarterly(03)
+
+        last_month = int(current_month) - 3
+        last_year = int(current_year)
+        if last_month < 1:
+            last_year -= 1
+            last_month += 4
+        if len(str(last_month)) < 2:
+            last_month = "0" + str(last_month)
+        last_period = str(last_year) + str(last_month)
+
+    return last_period
+
+
+@functools.lru_cache(maxsize=None)
+def get_calendar(periodicity):
+    """
+    Returns the calendar for a periodicity, building it on first use. It is kept for
+    the life of the container, so warm invocations reuse it.
+    :param periodicity: String - The periodicity of the survey:
+    01 = monthly, 02 = annually, 03 = quarterly
+    :return: The calendar - Type: PeriodCalendar
+    """
+    return PeriodCalendar(periodicity)
+
+
+class PeriodCalendar:
+    """
+    Precomputed previous and next periods (Format YYYYMM) for one periodicity, so that
+    previous, next and N-back lookups are dictionary lookups instead of date
+    arithmetic on strings. N-back answers are memoised as they are asked for.
+    Periods step back exactly as calculate_adjacent_periods does.
+    """
+    def __init__(self, periodicity, first_year=first_year, last_year=last_year):
+        """
+        :param periodicity: String - The periodicity of the survey:
+        01 = monthly, 02 = annually, 03 = quarterly
+        :param first_year: Optional, first year to precompute - Type: Int
+        :param last_year: Optional, last year to precompute - Type: Int
+        """
+        self.periodicity = periodicity
+        self._previous = {}
+        self._next = {}
+        self._periods_back = {}
+        for year in range(first_year, last_year + 1):
+            for month in range(1, 13):
+                period = str(year * 100 + month)
+                previous_period = _calculate_previous_period(period, periodicity)
+                self._previous[period] = previous_period
+                # Where two periods step back to the same period, the one in the same
+                # year is taken as its next period.
+                if previous_period not in self._next or \
+                        previous_period[:4] == period[:4]:
+                    self._next[previous_period] = period
+
+    def next(self, period, periods_forward=1):
+        """
+        Returns the period that steps back to the given period.
+        :param period: int/str(either) - The period to find the next for
+        :param periods_forward: Optional, how many periods to step forward - Type: Int
+        :return: next_period: String - The next period.
+        """
+        next_period = str(period)
+        for _ in range(periods_forward):
+            if next_period not in self._next:
+                raise ValueError(f"No period after {next_period} in the calendar.")
+            next_period = self._next[next_period]
+        return next_period
+
+    def previous(self, period, periods_back=1):
+        """
+        Returns the period periods_back before the given period.
+        :param period: int/str(either) - The period to find the previous for
+        :param periods_back: Optional, how many periods to step back - Type: Int
+        :return: previous_period: String - The previous period.
+        """
+        # The type is part of the key, as eg. 201906 and 201906.0 are equal but are
+        # not always answered alike.
+        key = (type(period), period, periods_back)
+        previous_period = self._periods_back.get(key)
+        if previous_period is None:
+            previous_period = period
+            for _ in range(periods_back):
+                # Periods not in the calendar are calculated from the value as given,
+                # eg. a float, as calculate_adjacent_periods always has.
+                previous_period = self._previous.get(str(previous_period)) or \
+                    _calculate_previous_period(previous_period, self.periodicity)
+            previous_period = str(previous_period)
+            if len(self._periods_back) >= 100000:
+                self._periods_back.clear()
+            self._periods_back[key] = previous_period
+        return previous_period
+
+    def range(self, start_period, end_period):
+        """
+        Returns every period from start_period to end_period.
+        :param start_period: int/str(either) - The first period
+        :param end_period: int/str(either) - The last period
+        :return: periods: The periods, oldest first - Type: List of String
+        """
+        periods = [str(end_period)]
+        while periods[-1] != str(start_period):
+            if int(periods[-1]) < int(start_period):
+                raise ValueError(f"{start_period} is not a period before {end_period}.")
+            periods.append(self.previous(periods[-1]))
+        return periods[::-1]
+
+    def sequence(self, period, count):
+        """
+        Returns the count periods up to and including the given period, eg. the last
+        4 quarters.
+        :param period: int/str(either) - The latest period
+        :param count: Number of periods - Type: Int
+        :return: periods: The periods, oldest first - Type: List of String
+        """
+        return [self.previous(period, periods_back)
+                for periods_back in range(count - 1, -1, -1)]
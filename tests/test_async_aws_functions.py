@@ -0,0 +1,45 @@
+import asyncio
+import threading
+
+import pytest
+from es_aws_functions import async_aws_functions
+
+
+async def thread_name(result):
+    await asyncio.sleep(0)
+    return result, threading.current_thread().name
+
+
+async def fail():
+    raise ValueError("failed")
+
+
+def test_run_all_without_running_loop_uses_current_thread():
+    results = async_aws_functions.run_all(thread_name(1), thread_name(2))
+    assert results == [(1, threading.current_thread().name),
+                       (2, threading.current_thread().name)]
+
+
+def test_run_all_inside_running_loop_uses_another_thread():
+    async def handler():
+        return async_aws_functions.run_all(thread_name(1), thread_name(2))
+
+    loop = asyncio.new_event_loop()
+    try:
+        results = loop.run_until_complete(handler())
+    finally:
+        loop.close()
+    assert [result for result, _ in results] == [1, 2]
+    assert {name for _, name in results} != {threading.current_thread().name}
+
+
+def test_run_all_raises_first_exception():
+    with pytest.raises(ValueError, match="failed"):
+        async_aws_functions.run_all(thread_name(1), fail())
+
+
+def test_run_all_returns_exceptions():
+    results = async_aws_functions.run_all(thread_name(1), fail(),
+                                          return_exceptions=True)
+    assert results[0] == (1, threading.current_thread().name)
+    assert isinstance(results[1], ValueError)
@@ -0,0 +1,732 @@
+import json
+import os
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import moto
+import pandas as pd
+import pytest
+from es_aws_functions import aws_functions
+
+
+@pytest.fixture
+def clients(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    aws_functions.reset_clients()
+    yield
+    aws_functions.reset_clients()
+
+
+def test_get_client_reuses_client_for_service_and_region(clients):
+    client = aws_functions.get_client("s3")
+    assert aws_functions.get_client("s3", aws_functions.region) is client
+    assert aws_functions.get_client("s3", "eu-west-1") is not client
+    assert aws_functions.get_client("sqs") is not client
+    assert client.meta.region_name == aws_functions.region
+
+
+def test_get_resource_creates_one_resource_per_thread(clients):
+    resource = aws_functions.get_resource("s3")
+    assert aws_functions.get_resource("s3") is resource
+    assert aws_functions.get_resource("s3", "eu-west-1") is not resource
+    with ThreadPoolExecutor(1) as executor:
+        other = executor.submit(aws_functions.get_resource, "s3").result()
+        assert executor.submit(aws_functions.get_resource, "s3").result() is other
+    assert other is not resource
+
+
+def test_reset_clients_discards_clients_and_resources(clients):
+    client = aws_functions.get_client("s3")
+    resource = aws_functions.get_resource("s3")
+    with ThreadPoolExecutor(1) as executor:
+        other = executor.submit(aws_functions.get_resource, "s3").result()
+        aws_functions.reset_clients()
+        assert executor.submit(aws_functions.get_resource, "s3").result() is not other
+    assert aws_functions.get_client("s3") is not client
+    assert aws_functions.get_resource("s3") is not resource
+
+
+class FakeSQS:
+    """
+    Stands in for an SQS client. Each call to send_message_batch takes the next entry
+    of failures, a dict of message body to the failure's SenderFault, or an exception
+    to raise. Messages are delivered unless their de-duplication id was seen before.
+    Each call to receive_message returns the next list of messages in receives.
+    """
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.calls = 0
+        self.delivered = []
+        self.receives = []
+        self.waits = []
+        self._deduplication_ids = set()
+
+    def receive_message(self, **kwargs):
+        self.waits.append(kwargs.get("WaitTimeSeconds"))
+        return {"Messages": self.receives.pop(0) if self.receives else []}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        self.calls += 1
+        failures = self.failures.pop(0) if self.failures else {}
+        if isinstance(failures, Exception):
+            raise failures
+        response = {"Successful": [], "Failed": []}
+        for entry in Entries:
+            if entry["MessageBody"] in failures:
+                response["Failed"].append({
+                    "Id": entry["Id"], "SenderFault": failures[entry["MessageBody"]],
+                    "Code": "Error"})
+                continue
+            response["Successful"].append({"Id": entry["Id"]})
+            deduplication_id = entry.get("MessageDeduplicationId")
+            if deduplication_id not in self._deduplication_ids:
+                self.delivered.append(entry["MessageBody"])
+            if deduplication_id:
+                self._deduplication_ids.add(deduplication_id)
+        return response
+
+
+def build_times():
+    times = pd.Series([pd.Timestamp("2020-01-01"), pd.Timestamp("2020-01-02"), pd.NaT,
+                       pd.Timestamp("2020-01-02 10:00:00.5"),
+                       pd.Timestamp("2020-01-03 00:00:00.000001")])
+    return pd.DataFrame({"date": times,
+                         "london": times.dt.tz_localize("Europe/London"),
+                         "category": times.astype("category"),
+                         "elapsed": times - times.iloc[0],
+                         "text": ["a", "b,c", None, "d", "e"],
+                         "value": [1.5, 2.0, 3.25, None, 5.0]})
+
+
+@pytest.mark.parametrize("compression", [None, "gzip"])
+@pytest.mark.parametrize("chunk_rows", [1, 2, 3, 10])
+def test_csv_parts_match_whole_dataframe(compression, chunk_rows):
+    dataframe = build_times()
+    data = b"".join(aws_functions._csv_parts(dataframe, 7, chunk_rows, compression))
+    if compression:
+        data = aws_functions.gzip.decompress(data)
+    assert data == dataframe.to_csv(index=False).encode("UTF-8")
+
+
+def test_csv_parts_writes_header_of_empty_dataframe():
+    dataframe = build_times().iloc[:0]
+    data = b"".join(aws_functions._csv_parts(dataframe, 7, 2))
+    assert data == dataframe.to_csv(index=False).encode("UTF-8")
+
+
+@pytest.fixture
+def sqs(monkeypatch):
+    client = FakeSQS()
+    monkeypatch.setattr(aws_functions, "get_client", lambda *args, **kwargs: client)
+    monkeypatch.setattr(aws_functions.time, "sleep", lambda seconds: None)
+    return client
+
+
+def test_send_sqs_messages_resends_later_group_entries_after_failure(sqs):
+    sqs.failures = [{"a": False}]
+    result = aws_functions.send_sqs_messages("queue", ["a", "b", "c"])
+    assert sqs.delivered == ["b", "c", "a", "b", "c"]
+    assert [entry["Id"] for entry in result["Successful"]] == ["0", "1", "2"]
+    assert result["Failed"] == []
+
+
+def test_send_sqs_messages_only_retries_failed_entries_on_standard_queue(sqs):
+    sqs.failures = [{"a": False}]
+    result = aws_functions.send_sqs_messages("queue", ["a", "b", "c"], fifo=False)
+    assert sqs.delivered == ["b", "c", "a"]
+    assert len(result["Successful"]) == 3
+
+
+def test_send_sqs_messages_stops_group_after_failure(sqs):
+    sqs.failures = [{"g0": True}]
+    messages = [(f"g{index}", "g") for index in range(12)] + [("h0", "h")]
+    result = aws_functions.send_sqs_messages("queue", messages)
+    # The rest of the first batch was accepted, the second batch is held back.
+    assert sqs.delivered == [f"g{index}" for index in range(1, 10)] + ["h0"]
+    assert [(entry["Id"], entry["Code"]) for entry in result["Failed"]] == [
+        ("0", "Error"), ("10", "PrecedingMessageFailed"),
+        ("11", "PrecedingMessageFailed")]
+
+
+def test_send_sqs_messages_gives_up_after_retries(sqs):
+    sqs.failures = [{"a": False}] * (aws_functions.sqs_batch_retries + 1)
+    result = aws_functions.send_sqs_messages("queue", ["a", "b"])
+    assert sqs.calls == aws_functions.sqs_batch_retries + 1
+    assert [entry["Id"] for entry in result["Failed"]] == ["0"]
+    assert [entry["Id"] for entry in result["Successful"]] == ["1"]
+
+
+@pytest.mark.parametrize("flush_interval", [None, 60])
+def test_sqs_batch_sender_only_sends_full_batch_without_flush_interval(
+        sqs, flush_interval):
+    sender = aws_functions.SQSBatchSender("queue", flush_interval=flush_interval)
+    for index in range(10):
+        sender.send(str(index))
+    # With flush_interval, send leaves sending to the background thread.
+    assert sqs.calls == (0 if flush_interval else 1)
+    sender.close()
+    assert sqs.delivered == [str(index) for index in range(10)]
+
+
+def test_sqs_batch_sender_keeps_messages_when_flush_raises(sqs):
+    sqs.failures = [ConnectionError("down")]
+    sender = aws_functions.SQSBatchSender("queue")
+    sender.send("a")
+    sender.send("b")
+    with pytest.raises(ConnectionError):
+        sender.flush()
+    sender.send("c")
+    sender.close()
+    assert sqs.delivered == ["a", "b", "c"]
+
+
+def test_sqs_batch_sender_resend_is_not_delivered_twice(sqs, monkeypatch):
+    send_sqs_messages = aws_functions.send_sqs_messages
+
+    def send_then_raise(*args, **kwargs):
+        send_sqs_messages(*args, **kwargs)
+        raise TimeoutError("response lost")
+
+    monkeypatch.setattr(aws_functions, "send_sqs_messages", send_then_raise)
+    sender = aws_functions.SQSBatchSender("queue")
+    sender.send("a")
+    with pytest.raises(TimeoutError):
+        sender.flush()
+    monkeypatch.setattr(aws_functions, "send_sqs_messages", send_sqs_messages)
+    sender.close()
+    assert sqs.calls == 2
+    assert sqs.delivered == ["a"]
+
+
+def test_sqs_batch_sender_records_background_errors(sqs):
+    sqs.failures = [ConnectionError("down")]
+    sender = aws_functions.SQSBatchSender("queue", flush_interval=0.01)
+    sender.send("a")
+    deadline = time.monotonic() + 5
+    while not sqs.delivered and time.monotonic() < deadline:
+        time.sleep(0.01)
+    sender.close()
+    assert [type(error) for error in sender.errors] == [ConnectionError]
+    assert sqs.delivered == ["a"]
+
+
+def test_bpm_status_reporter_keeps_statuses_when_flush_raises(sqs):
+    sqs.failures = [ConnectionError("down")]
+    reporter = aws_functions.BPMStatusReporter("queue")
+    reporter.report("module_a", "IN PROGRESS", "1")
+    reporter.report("module_b", "IN PROGRESS", "1")
+    with pytest.raises(ConnectionError):
+        reporter.flush()
+    reporter.report("module_b", "FINISHED", "1")
+    reporter.close()
+    statuses = [(status["step_name"], status["state"]) for status in
+                (json.loads(message)["status"] for message in sqs.delivered)]
+    assert statuses == [("module_a", "IN PROGRESS"), ("module_b", "FINISHED")]
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    mock = getattr(moto, "mock_aws", None) or moto.mock_s3
+    with mock():
+        aws_functions.reset_clients()
+        client = aws_functions.get_client("s3")
+        client.create_bucket(Bucket="bucket", CreateBucketConfiguration={
+            "LocationConstraint": aws_functions.region})
+        yield client
+    aws_functions.reset_clients()
+
+
+@pytest.fixture
+def dataframe_cache(monkeypatch):
+    monkeypatch.setattr(aws_functions, "dataframe_cache_max_size", 1024 * 1024)
+    aws_functions.clear_dataframe_cache()
+    yield
+    aws_functions.clear_dataframe_cache()
+
+
+@pytest.mark.parametrize("dtype", ["category", "Int64", "string"])
+def test_cached_extension_columns_are_copied(s3, dataframe_cache, dtype):
+    aws_functions.save_to_s3("bucket", "data", json.dumps([{"a": 1}, {"a": 2}]))
+    dtypes = {"a": dtype}
+    first = aws_functions.read_dataframe_from_s3("bucket", "data", dtypes=dtypes)
+    first.loc[0, "a"] = first.loc[1, "a"]
+    second = aws_functions.read_dataframe_from_s3("bucket", "data", dtypes=dtypes)
+    assert aws_functions.get_dataframe_cache_stats()["hits"] == 1
+    assert second["a"].astype(str).tolist() == ["1", "2"]
+
+
+@pytest.mark.skipif(not aws_functions._copy_on_write(),
+                    reason="Cached DataFrames are deep copied without copy-on-write.")
+def test_cached_numpy_columns_are_read_only(s3, dataframe_cache):
+    aws_functions.save_to_s3("bucket", "data", json.dumps([{"a": 1}, {"a": 2}]))
+    aws_functions.read_dataframe_from_s3("bucket", "data")
+    dataframe = aws_functions.read_dataframe_from_s3("bucket", "data")
+    with pytest.raises(ValueError):
+        dataframe["a"].to_numpy()[0] = 3
+
+
+@pytest.mark.parametrize("copy_on_write", [True, False])
+def test_changing_cached_dataframe_does_not_change_cache(s3, dataframe_cache,
+                                                         monkeypatch, copy_on_write):
+    monkeypatch.setattr(aws_functions, "_copy_on_write", lambda: copy_on_write)
+    aws_functions.save_to_s3("bucket", "data", json.dumps(
+        [{"a": 1, "b": 1.5, "c": "x"}, {"a": 2, "b": 2.5, "c": "y"}]))
+    first = aws_functions.read_dataframe_from_s3("bucket", "data")
+    first["a"] = [3, 4]
+    first.loc[0, "b"] = 0.5
+    first["c"] = first["c"].str.upper()
+    second = aws_functions.read_dataframe_from_s3("bucket", "data")
+    assert aws_functions.get_dataframe_cache_stats()["hits"] == 1
+    assert second.to_dict("list") == {"a": [1, 2], "b": [1.5, 2.5], "c": ["x", "y"]}
+
+
+def test_cached_read_fails_if_file_changes_after_head(s3, dataframe_cache,
+                                                      monkeypatch):
+    aws_functions.save_to_s3("bucket", "data", json.dumps([{"a": 1}]))
+    head_object = s3.head_object
+
+    def head_then_change(**kwargs):
+        response = head_object(**kwargs)
+        aws_functions.save_to_s3("bucket", "data", json.dumps([{"a": 2}]))
+        return response
+
+    monkeypatch.setattr(s3, "head_object", head_then_change)
+    with pytest.raises(Exception, match="Could not find"):
+        aws_functions.read_dataframe_from_s3("bucket", "data")
+    assert aws_functions.get_dataframe_cache_stats()["entries"] == 0
+
+
+def parse_batches(document, chunk_size=4, batch_rows=3):
+    return list(aws_functions._iter_dataframe_batches(
+        BytesIO(document.encode("UTF-8")), chunk_size, batch_rows))
+
+
+@pytest.mark.parametrize("document", [
+    '[{"a": 1}, {"a": 2}, {"a": 3}, {"a": 4}] \n', "[ ]", '[{"a": "]"}]',
+    '{"a": [1, 2]}'])
+def test_iter_dataframe_batches_matches_json(document):
+    batches = parse_batches(document)
+    dataframe = pd.concat(batches, ignore_index=True) if batches else pd.DataFrame()
+    expected = pd.DataFrame(json.loads(document))
+    assert dataframe.to_dict("list") == expected.to_dict("list")
+
+
+@pytest.mark.parametrize("document", [
+    '[{"a": 1}]garbage', '[{"a": 1}] ]', '[{"a": 1},,{"a": 2}]', '[,{"a": 1}]',
+    '[{"a": 1},]', '[{"a": 1} {"a": 2}]', '[{"a": 1}', ""])
+def test_iter_dataframe_batches_rejects_invalid_json(document):
+    with pytest.raises(ValueError):
+        parse_batches(document)
+
+
+def test_stream_dataframe_from_s3_matches_read_dataframe_from_s3(s3):
+    records = [{"a": None, "b": 1}] * 3 + [{"a": 1, "b": "x"}] * 3 + [{"b": True}]
+    aws_functions.save_to_s3("bucket", "data", json.dumps(records))
+    dataframe = aws_functions.stream_dataframe_from_s3("bucket", "data", chunk_size=8,
+                                                       batch_rows=3)
+    expected = aws_functions.read_dataframe_from_s3("bucket", "data")
+    assert dataframe.dtypes.to_dict() == expected.dtypes.to_dict()
+    pd.testing.assert_frame_equal(dataframe, expected)
+
+
+def sqs_message(message_id, receipt_handle, group="group"):
+    return {"MessageId": message_id, "ReceiptHandle": receipt_handle, "Body": "{}",
+            "Attributes": {"MessageGroupId": group}}
+
+
+def test_get_sqs_messages_keeps_latest_receipt_handle(sqs):
+    sqs.receives = [[sqs_message("1", "first"), sqs_message("2", "other", "x")],
+                    [sqs_message("1", "second"), sqs_message("3", "third")]]
+    messages = aws_functions.get_sqs_messages("queue", 2, "group")["Messages"]
+    assert [(message["MessageId"], message["ReceiptHandle"])
+            for message in messages] == [("1", "second"), ("3", "third")]
+
+
+def test_get_sqs_messages_waits_until_timeout(sqs, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(aws_functions.time, "monotonic", lambda: now[0])
+
+    def receive_message(**kwargs):
+        sqs.waits.append(kwargs["WaitTimeSeconds"])
+        now[0] += kwargs["WaitTimeSeconds"] or 0.01
+        return {}
+
+    sqs.receive_message = receive_message
+    with pytest.raises(aws_functions.exception_classes.NoDataInQueueError):
+        aws_functions.get_sqs_messages("queue", 1, "group", timeout=20.4)
+    assert sqs.waits == [20, 1]
+
+
+def test_parse_json_dataframe_builds_columns_with_dtypes(monkeypatch):
+    built = []
+    build_dataframe = aws_functions._build_dataframe
+    monkeypatch.setattr(aws_functions, "_build_dataframe",
+                        lambda *args: built.append(args) or build_dataframe(*args))
+    data = json.dumps([{"a": "x", "b": 1}, {"a": "y", "b": 2}])
+    dataframe = aws_functions._parse_json_dataframe(data, ".json", {"a": "category"})
+    assert len(built) == 1
+    assert dataframe["a"].dtype == "category"
+    assert dataframe.attrs["dtype_report"]["a"]["to"] == "category"
+
+
+def test_read_many_dataframes_keeps_categories_when_concatenating(s3):
+    aws_functions.save_to_s3("bucket", "first", json.dumps([{"a": "x"}, {"a": "x"}]))
+    aws_functions.save_to_s3("bucket", "second", json.dumps([{"a": "y"}]))
+    dataframe = aws_functions.read_many_dataframes(
+        [("bucket", "first"), ("bucket", "second")], concatenate=True,
+        dtypes={"a": "category"})
+    assert dataframe["a"].dtype == "category"
+    assert dataframe["a"].tolist() == ["x", "x", "y"]
+    assert dataframe.attrs["dtype_report"]["a"]["bytes_before"] > 0
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+@pytest.mark.parametrize("threshold", [0, 100, 10 ** 6])
+def test_read_from_s3_decompresses_as_it_reads(s3, monkeypatch, compression,
+                                               threshold):
+    monkeypatch.setattr(aws_functions, "ranged_get_threshold", threshold)
+    monkeypatch.setattr(aws_functions, "decompress_chunksize", 64)
+    data = json.dumps([{"reference": index, "region": str(index % 7)}
+                       for index in range(500)])
+    aws_functions.save_to_s3("bucket", "data", data, compression=compression)
+    decompress = aws_functions._decompress_body
+    bodies = []
+    monkeypatch.setattr(aws_functions, "_decompress_body",
+                        lambda *args: bodies.append(args) or decompress(*args))
+    assert aws_functions.read_from_s3("bucket", "data") == data
+    assert len(bodies) == (2 if threshold == 100 else 1)
+
+
+@pytest.fixture
+def hooks():
+    added = []
+    yield added
+    for hook in added:
+        aws_functions.remove_instrumentation_hook(hook)
+
+
+def add_hook(hooks, hook):
+    hooks.append(hook)
+    aws_functions.add_instrumentation_hook(hook)
+
+
+def failing_hook(record):
+    raise KeyError("hook")
+
+
+def test_failing_hook_does_not_break_call(sqs, hooks):
+    records = []
+    add_hook(hooks, failing_hook)
+    add_hook(hooks, records.append)
+    with pytest.warns(RuntimeWarning, match="KeyError"):
+        result = aws_functions.send_sqs_messages("queue", ["a"])
+    assert len(result["Successful"]) == 1
+    assert [record["call"] for record in records] == ["send_sqs_messages"]
+
+
+def test_failing_hook_does_not_replace_error(sqs, hooks):
+    sqs.failures = [ConnectionError("down")]
+    add_hook(hooks, failing_hook)
+    with pytest.warns(RuntimeWarning), pytest.raises(ConnectionError):
+        aws_functions.send_sqs_messages("queue", ["a"])
+
+
+def test_failing_hook_does_not_break_call_when_warnings_are_errors(sqs, hooks):
+    add_hook(hooks, failing_hook)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert len(aws_functions.send_sqs_messages("queue", ["a"])["Successful"]) == 1
+
+
+def client_error(code):
+    return aws_functions.botocore_exceptions.ClientError(
+        {"Error": {"Code": code, "Message": code}}, "UploadPart")
+
+
+@pytest.fixture
+def multipart(s3, monkeypatch):
+    monkeypatch.setattr(aws_functions, "multipart_threshold", 6 * 1024 * 1024)
+    monkeypatch.setattr(aws_functions, "multipart_chunksize", 5 * 1024 * 1024)
+    monkeypatch.setattr(aws_functions.time, "sleep", lambda seconds: None)
+    upload_part = s3.upload_part
+    failures = {}
+
+    def failing_upload_part(**kwargs):
+        if failures.get(kwargs["PartNumber"], 0):
+            failures[kwargs["PartNumber"]] -= 1
+            raise client_error("InternalError")
+        return upload_part(**kwargs)
+
+    monkeypatch.setattr(s3, "upload_part", failing_upload_part)
+    return failures
+
+
+def test_multipart_upload_retries_failed_part(s3, multipart):
+    multipart[2] = aws_functions.multipart_part_retries
+    data = "x" * (11 * 1024 * 1024)
+    aws_functions.save_to_s3("bucket", "data", data)
+    assert aws_functions.read_from_s3("bucket", "data") == data
+
+
+def test_multipart_upload_aborts_when_part_keeps_failing(s3, multipart):
+    multipart[2] = aws_functions.multipart_part_retries + 1
+    with pytest.raises(Exception):
+        aws_functions.save_to_s3("bucket", "data", "x" * (11 * 1024 * 1024))
+    assert "Contents" not in s3.list_objects_v2(Bucket="bucket")
+    assert "Uploads" not in s3.list_multipart_uploads(Bucket="bucket")
+
+
+@pytest.fixture
+def disk_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(aws_functions, "disk_cache_directory", str(tmp_path))
+    aws_functions.clear_disk_cache()
+    yield tmp_path
+    aws_functions.clear_disk_cache()
+
+
+def test_disk_cache_uses_copy_while_file_is_unchanged(s3, disk_cache):
+    aws_functions.save_to_s3("bucket", "data", "[1]", compression="gzip")
+    assert aws_functions.read_from_s3("bucket", "data") == "[1]"
+    assert aws_functions.read_from_s3("bucket", "data") == "[1]"
+    aws_functions.save_to_s3("bucket", "data", "[2]")
+    assert aws_functions.read_from_s3("bucket", "data") == "[2]"
+    assert aws_functions.get_disk_cache_stats() == {"hits": 1, "misses": 2,
+                                                    "evictions": 0}
+
+
+def test_disk_cache_ignores_damaged_copy(s3, disk_cache):
+    aws_functions.save_to_s3("bucket", "data", "[1]")
+    aws_functions.read_from_s3("bucket", "data")
+    for path in disk_cache.iterdir():
+        path.write_bytes(b"not a header")
+    assert aws_functions.read_from_s3("bucket", "data") == "[1]"
+    assert aws_functions.get_disk_cache_stats()["misses"] == 2
+
+
+def test_disk_cache_evicts_least_recently_used(s3, disk_cache, monkeypatch):
+    monkeypatch.setattr(aws_functions, "disk_cache_max_size", 2500)
+    for name in ("first", "second", "third"):
+        aws_functions.save_to_s3("bucket", name, "x" * 1000)
+        aws_functions.read_from_s3("bucket", name)
+        time.sleep(0.01)
+    assert len(list(disk_cache.iterdir())) == 2
+    assert aws_functions.get_disk_cache_stats()["evictions"] == 1
+    aws_functions.read_from_s3("bucket", "first")
+    assert aws_functions.get_disk_cache_stats()["misses"] == 4
+
+
+def test_disk_cache_that_cannot_be_written_is_skipped(s3, disk_cache, monkeypatch):
+    monkeypatch.setattr(aws_functions, "disk_cache_directory", "/dev/null/cache")
+    aws_functions.save_to_s3("bucket", "data", "[1]")
+    assert aws_functions.read_from_s3("bucket", "data") == "[1]"
+    assert aws_functions.read_from_s3("bucket", "data") == "[1]"
+    assert aws_functions.get_disk_cache_stats()["misses"] == 2
+
+
+def test_disk_cache_copy_cleared_while_written_is_skipped(s3, disk_cache,
+                                                          monkeypatch):
+    os_replace = os.replace
+
+    def replace(source, destination):
+        # clear_disk_cache runs between the write and the rename.
+        aws_functions.clear_disk_cache()
+        return os_replace(source, destination)
+
+    monkeypatch.setattr(aws_functions.os, "replace", replace)
+    aws_functions.save_to_s3("bucket", "data", "[1]")
+    assert aws_functions.read_from_s3("bucket", "data") == "[1]"
+    assert list(disk_cache.iterdir()) == []
+
+
+@pytest.mark.parametrize("size", [0, 99, 100, 101, 1000])
+def test_ranged_get_reads_whole_object(s3, monkeypatch, size):
+    monkeypatch.setattr(aws_functions, "ranged_get_threshold", 100)
+    monkeypatch.setattr(aws_functions, "ranged_get_chunksize", 30)
+    data = "".join(str(index % 10) for index in range(size))
+    aws_functions.save_to_s3("bucket", "data", data)
+    assert aws_functions.read_from_s3("bucket", "data") == data
+
+
+def test_ranged_get_fails_if_object_changes_during_read(s3, monkeypatch):
+    monkeypatch.setattr(aws_functions, "ranged_get_threshold", 100)
+    monkeypatch.setattr(aws_functions, "ranged_get_chunksize", 30)
+    aws_functions.save_to_s3("bucket", "data", "x" * 1000)
+    get_object = s3.get_object
+
+    def get_then_change(**kwargs):
+        response = get_object(**kwargs)
+        if "IfMatch" not in kwargs:
+            aws_functions.save_to_s3("bucket", "data", "y" * 1000)
+        return response
+
+    monkeypatch.setattr(s3, "get_object", get_then_change)
+    with pytest.raises(Exception, match="Could not find"):
+        aws_functions.read_from_s3("bucket", "data")
+
+
+@pytest.fixture
+def queue(s3, monkeypatch):
+    monkeypatch.setattr(aws_functions, "sqs_inline_threshold", 1024 * 1024)
+    return aws_functions.get_client("sqs").create_queue(
+        QueueName="queue.fifo", Attributes={"FifoQueue": "true"})["QueueUrl"]
+
+
+def claim_check(queue, get, data, **kwargs):
+    """
+    Sends data with save_data and receives it with get, returning what get returned,
+    the message sent and the keys saved to the bucket.
+    """
+    aws_functions.save_data("bucket", "data", data, queue, "module", **kwargs)
+    sqs = aws_functions.get_client("sqs")
+    body = sqs.receive_message(QueueUrl=queue, VisibilityTimeout=0)["Messages"][0]["Body"]
+    kwargs.pop("compression", None)
+    received, receipt_handle = get(queue, "bucket", "default", "module", **kwargs)
+    sqs.delete_message(QueueUrl=queue, ReceiptHandle=receipt_handle)
+    keys = [item["Key"] for item in aws_functions.get_client("s3").list_objects_v2(
+        Bucket="bucket").get("Contents", [])]
+    return received, json.loads(body), keys
+
+
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_save_data_sends_small_payload_inline(queue, compression):
+    data = json.dumps([{"reference": index, "region": "é"} for index in range(100)])
+    received, message, keys = claim_check(queue, aws_functions.get_data, data,
+                                          compression=compression)
+    assert received == data
+    assert keys == []
+    assert message.get("content_encoding") == compression
+    if compression:
+        assert message["data"] != data
+
+    dataframe, message, keys = claim_check(queue, aws_functions.get_dataframe, data,
+                                           compression=compression)
+    pd.testing.assert_frame_equal(dataframe, pd.DataFrame(json.loads(data)))
+    assert keys == []
+
+
+@pytest.mark.parametrize("file_extension", [".parquet", ".feather"])
+def test_save_data_sends_small_columnar_payload_inline(queue, file_extension):
+    data = pd.DataFrame({"reference": [1, 2], "region": ["x", "y"],
+                         "value": [1.5, None]})
+    dataframe, message, keys = claim_check(queue, aws_functions.get_dataframe, data,
+                                           file_extension=file_extension)
+    pd.testing.assert_frame_equal(dataframe, data)
+    assert message["binary"] is True
+    assert keys == []
+
+    received, _, _ = claim_check(queue, aws_functions.get_data, data,
+                                 file_extension=file_extension)
+    pd.testing.assert_frame_equal(
+        aws_functions._from_columnar(received, file_extension), data)
+
+
+def test_save_data_saves_to_s3_if_message_would_be_too_large(queue):
+    # Under 256KB, but escaping its quotes in the message takes it over.
+    data = json.dumps(['"' * 50 for _ in range(2000)])
+    received, message, keys = claim_check(queue, aws_functions.get_data, data)
+    assert received == data
+    assert message == {"bucket": "bucket", "key": "data"}
+    assert keys == ["data.json"]
+
+    dataframe, _, _ = claim_check(queue, aws_functions.get_dataframe, data)
+    assert dataframe[0].tolist() == ['"' * 50] * 2000
+
+
+def count_requests(s3):
+    operations = []
+    s3.meta.events.register(
+        "before-call.s3", lambda model, **kwargs: operations.append(model.name))
+    return operations
+
+
+def test_delete_data_by_prefix_deletes_every_page(s3):
+    keys = [f"run/{index:04}.json" for index in range(1005)]
+    for key in keys + ["other/0.json", "run.json"]:
+        s3.put_object(Bucket="bucket", Key=key, Body=b"")
+    operations = count_requests(s3)
+    report = aws_functions.delete_data_by_prefix("bucket", "run/")
+    assert sorted(report["Deleted"]) == keys
+    assert report["Errors"] == []
+    assert operations.count("DeleteObjects") == 2
+    assert [item["Key"] for item in s3.list_objects_v2(Bucket="bucket")["Contents"]] \
+        == ["other/0.json", "run.json"]
+
+
+def test_delete_data_by_prefix_reports_keys_not_deleted(s3, monkeypatch):
+    for key in ("run/a.json", "run/b.json"):
+        s3.put_object(Bucket="bucket", Key=key, Body=b"")
+    error = {"Key": "run/b.json", "Code": "AccessDenied", "Message": "Access Denied"}
+
+    def delete_objects(Bucket, Delete):
+        return {"Deleted": [item for item in Delete["Objects"]
+                            if item["Key"] != error["Key"]],
+                "Errors": [error]}
+
+    monkeypatch.setattr(s3, "delete_objects", delete_objects)
+    assert aws_functions.delete_data_by_prefix("bucket", "run/") == {
+        "Deleted": ["run/a.json"], "Errors": [error]}
+
+
+def test_delete_data_by_prefix_refuses_empty_prefix(s3):
+    s3.put_object(Bucket="bucket", Key="a.json", Body=b"")
+    with pytest.raises(ValueError):
+        aws_functions.delete_data_by_prefix("bucket", "")
+    assert s3.list_objects_v2(Bucket="bucket")["KeyCount"] == 1
+
+
+@pytest.mark.parametrize("exists", [True, False])
+def test_delete_data_sends_one_request(s3, exists):
+    if exists:
+        aws_functions.save_to_s3("bucket", "data", "[1]", "run-")
+    operations = count_requests(s3)
+    assert aws_functions.delete_data("bucket", "data", "run-") == \
+        "Succesfully deleted file from S3 bucket."
+    assert operations == ["DeleteObject"]
+    assert s3.list_objects_v2(Bucket="bucket")["KeyCount"] == 0
+
+
+def columnar_dataframe():
+    return pd.DataFrame({
+        "reference": pd.Series([49900000001, 49900000002, 49900000003], dtype="int64"),
+        "small": pd.Series([1, 2, 3], dtype="int32"),
+        "value": [1.5, None, 2.5],
+        "count": pd.array([1, None, 3], dtype="Int64"),
+        "flag": [True, False, True],
+        "region": pd.Categorical(["x", "y", "x"]),
+        "name": ["a", "b", None],
+        "date": pd.to_datetime(["2019-01-01", "2019-02-01", None])})
+
+
+@pytest.mark.parametrize("file_extension", [".parquet", ".feather"])
+def test_columnar_round_trip_through_s3_keeps_dtypes(s3, file_extension):
+    dataframe = columnar_dataframe()
+    aws_functions.save_to_s3("bucket", "data", dataframe, "run-", file_extension)
+    assert s3.head_object(Bucket="bucket", Key="run-data" + file_extension)
+    pd.testing.assert_frame_equal(aws_functions.read_dataframe_from_s3(
+        "bucket", "data", "run-", file_extension), dataframe)
+
+
+@pytest.mark.parametrize("file_extension", [".parquet", ".feather"])
+def test_columnar_round_trip_through_save_data_keeps_dtypes(
+        queue, monkeypatch, file_extension):
+    monkeypatch.setattr(aws_functions, "sqs_inline_threshold", 0)
+    dataframe = columnar_dataframe()
+    received, message, keys = claim_check(queue, aws_functions.get_dataframe,
+                                          dataframe, file_extension=file_extension)
+    assert message == {"bucket": "bucket", "key": "data"}
+    assert keys == ["data" + file_extension]
+    pd.testing.assert_frame_equal(received, dataframe)
+
+
+@pytest.mark.parametrize("file_extension", [".parquet", ".feather"])
+def test_columnar_file_saved_from_json(s3, file_extension):
+    data = json.dumps([{"a": 1, "b": "x"}, {"a": 2, "b": None}])
+    aws_functions.save_to_s3("bucket", "data", data, file_extension=file_extension)
+    dataframe = aws_functions.read_dataframe_from_s3("bucket", "data",
+                                                     file_extension=file_extension)
+    pd.testing.assert_frame_equal(dataframe, pd.DataFrame(json.loads(data)))
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import pytest
+from es_aws_functions import general_functions
+
+months = {"01": range(1, 13), "02": range(1, 13), "03": (3, 6, 9, 12)}
+
+
+def build_periods(periodicity, as_int):
+    years = np.repeat(np.arange(1990, 2031), len(months[periodicity]))
+    periods = years * 100 + np.tile(list(months[periodicity]), 2031 - 1990)
+    return pd.Series(periods if as_int else periods.astype(str), index=periods[::-1])
+
+
+def scalar_periods(periods, periodicity, periods_back):
+    expected = periods
+    for _ in range(periods_back):
+        expected = expected.apply(general_functions.calculate_adjacent_periods,
+                                  periodicity=periodicity)
+    return expected
+
+
+@pytest.mark.parametrize("periodicity", ["01", "02", "03"])
+@pytest.mark.parametrize("as_int", [True, False])
+@pytest.mark.parametrize("periods_back", [1, 2, 5, 13])
+def test_calculate_adjacent_periods_vectorised_matches_scalar(periodicity, as_int,
+                                                              periods_back):
+    periods = build_periods(periodicity, as_int)
+    expected = scalar_periods(periods, periodicity, periods_back)
+    result = general_functions.calculate_adjacent_periods_vectorised(
+        periods, periodicity, periods_back)
+    assert list(result) == list(expected)
+    assert list(result.index) == list(periods.index)
+    assert all(isinstance(period, str) for period in result)
+
+
+@pytest.mark.parametrize("periodicity", ["01", "02", "03"])
+def test_calculate_adjacent_periods_vectorised_array_and_list(periodicity):
+    periods = build_periods(periodicity, True)
+    expected = list(scalar_periods(periods, periodicity, 1))
+    assert list(general_functions.calculate_adjacent_periods_vectorised(
+        periods.values, periodicity)) == expected
+    assert list(general_functions.calculate_adjacent_periods_vectorised(
+        list(periods), periodicity)) == expected
+
+
+def test_calculate_adjacent_periods_vectorised_rejects_missing():
+    with pytest.raises(ValueError):
+        general_functions.calculate_adjacent_periods_vectorised(
+            pd.Series(["201801", None]), "01")
+
+
+@pytest.mark.parametrize("high", [10 ** 7, 10 ** 12, 10 ** 17])
+def test_sas_round_vectorised_matches_sas_round(high):
+    values = pd.Series(np.random.RandomState(high % 997).randint(0, high, 100000) / 100)
+    expected = values.apply(general_functions.sas_round)
+    assert (general_functions.sas_round_vectorised(values) == expected).all()
+
+
+def test_sas_round_vectorised_large_and_special_values():
+    result = general_functions.sas_round_vectorised(
+        np.array([3437932970.5, 4503599.5, 1e300, -1e300, 2.0 ** 53, np.nan]))
+    assert list(result[:5]) == [3437932971.0, 4503600.0, 1e300, -1e300, 2.0 ** 53]
+    assert np.isnan(result[5])
+
+
+def test_sas_round_vectorised_fuzz_and_negatives():
+    result = general_functions.sas_round_vectorised(
+        np.array([2.675, -2.675, -2.5, -0.4, 0.5]), 2)
+    assert list(result) == [2.68, -2.68, -2.5, -0.4, 0.5]
+    assert list(general_functions.sas_round_vectorised(
+        np.array([-2.5, -0.4, 2.5]))) == [-3.0, 0.0, 3.0]
+    assert not np.signbit(general_functions.sas_round_vectorised(np.array([-0.4])))[0]
+
+
+@pytest.mark.parametrize("value, expected, sas_round_expected", [
+    # Negative halves are rounded away from zero.
+    (-2.5, -3.0, -2), (-0.5, -1.0, 0),
+    # Values within 5e-10 of a half are fuzzed to the half.
+    (0.4999999999, 1.0, 0), (1.4999999996, 2.0, 1), (-0.4999999999, -1.0, 0),
+    # Further from a half, both agree.
+    (0.4999999994, 0.0, 0), (1.499999999, 1.0, 1), (-2.6, -3.0, -3), (-2.4, -2.0, -2)])
+def test_sas_round_vectorised_differences_from_sas_round(value, expected,
+                                                         sas_round_expected):
+    assert general_functions.sas_round_vectorised(np.array([value]))[0] == expected
+    assert general_functions.sas_round(value) == sas_round_expected
+
+
+@pytest.fixture
+def loggers(monkeypatch):
+    monkeypatch.setattr(general_functions, "logger_cache_size", 2)
+    yield
+    for key in list(general_functions._loggers):
+        logger, listener = general_functions._loggers.pop(key)
+        if listener:
+            general_functions._make_synchronous(logger, listener)
+
+
+def test_get_logger_returns_cached_logger(loggers):
+    logger = general_functions.get_logger("BMI", "module", "dev", 1)
+    assert general_functions.get_logger("BMI", "module", "dev", "1") is logger
+    assert general_functions.get_logger("BMI", "module", "dev", 2) is not logger
+    assert general_functions.get_logger("BMI", "module", "dev", 1,
+                                        log_level="DEBUG") is not logger
+
+
+def test_get_logger_evicts_least_recently_used(loggers):
+    first = general_functions.get_logger("BMI", "first", "dev", 1, asynchronous=True)
+    general_functions.get_logger("BMI", "second", "dev", 1)
+    general_functions.get_logger("BMI", "third", "dev", 1)
+    assert len(general_functions._loggers) == 2
+    # The evicted logger still writes, synchronously.
+    assert not any(isinstance(handler, general_functions._QueueHandler)
+                   for handler in first.handlers)
+    assert general_functions.get_logger("BMI", "first", "dev", 1,
+                                        asynchronous=True) is not first
+
+
+def test_asynchronous_logger_writes_by_flush_logs(loggers, capsys):
+    logger = general_functions.get_logger("BMI", "module", "dev", 1,
+                                          asynchronous=True)
+    values = ["before"]
+    logger.info("%s", values)
+    values[0] = "after"
+    general_functions.flush_logs()
+    output = capsys.readouterr().out
+    # The message is built when logged, not when written.
+    assert "['before']" in output
+    assert "after" not in output
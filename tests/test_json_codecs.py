@@ -0,0 +1,54 @@
+import json
+
+import pandas as pd
+import pytest
+from es_aws_functions import json_codecs
+
+
+@pytest.fixture(params=json_codecs.codec_names())
+def codec(request):
+    json_codecs.set_codec(request.param)
+    yield request.param
+    json_codecs.set_codec()
+
+
+@pytest.mark.parametrize("document", [
+    '[{"a": 1, "b": "x", "c": 1.5, "d": null, "e": true}]',
+    "18446744073709551615", "18446744073709551616", "-9223372036854775809",
+    '{"a": 123456789012345678901234567890}', '[0.12345678901234567890123]',
+    '"12345678901234567890123"', "[NaN, Infinity]",
+    "[1e19, -9.3e18, 9223372036854775807.5]"])
+def test_loads_matches_json(codec, document):
+    expected = json.loads(document)
+    for data in (document, document.encode("UTF-8")):
+        # Compared as JSON, as NaN != NaN and 1e19 == 10000000000000000000.
+        assert json.dumps(json_codecs.loads(data)) == json.dumps(expected)
+
+
+def test_dumps_dataframe_matches_json(codec):
+    dataframe = pd.DataFrame({"reference": [49900000001, 49900000002],
+                              "region": ["1", "é"],
+                              "value": [1.5, float("nan")],
+                              "flag": [True, False],
+                              "other": [None, "x"]})
+    expected = json.dumps(dataframe.to_dict("records"))
+    assert json_codecs.dumps_dataframe(dataframe) == expected
+
+
+def test_dumps_dataframe_writes_missing_nullable_values_as_null(codec):
+    dataframe = pd.DataFrame({"int": pd.array([1, None], dtype="Int64"),
+                              "bool": pd.array([True, None], dtype="boolean"),
+                              "text": pd.array(["x", None], dtype="string")})
+    assert json.loads(json_codecs.dumps_dataframe(dataframe)) == [
+        {"int": 1, "bool": True, "text": "x"},
+        {"int": None, "bool": None, "text": None}]
+
+
+def test_json_is_preferred():
+    assert json_codecs.codec_names()[0] == "json"
+    assert json_codecs.get_codec().name == "json"
+
+
+def test_set_codec_rejects_unknown_codec():
+    with pytest.raises(ValueError):
+        json_codecs.set_codec("unknown")
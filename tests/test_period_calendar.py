@@ -0,0 +1,117 @@
+import pytest
+from es_aws_functions import general_functions, period_calendar
+
+
+def baseline_previous_period(current_period, periodicity):
+    # calculate_adjacent_periods as it was before the calendar, which the calendar
+    # must answer exactly as.
+    monthly = "01"
+    annually = "02"
+    current_month = str(current_period)[4:]
+    current_year = str(current_period)[:4]
+    if periodicity == monthly:
+
+        last_month = int(float(current_month)) - int(periodicity)
+        last_year = int(current_year)
+        if last_month < 1:
+            last_year -= 1
+            last_month += 12
+        if last_month < 10:
+            last_month = "0" + str(last_month)
+
+        last_period = str(last_year) + str(last_month)
+
+    elif periodicity == annually:
+
+        last_period = str(int(current_period) - 1)
+
+    else:  # quarterly(03)
+
+        last_month = int(current_month) - 3
+        last_year = int(current_year)
+        if last_month < 1:
+            last_year -= 1
+            last_month += 4
+        if len(str(last_month)) < 2:
+            last_month = "0" + str(last_month)
+        last_period = str(last_year) + str(last_month)
+
+    return last_period
+
+
+def outcome(function, *args):
+    try:
+        return function(*args)
+    except Exception as e:
+        return type(e)
+
+
+# Years inside the precomputed calendar and either side of it.
+periods = [year * 100 + month for year in (1899, 1900, 2019, 2100, 2101)
+           for month in range(1, 13)]
+
+
+@pytest.mark.parametrize("periodicity", ["01", "02", "03"])
+@pytest.mark.parametrize("as_type", [int, str, float])
+def test_calculate_adjacent_periods_matches_baseline(periodicity, as_type):
+    for period in periods:
+        period = as_type(period)
+        expected = outcome(baseline_previous_period, period, periodicity)
+        assert outcome(general_functions.calculate_adjacent_periods, period,
+                       periodicity) == expected
+
+
+@pytest.mark.parametrize("periodicity", ["01", "02", "03"])
+def test_previous_answers_equal_periods_of_different_types_separately(periodicity):
+    calendar = period_calendar.PeriodCalendar(periodicity)
+    for as_type in (int, float, str, float, int):
+        assert outcome(calendar.previous, as_type(201906)) == \
+            outcome(baseline_previous_period, as_type(201906), periodicity)
+
+
+def test_previous_steps_back_several_periods():
+    calendar = period_calendar.get_calendar("01")
+    assert calendar.previous("201903", 4) == "201811"
+    assert calendar.previous(201903, 0) == "201903"
+    assert calendar.previous("210102", 3) == "210011"
+
+
+@pytest.mark.parametrize("periodicity, months",
+                         [("01", range(1, 13)), ("02", range(2, 13))])
+def test_next_undoes_previous(periodicity, months):
+    calendar = period_calendar.get_calendar(periodicity)
+    for year in (1901, 2019, 2100):
+        for month in months:
+            period = str(year * 100 + month)
+            assert calendar.next(calendar.previous(period)) == period
+
+
+def test_next_steps_forward():
+    assert period_calendar.get_calendar("01").next(201811, 3) == "201902"
+    assert period_calendar.get_calendar("03").next("201901", 2) == "201907"
+    assert period_calendar.get_calendar("02").next("201905") == "201906"
+
+
+def test_next_rejects_period_outside_calendar():
+    with pytest.raises(ValueError):
+        period_calendar.get_calendar("01").next("220012")
+
+
+@pytest.mark.parametrize("periodicity, start, end, expected", [
+    ("01", "201811", "201902", ["201811", "201812", "201901", "201902"]),
+    ("01", 201812, 201812, ["201812"]),
+    ("02", "201905", "201905", ["201905"])])
+def test_range(periodicity, start, end, expected):
+    assert period_calendar.get_calendar(periodicity).range(start, end) == expected
+
+
+def test_range_rejects_start_after_end():
+    with pytest.raises(ValueError):
+        period_calendar.get_calendar("01").range("201902", "201811")
+
+
+def test_sequence():
+    calendar = period_calendar.get_calendar("01")
+    assert calendar.sequence(201902, 4) == ["201811", "201812", "201901", "201902"]
+    assert calendar.sequence("201903", 1) == ["201903"]
+    assert calendar.sequence("201903", 0) == []